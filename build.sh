@@ -1,9 +1,7 @@
 #!/bin/bash
 
-mkdir -p 'test/build/bin'
+mkdir -p 'test/build/elf'
 
 for f in "$1"/*.riscv; do
-    filename=$(basename -- "$f")
-    filename="${filename%.*}"
-    riscv64-linux-gnu-objcopy -O binary "$f" "test/build/bin/${filename}.bin"
-done
\ No newline at end of file
+    cp "$f" "test/build/elf/"
+done
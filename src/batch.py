@@ -0,0 +1,424 @@
+from collections.abc import Callable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import decoder
+from memory import PAGE_BITS, PAGE_SIZE, PAGE_MASK
+from simulator import Simulator
+from utils import MASK_32
+
+# guest pages get a column in the page table on first use; every lane starts on one shared copy of each page,
+# in a pool of page rows, and gets a private row on its first store to the page
+_ADDRESS_PAGES = 1 << (32 - PAGE_BITS)
+_INITIAL_PAGES = 16
+_WIDTHS = {1: 'u1', 2: '<u2', 4: '<u4'}
+
+# runs one instruction for an array of lanes, see BatchMachine._step
+_Step = Callable[..., tuple | None]
+
+def _signed(a):
+    return a.view(np.int32)
+
+def _div(a, b):
+    a, b = _signed(a).astype(np.int64), _signed(b).astype(np.int64)
+    zero = b == 0
+    quotient = np.abs(a) // np.where(zero, 1, np.abs(b)) * np.sign(a) * np.sign(b)
+    # -2**31 / -1 overflows to 2**31, which wraps back to -2**31 like the reference
+    return np.where(zero, -1, quotient).astype(np.uint32)
+
+def _rem(a, b):
+    a, b = _signed(a).astype(np.int64), _signed(b).astype(np.int64)
+    zero = b == 0
+    # truncating, so the sign follows the dividend as in rtype_helper.rem
+    remainder = np.abs(a) % np.where(zero, 1, np.abs(b)) * np.sign(a)
+    return np.where(zero, a, remainder).astype(np.uint32)
+
+def _divu(a, b):
+    zero = b == 0
+    return np.where(zero, MASK_32, a // np.where(zero, 1, b)).astype(np.uint32)
+
+def _remu(a, b):
+    zero = b == 0
+    return np.where(zero, a, a % np.where(zero, 1, b)).astype(np.uint32)
+
+def _mulh(a, b):
+    return ((_signed(a).astype(np.int64) * _signed(b).astype(np.int64)) >> 32).astype(np.uint32)
+
+def _mulhsu(a, b):
+    return ((_signed(a).astype(np.int64) * b.astype(np.int64)) >> 32).astype(np.uint32)
+
+def _mulhu(a, b):
+    return ((a.astype(np.uint64) * b.astype(np.uint64)) >> 32).astype(np.uint32)
+
+# vectorized counterparts of rtype_helper, with the same div/rem edge cases
+_RTYPE = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'sll': lambda a, b: a << (b & 0x1f),
+    'srl': lambda a, b: a >> (b & 0x1f),
+    'sra': lambda a, b: (_signed(a) >> _signed(b & 0x1f)).view(np.uint32),
+    'slt': lambda a, b: (_signed(a) < _signed(b)).astype(np.uint32),
+    'sltu': lambda a, b: (a < b).astype(np.uint32),
+    'xor': lambda a, b: a ^ b,
+    'or': lambda a, b: a | b,
+    'and': lambda a, b: a & b,
+    'mul': lambda a, b: a * b,
+    'mulh': _mulh,
+    'mulhsu': _mulhsu,
+    'mulhu': _mulhu,
+    'div': _div,
+    'divu': _divu,
+    'rem': _rem,
+    'remu': _remu,
+}
+
+_ITYPE = {
+    'addi': lambda a, imm: a + np.uint32(imm & MASK_32),
+    'slti': lambda a, imm: (_signed(a) < np.int32(imm)).astype(np.uint32),
+    'sltiu': lambda a, imm: (a < np.uint32(imm & MASK_32)).astype(np.uint32),
+    'xori': lambda a, imm: a ^ np.uint32(imm & MASK_32),
+    'ori': lambda a, imm: a | np.uint32(imm & MASK_32),
+    'andi': lambda a, imm: a & np.uint32(imm & MASK_32),
+    'slli': lambda a, imm: a << np.uint32(imm & 0x1f),
+    'srli': lambda a, imm: a >> np.uint32(imm & 0x1f),
+    'srai': lambda a, imm: (_signed(a) >> np.int32(imm & 0x1f)).view(np.uint32),
+}
+
+_BRANCHES = {
+    'beq': lambda a, b: a == b,
+    'bne': lambda a, b: a != b,
+    'blt': lambda a, b: _signed(a) < _signed(b),
+    'bge': lambda a, b: _signed(a) >= _signed(b),
+    'bltu': lambda a, b: a < b,
+    'bgeu': lambda a, b: a >= b,
+}
+
+# width and sign bit of each load
+_LOADS = {'lb': (1, 0x80), 'lh': (2, 0x8000), 'lw': (4, 0), 'lbu': (1, 0), 'lhu': (2, 0)}
+_STORES = {'sb': 1, 'sh': 2, 'sw': 4}
+_COUNTERS = (decoder.CSR_CYCLE, decoder.CSR_TIME, decoder.CSR_INSTRET, decoder.CSR_CYCLEH, decoder.CSR_TIMEH,
+             decoder.CSR_INSTRETH)
+
+class BatchMachine:
+    size: int
+    regs: object
+    pc: object
+    clock: object
+    active: object
+    finished: object
+    errors: dict[int, str]
+    _base: Simulator
+    # guest page -> column of _slots, -1 until the batch touches it
+    _page_map: object
+    _columns: int
+    # (lane, column) -> row of _pool holding that lane's copy of the page
+    _slots: object
+    _pool: object
+    _rows: int
+    # per pool row, whether it is the copy shared by the lanes that did not write to the page
+    _shared: object
+    _start_clock: int
+    _group_steps: int
+    _code_start: int
+    _code_end: int
+    _decoder: decoder.Decoder
+    _steps: dict[int, _Step]
+
+    def __init__(self, base: Simulator, size: int):
+        # `size` copies of the machine state of `base`; its code must not change while the batch runs
+        if np is None:
+            raise Exception('The batch engine needs NumPy (pip install numpy)')
+        bank = base.register_bank
+        self.size = size
+        self._base = base
+        self.regs = np.tile(np.array(bank.regs, dtype=np.uint32), (size, 1))
+        self.pc = np.full(size, bank.pc, dtype=np.uint32)
+        self.clock = np.full(size, base.clock, dtype=np.int64)
+        self._start_clock = base.clock
+        self._group_steps = 0
+        self.active = np.full(size, not base.finished)
+        self.finished = np.full(size, base.finished)
+        self.errors = {}
+        self._page_map = np.full(_ADDRESS_PAGES, -1, dtype=np.int64)
+        self._columns = 0
+        self._slots = np.zeros((size, _INITIAL_PAGES), dtype=np.int64)
+        self._pool = np.zeros((_INITIAL_PAGES, PAGE_SIZE), dtype=np.uint8)
+        self._rows = 0
+        self._shared = np.zeros(_INITIAL_PAGES, dtype=bool)
+        self._code_start, self._code_end = base.code_range()
+        self._decoder = base.decoder
+        self._steps = {}
+        pages = [page for page, view in base.memory.pages() if np.frombuffer(view, dtype=np.uint8).any()]
+        self._map_pages(np.array(pages + [bank.regs[2] >> PAGE_BITS], dtype=np.int64))
+
+    def _allocate(self, count: int):
+        start, end = self._rows, self._rows + count
+        if end > self._pool.shape[0]:
+            capacity = max(end, 2 * self._pool.shape[0])
+            pool = np.zeros((capacity, PAGE_SIZE), dtype=np.uint8)
+            pool[:start] = self._pool[:start]
+            shared = np.zeros(capacity, dtype=bool)
+            shared[:start] = self._shared[:start]
+            self._pool, self._shared = pool, shared
+        self._rows = end
+        return np.arange(start, end, dtype=np.int64)
+
+    def _map_pages(self, pages) -> None:
+        pages = np.unique(pages)
+        pages = pages[self._page_map[pages] < 0]
+        if not pages.size:
+            return
+        start, end = self._columns, self._columns + pages.size
+        if end > self._slots.shape[1]:
+            slots = np.zeros((self.size, max(end, 2 * self._slots.shape[1])), dtype=np.int64)
+            slots[:, :start] = self._slots[:, :start]
+            self._slots = slots
+        rows = self._allocate(pages.size)
+        for page, row in zip(pages.tolist(), rows.tolist()):
+            data = np.frombuffer(self._base.memory.page_data(page), dtype=np.uint8)
+            if data.any():
+                self._pool[row] = data
+        self._shared[rows] = True
+        self._page_map[pages] = np.arange(start, end)
+        self._slots[:, start:end] = rows
+        self._columns = end
+
+    def _columns_of(self, addresses):
+        columns = self._page_map[addresses >> PAGE_BITS]
+        missing = columns < 0
+        if missing.any():
+            self._map_pages(addresses[missing].astype(np.int64) >> PAGE_BITS)
+            columns = self._page_map[addresses >> PAGE_BITS]
+        return columns
+
+    def _locate(self, lanes, addresses):
+        # offsets into the flattened pool of the bytes each lane sees at its address
+        return self._slots[lanes, self._columns_of(addresses)] * PAGE_SIZE + (addresses & PAGE_MASK)
+
+    def _own(self, lanes, addresses):
+        # like _locate, after giving each lane (unique in `lanes`) a private copy of the page it writes
+        columns = self._columns_of(addresses)
+        rows = self._slots[lanes, columns]
+        shared = self._shared[rows]
+        if shared.any():
+            copies = self._allocate(int(shared.sum()))
+            self._pool[copies] = self._pool[rows[shared]]
+            self._slots[lanes[shared], columns[shared]] = copies
+            rows[shared] = copies
+        return rows * PAGE_SIZE + (addresses & PAGE_MASK)
+
+    def _view(self, dtype: str):
+        return self._pool.reshape(-1).view(dtype)
+
+    def write(self, instance: int, address: int, data: bytes) -> None:
+        lane = np.array([instance])
+        position = 0
+        while position < len(data):
+            current = (address + position) & MASK_32
+            chunk = min(len(data) - position, PAGE_SIZE - (current & PAGE_MASK))
+            offset = int(self._own(lane, np.array([current], dtype=np.uint32))[0])
+            self._view('u1')[offset:offset + chunk] = np.frombuffer(data[position:position + chunk], dtype=np.uint8)
+            position += chunk
+
+    def read(self, instance: int, address: int, size: int) -> bytes:
+        lane = np.array([instance])
+        data = b''
+        while len(data) < size:
+            current = (address + len(data)) & MASK_32
+            chunk = min(size - len(data), PAGE_SIZE - (current & PAGE_MASK))
+            offset = int(self._locate(lane, np.array([current], dtype=np.uint32))[0])
+            data += self._view('u1')[offset:offset + chunk].tobytes()
+        return data
+
+    def _load(self, lanes, addresses, width: int):
+        # aligned halves and words are one gather from the pool seen as little-endian 16 or 32-bit values
+        if width > 1 and not (addresses & np.uint32(width - 1)).any():
+            return self._view(_WIDTHS[width])[self._locate(lanes, addresses) // width].astype(np.uint32)
+        value = np.zeros(lanes.size, dtype=np.uint32)
+        for byte in range(width):
+            offsets = self._locate(lanes, addresses + np.uint32(byte))
+            value |= self._view('u1')[offsets].astype(np.uint32) << np.uint32(8 * byte)
+        return value
+
+    def _store(self, lanes, addresses, value, width: int) -> None:
+        if width > 1 and not (addresses & np.uint32(width - 1)).any():
+            view = self._view(_WIDTHS[width])
+            view[self._own(lanes, addresses) // width] = value.astype(view.dtype)
+            return
+        for byte in range(width):
+            offsets = self._own(lanes, addresses + np.uint32(byte))
+            self._view('u1')[offsets] = (value >> np.uint32(8 * byte)).astype(np.uint8)
+
+    def _fail(self, lanes, pc: int, message: str) -> None:
+        self.active[lanes] = False
+        self.pc[lanes] = pc
+        for lane in lanes.tolist():
+            self.errors[lane] = message
+
+    def _step(self, pc: int) -> _Step:
+        # a function running the instruction at pc for a group of lanes; it returns the lanes that
+        # retired it and their next pc, or None when it wrote diverging pcs itself
+        step = self._steps.get(pc)
+        if step is None:
+            word = self._base.memory.load_word(pc)
+            step = self._steps[pc] = self._compile(self._decoder.build_instruction(word, pc))
+        return step
+
+    def _compile(self, instr: decoder.Instruction) -> _Step:
+        regs = self.regs
+        name, rd, rs1, rs2, imm = instr.name, instr.rd, instr.rs1, instr.rs2, instr.imm
+        pc, next_pc, target = instr.pc, instr.next_pc, instr.target
+
+        if name in _RTYPE:
+            function = _RTYPE[name]
+
+            def step(lanes):
+                if rd:
+                    regs[lanes, rd] = function(regs[lanes, rs1], regs[lanes, rs2])
+                return lanes, next_pc
+        elif name in _ITYPE:
+            function = _ITYPE[name]
+
+            def step(lanes):
+                if rd:
+                    regs[lanes, rd] = function(regs[lanes, rs1], imm)
+                return lanes, next_pc
+        elif name in ('lui', 'auipc'):
+            value = imm & MASK_32 if name == 'lui' else (pc + imm) & MASK_32
+
+            def step(lanes):
+                if rd:
+                    regs[lanes, rd] = value
+                return lanes, next_pc
+        elif name in _LOADS:
+            width, sign = _LOADS[name]
+
+            def step(lanes):
+                value = self._load(lanes, regs[lanes, rs1] + np.uint32(imm & MASK_32), width)
+                if rd:
+                    regs[lanes, rd] = (value ^ np.uint32(sign)) - np.uint32(sign) if sign else value
+                return lanes, next_pc
+        elif name in _STORES:
+            width = _STORES[name]
+
+            def step(lanes):
+                addresses = regs[lanes, rs1] + np.uint32(imm & MASK_32)
+                code = (addresses + np.uint32(width) > self._code_start) & (addresses < self._code_end)
+                if code.any():
+                    self._fail(lanes[code], pc, 'self-modifying code is not supported by the batch engine')
+                    lanes, addresses = lanes[~code], addresses[~code]
+                self._store(lanes, addresses, regs[lanes, rs2], width)
+                return lanes, next_pc
+        elif name in _BRANCHES:
+            condition = _BRANCHES[name]
+
+            def step(lanes):
+                taken = condition(regs[lanes, rs1], regs[lanes, rs2])
+                if taken.all():
+                    return lanes, target
+                if not taken.any():
+                    return lanes, next_pc
+                self.pc[lanes] = np.where(taken, np.uint32(target), np.uint32(next_pc))
+                return lanes, None
+        elif name == 'jal':
+            def step(lanes):
+                if rd:
+                    regs[lanes, rd] = next_pc
+                return lanes, target
+        elif name == 'jalr':
+            def step(lanes):
+                targets = (regs[lanes, rs1] + np.uint32(imm & MASK_32)) & np.uint32(0xfffffffe)
+                if rd:
+                    regs[lanes, rd] = next_pc
+                if (targets == targets[0]).all():
+                    return lanes, int(targets[0])
+                self.pc[lanes] = targets
+                return lanes, None
+        elif instr.op.format == 'C':
+            reads, writes = decoder.csr_effects(instr)
+            # fails like the other engines on writes and unknown CSRs; only the counters differ between lanes
+            value = decoder.csr_access(self._base.register_bank, imm, reads, writes)
+            if reads and imm in _COUNTERS:
+                high = bool(imm & 0x80)
+
+                def step(lanes):
+                    if rd:
+                        # the group's steps in this run are not in the clock yet
+                        retired = self.clock[lanes] + self._group_steps
+                        regs[lanes, rd] = (retired >> 32 if high else retired).astype(np.uint32)
+                    return lanes, next_pc
+            else:
+                def step(lanes):
+                    if rd:
+                        regs[lanes, rd] = value
+                    return lanes, next_pc
+        elif instr.is_end:
+            def step(lanes):
+                self.active[lanes] = False
+                self.finished[lanes] = True
+                self.pc[lanes] = pc
+                return lanes, None
+        else:
+            raise Exception(f'Instruction {name} at {pc:08x} is not supported by the batch engine')
+        return step
+
+    def run(self, max_instructions: int | None = None) -> None:
+        # every step runs one instruction for all live lanes at the lowest pc; lanes that agree on the
+        # next pc stay in the group, so converged instances advance together without regrouping
+        limit = np.full(self.size, np.iinfo(np.int64).max, dtype=np.int64)
+        if max_instructions is not None:
+            limit = self.clock + max_instructions
+        group = None
+        while True:
+            if group is None:
+                live = np.flatnonzero(self.active & (self.clock < limit))
+                if not live.size:
+                    return
+                pcs = self.pc[live]
+                pc = int(pcs.min())
+                group = live if int(pcs.max()) == pc else live[pcs == pc]
+                converged = group.size == live.size
+                room = int((limit[group] - self.clock[group]).min())
+                steps = 0
+            if steps == room:
+                self.clock[group] += steps
+                self.pc[group] = pc
+                group = None
+                continue
+            try:
+                self._group_steps = steps
+                lanes, next_pc = self._step(pc)(group)
+            except Exception as error:
+                self.clock[group] += steps
+                self._fail(group, pc, f'{type(error).__name__}: {error}')
+                group = None
+                continue
+            steps += 1
+            if lanes is group and next_pc is not None and converged:
+                pc = next_pc
+                continue
+            self.clock[group] += steps - 1
+            self.clock[lanes] += 1
+            if next_pc is not None:
+                self.pc[lanes] = next_pc
+            group = None
+
+    def results(self) -> list[dict]:
+        results = []
+        for lane in range(self.size):
+            status = 'ok' if self.finished[lane] else 'error' if lane in self.errors else 'budget'
+            results.append({'status': status, 'instructions': int(self.clock[lane]) - self._start_clock,
+                            'error': self.errors.get(lane), 'pc': int(self.pc[lane]),
+                            'registers': self.regs[lane].tolist()})
+        return results
+
+def run(parent: Simulator, variants: list[list[tuple[int, bytes]]], max_instructions: int | None = None) -> list[dict]:
+    machine = BatchMachine(parent, len(variants))
+    for lane, patches in enumerate(variants):
+        for address, data in patches:
+            machine.write(lane, address, data)
+    machine.run(max_instructions)
+    return machine.results()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import decoder
+import main
+import rtype_helper
+from memory import Memory
+from register import RegisterBank
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.10
+MICRO_ITERATIONS = 20000
+MEMORY_ITERATIONS = 20000
+DATA_BASE = 0x20000
+DATA_SIZE = 0x10000
+BENCH_PC = 0x1000
+
+# rd, rs1, rs2 used by the synthesized instructions; rs1 points to DATA_BASE so loads and stores stay mapped
+_RD, _RS1, _RS2 = 5, 6, 7
+
+def best_of(function, repeat: int, count: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / count * 1e9
+
+def sample_words() -> dict[str, int]:
+    words = {op.name: decoder.encode(op.name, _RD, _RS1, _RS2) for op in decoder.descriptors()}
+    # CSR accesses need an implemented register and no write; every implemented CSR is read-only, so csrrw
+    # and csrrwi always fail
+    for name in ('csrrs', 'csrrc', 'csrrsi', 'csrrci'):
+        words[name] = decoder.encode(name, _RD, imm=decoder.CSR_INSTRET)
+    del words['csrrw'], words['csrrwi']
+    return words
+
+def _machine() -> tuple[RegisterBank, Memory]:
+    bank = RegisterBank()
+    memory = Memory()
+    memory.add_region('data', DATA_BASE, DATA_SIZE)
+    bank.regs[_RS1] = DATA_BASE
+    bank.regs[_RS2] = 0x12345678
+    return bank, memory
+
+def bench_decode(repeat: int, iterations: int = MICRO_ITERATIONS) -> dict[str, float]:
+    build = decoder.Decoder().build_instruction
+    results = {}
+    for name, word in sample_words().items():
+        def loop():
+            for _ in range(iterations):
+                build(word, BENCH_PC)
+        results[f'decode.{name}'] = best_of(loop, repeat, iterations)
+    return results
+
+def bench_exec(repeat: int, iterations: int = MICRO_ITERATIONS) -> dict[str, float]:
+    build = decoder.Decoder().build_instruction
+    results = {}
+    for name, word in sample_words().items():
+        instr = build(word, BENCH_PC)
+        bank, memory = _machine()
+        regs = bank.regs
+        handler = instr.handler
+        def loop():
+            for _ in range(iterations):
+                handler(instr, regs, bank, memory)
+        results[f'exec.{name}'] = best_of(loop, repeat, iterations)
+    return results
+
+def bench_rtype(repeat: int, iterations: int = MICRO_ITERATIONS) -> dict[str, float]:
+    rng = random.Random(0)
+    operands = [(rng.getrandbits(32), rng.getrandbits(32) | 1) for _ in range(64)]
+    results = {}
+    for name, function in rtype_helper.FUNCTIONS.items():
+        def loop():
+            for _ in range(iterations // len(operands)):
+                for a, b in operands:
+                    function(a, b)
+        results[f'rtype.{name}'] = best_of(loop, repeat, iterations // len(operands) * len(operands))
+    return results
+
+def bench_memory(repeat: int, iterations: int = MEMORY_ITERATIONS) -> dict[str, float]:
+    _, memory = _machine()
+    results = {}
+    for name, width in [('byte', 1), ('half', 2), ('word', 4)]:
+        load = getattr(memory, f'load_{name}')
+        store = getattr(memory, f'store_{name}')
+        addresses = [DATA_BASE + (i * 4 * width) % DATA_SIZE for i in range(iterations)]
+        def load_loop():
+            for address in addresses:
+                load(address)
+        def store_loop():
+            for address in addresses:
+                store(address, address)
+        results[f'memory.load_{name}'] = best_of(load_loop, repeat, iterations)
+        results[f'memory.store_{name}'] = best_of(store_loop, repeat, iterations)
+    return results
+
+def bench_programs(paths: list[str], engines: list[str], repeat: int) -> dict[str, float]:
+    results = {}
+    for path in paths:
+        name = main.program_name(path)
+        for engine in engines:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                sim, status = main.run_test(path, main.RunOptions(engine=engine, trace_level='off'))
+                elapsed = time.perf_counter() - start
+                if status != 'ok':
+                    raise Exception(f'Program {name} did not finish: {status}')
+                if best is None or elapsed < best:
+                    best = elapsed
+            results[f'program.{engine}.{name}'] = best / max(sim.clock, 1) * 1e9
+    return results
+
+def run(groups: list[str], repeat: int, paths: list[str], engines: list[str], pattern: str | None) -> dict[str, float]:
+    results = {}
+    if 'decode' in groups:
+        results.update(bench_decode(repeat))
+    if 'exec' in groups:
+        results.update(bench_exec(repeat))
+    if 'rtype' in groups:
+        results.update(bench_rtype(repeat))
+    if 'memory' in groups:
+        results.update(bench_memory(repeat))
+    if 'program' in groups:
+        results.update(bench_programs(paths, engines, repeat))
+    if pattern:
+        results = {name: value for name, value in results.items() if pattern in name}
+    return results
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+    }
+
+def save(path: str, results: dict[str, float]) -> None:
+    with open(path, 'tw') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def load(path: str) -> dict[str, float]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+def compare(baseline: dict[str, float], results: dict[str, float], threshold: float) -> list[tuple]:
+    rows = []
+    for name, value in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None or old <= 0:
+            rows.append((name, old, value, None, False))
+            continue
+        change = value / old - 1
+        rows.append((name, old, value, change, change > threshold))
+    return rows
+
+def _mips(name: str, ns: float) -> str:
+    return f'{1e3 / ns:8.3f} MIPS' if name.startswith('program.') else ''
+
+def format_results(results: dict[str, float]) -> str:
+    lines = [f'{"benchmark":<40} {"ns/op":>10}']
+    for name, value in sorted(results.items()):
+        lines.append(f'{name:<40} {value:>10.1f} {_mips(name, value)}'.rstrip())
+    return '\n'.join(lines)
+
+def format_comparison(rows: list[tuple]) -> str:
+    lines = [f'{"benchmark":<40} {"baseline":>10} {"current":>10} {"change":>8}']
+    for name, old, value, change, regressed in rows:
+        old_text = '-' if old is None else f'{old:.1f}'
+        change_text = 'new' if change is None else f'{change:+.1%}'
+        lines.append(f'{name:<40} {old_text:>10} {value:>10.1f} {change_text:>8}'
+                     f'{"  REGRESSION" if regressed else ""}')
+    return '\n'.join(lines)
+
+GROUPS = ('decode', 'exec', 'rtype', 'memory', 'program')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure decode, execution, memory and end-to-end speed')
+    parser.add_argument('groups', nargs='*', metavar='group',
+                        help=f'benchmark groups to run: {", ".join(GROUPS)} (default: all)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per benchmark; the best is kept')
+    parser.add_argument('--engine', action='append', choices=main.ENGINES, default=None,
+                        help='engines used for the end-to-end programs (default: all)')
+    parser.add_argument('--programs', default=None,
+                        help='folder with the test programs, .riscv ELF files or raw .bin images (default: the test build)')
+    parser.add_argument('-k', '--filter', default=None, help='only keep benchmarks whose name contains this')
+    parser.add_argument('--save', default=None, help='write the results as a JSON baseline')
+    parser.add_argument('--compare', default=None, help='compare against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown reported as a regression (default: 0.10)')
+    args = parser.parse_args()
+    for group in args.groups:
+        if group not in GROUPS:
+            parser.error(f'unknown benchmark group: {group}')
+    args.groups = args.groups or list(GROUPS)
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    paths = []
+    if 'program' in args.groups:
+        tests = main.find_tests() if args.programs is None else main.find_programs(args.programs)
+        paths = sorted(test.path for test in tests)
+    results = run(args.groups, args.repeat, paths, args.engine or list(main.ENGINES), args.filter)
+    if args.save:
+        save(args.save, results)
+    if args.compare:
+        rows = compare(load(args.compare), results, args.threshold)
+        print(format_comparison(rows))
+        regressions = [row for row in rows if row[4]]
+        if regressions:
+            print(f'{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}')
+            sys.exit(1)
+    else:
+        print(format_results(results))
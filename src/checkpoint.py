@@ -0,0 +1,127 @@
+import gzip
+import lzma
+import struct
+
+from memory import Memory, PAGE_SIZE
+from register import RegisterBank
+
+MAGIC = b'RVCKPT02'
+# files from before the host state was saved
+MAGIC_V1 = b'RVCKPT01'
+COMPRESSIONS = ('none', 'gzip', 'lzma')
+
+_header = struct.Struct('<8sB')
+# pc, clock, x0..x31
+_machine = struct.Struct('<IQ32I')
+_count = struct.Struct('<I')
+_region = struct.Struct('<II')
+_string = struct.Struct('<H')
+_page = struct.Struct('<I')
+_value = struct.Struct('<q')
+_ZERO_PAGE = bytes(PAGE_SIZE)
+
+class Checkpoint:
+    program: str
+    pc: int
+    clock: int
+    regs: list[int]
+    regions: list[tuple[str, int, int]]
+    pages: dict[int, bytes]
+    # state kept on the host side of the machine, such as the program break of the ecall services
+    host: dict[str, int]
+
+    def __init__(self, program: str, pc: int, clock: int, regs: list[int], regions: list[tuple[str, int, int]],
+                 pages: dict[int, bytes], host: dict[str, int] | None = None):
+        self.program = program
+        self.pc = pc
+        self.clock = clock
+        self.regs = regs
+        self.regions = regions
+        self.pages = pages
+        self.host = host if host is not None else {}
+
+def capture(register_bank: RegisterBank, memory: Memory, clock: int, program: str = '') -> Checkpoint:
+    pages = {}
+    for page, view in memory.pages():
+        data = view.tobytes()
+        if data != _ZERO_PAGE:
+            pages[page] = data
+    regions = [(region.name, region.base, region.size) for region in memory.regions()]
+    return Checkpoint(program, register_bank.pc, clock, list(register_bank.regs), regions, pages)
+
+def apply(checkpoint: Checkpoint, register_bank: RegisterBank, memory: Memory) -> None:
+    existing = {(region.base, region.size) for region in memory.regions()}
+    for name, base, size in checkpoint.regions:
+        if (base, size) not in existing:
+            memory.add_region(name, base, size)
+    for page, _ in memory.pages():
+        if page not in checkpoint.pages:
+            memory.write_page(page, _ZERO_PAGE)
+    for page, data in checkpoint.pages.items():
+        memory.write_page(page, data)
+    register_bank.regs[:] = checkpoint.regs
+    register_bank.pc = checkpoint.pc
+
+def _open(file, mode: str, compression: str):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode=mode)
+    if compression == 'lzma':
+        return lzma.LZMAFile(file, mode=mode)
+    return file
+
+def _write_string(out, text: str) -> None:
+    data = text.encode()
+    out.write(_string.pack(len(data)))
+    out.write(data)
+
+def _read_string(f) -> str:
+    size, = _string.unpack(f.read(_string.size))
+    return f.read(size).decode()
+
+def write(path: str, checkpoint: Checkpoint, compression: str = 'none') -> None:
+    if compression not in COMPRESSIONS:
+        raise Exception(f'Unknown checkpoint compression: {compression}')
+    with open(path, 'wb') as f:
+        f.write(_header.pack(MAGIC, COMPRESSIONS.index(compression)))
+        out = _open(f, 'wb', compression)
+        _write_string(out, checkpoint.program)
+        out.write(_machine.pack(checkpoint.pc, checkpoint.clock, *checkpoint.regs))
+        out.write(_count.pack(len(checkpoint.host)))
+        for name, value in sorted(checkpoint.host.items()):
+            _write_string(out, name)
+            out.write(_value.pack(value))
+        out.write(_count.pack(len(checkpoint.regions)))
+        for name, base, size in checkpoint.regions:
+            out.write(_region.pack(base, size))
+            _write_string(out, name)
+        out.write(_count.pack(len(checkpoint.pages)))
+        for page, data in sorted(checkpoint.pages.items()):
+            out.write(_page.pack(page))
+            out.write(data)
+        if out is not f:
+            out.close()
+
+def read(path: str) -> Checkpoint:
+    with open(path, 'rb') as f:
+        magic, compression = _header.unpack(f.read(_header.size))
+        if magic not in (MAGIC, MAGIC_V1) or compression >= len(COMPRESSIONS):
+            raise Exception(f'Not a checkpoint file: {path}')
+        data = _open(f, 'rb', COMPRESSIONS[compression])
+        program = _read_string(data)
+        pc, clock, *regs = _machine.unpack(data.read(_machine.size))
+        host = {}
+        if magic == MAGIC:
+            for _ in range(_count.unpack(data.read(_count.size))[0]):
+                name = _read_string(data)
+                host[name], = _value.unpack(data.read(_value.size))
+        regions = []
+        for _ in range(_count.unpack(data.read(_count.size))[0]):
+            base, size = _region.unpack(data.read(_region.size))
+            regions.append((_read_string(data), base, size))
+        pages = {}
+        for _ in range(_count.unpack(data.read(_count.size))[0]):
+            page, = _page.unpack(data.read(_page.size))
+            pages[page] = data.read(PAGE_SIZE)
+            if len(pages[page]) != PAGE_SIZE:
+                raise Exception(f'Truncated checkpoint file: {path}')
+    return Checkpoint(program, pc, clock, regs, regions, pages, host)
@@ -1,446 +1,437 @@
-from register import RegisterBank
+from register import RegisterBank, REGISTER_ALIASES
 from memory import Memory
-from instructions import InstructionsCache
 from utils import *
 
 import rtype_helper
 
+FORMAT_NAMES = {
+    0b0110011: 'R',
+    0b0010011: 'I',
+    0b0000011: 'I',
+    0b1100111: 'I',
+    0b0100011: 'S',
+    0b1100011: 'B',
+    0b0110111: 'U',
+    0b0010111: 'U',
+    0b1101111: 'J',
+    0b1110011: 'E',
+}
+
+ECALL = 0x00000073
+
+CSR_CYCLE = 0xc00
+CSR_TIME = 0xc01
+CSR_INSTRET = 0xc02
+CSR_CYCLEH = 0xc80
+CSR_TIMEH = 0xc81
+CSR_INSTRETH = 0xc82
+CSR_MHARTID = 0xf14
+CSR_NAMES = {CSR_CYCLE: 'cycle', CSR_TIME: 'time', CSR_INSTRET: 'instret', CSR_CYCLEH: 'cycleh',
+             CSR_TIMEH: 'timeh', CSR_INSTRETH: 'instreth', CSR_MHARTID: 'mhartid'}
+
+class OpDescriptor:
+    __slots__ = ('name', 'format', 'handler', 'layout', 'is_end', 'is_terminator', 'static_mnem', 'registers',
+                 'reads_clock')
+
+    def __init__(self, name: str, format_: str, handler, layout: str, is_end: bool = False,
+                 is_terminator: bool = False, registers: tuple[int, int, int] | None = None):
+        self.name = name
+        self.format = format_
+        self.handler = handler
+        self.layout = layout
+        self.is_end = is_end
+        # CSR accesses read the instruction counters, so engines that batch the clock update it first
+        self.reads_clock = format_ == 'C'
+        self.is_terminator = is_terminator or is_end or format_ in ('B', 'J') or name == 'jalr'
+        self.static_mnem = '{dest' not in layout
+        # host calls log fixed registers (rd, rs1, rs2) instead of the fields of the word they replace
+        self.registers = registers
+
+def _imm_r(word: int) -> int:
+    return 0
+
+def _imm_i(word: int) -> int:
+    return twos_comp_to_dec(word >> 20, 12)
+
+def _imm_s(word: int) -> int:
+    return twos_comp_to_dec(((word >> 20) & 0xfe0) | ((word >> 7) & 0x1f), 12)
+
+def _imm_b(word: int) -> int:
+    res = ((word >> 31) & 1) << 12
+    res |= ((word >> 7) & 1) << 11
+    res |= ((word >> 25) & 0x3f) << 5
+    res |= ((word >> 8) & 0xf) << 1
+    return twos_comp_to_dec(res, 13)
+
+def _imm_u(word: int) -> int:
+    return word & 0xfffff000
+
+def _imm_csr(word: int) -> int:
+    return word >> 20
+
+def _imm_j(word: int) -> int:
+    res = ((word >> 31) & 1) << 20
+    res |= ((word >> 12) & 0xff) << 12
+    res |= ((word >> 20) & 1) << 11
+    res |= ((word >> 21) & 0x3ff) << 1
+    return twos_comp_to_dec(res, 21)
+
+class _RuntimeField:
+    # formats as a str.format field filled in at log time (the jalr target depends on rs1)
+    def __format__(self, spec: str) -> str:
+        return '{3:' + spec + '}'
+
+IMMEDIATES = {'R': _imm_r, 'I': _imm_i, 'S': _imm_s, 'B': _imm_b, 'U': _imm_u, 'J': _imm_j, 'E': _imm_r,
+              'C': _imm_csr}
 
 class Instruction:
-    _instr: str
-    _register_bank: RegisterBank
-    _memory: Memory
-    _rs1_value: int
-    _rs2_value: int
-    _pc: int
-
-    def __init__(self, instruction: str, register_bank: RegisterBank, memory: Memory):
-        self._instr = instruction
-        self._register_bank = register_bank
-        self._memory = memory
-        self._rs1_value = register_bank.get_register(self.get_rs1())
-        self._rs2_value = register_bank.get_register(self.get_rs2())
-        self._pc = register_bank.get_register('pc')
-
-    def get_rd(self) -> int:
-        return to_uint(slice_instruction(self._instr, 7, 11))
-
-    def get_rs1(self) -> int:
-        return to_uint(slice_instruction(self._instr, 15, 19))
-
-    def get_rs2(self) -> int:
-        return to_uint(slice_instruction(self._instr, 20, 24))
-
-    def get_opcode(self) -> str:
-        return slice_instruction(self._instr, 0, 6)
-
-    def _bump_pc(self):
-        self._register_bank.set_register('pc', self._pc + 4)
-
-    def get_imm(self) -> int:
-        raise NotImplementedError()
-
-    def exec(self):
-        raise NotImplementedError()
-
-    def mnem(self):
-        raise NotImplementedError()
-
-    def name(self):
-        raise NotImplementedError()
-
-    def log(self):
-        rd = self._register_bank.get_register(self.get_rd())
-        vals = {'rd':rd, 'rs1': self._rs1_value, 'rs2': self._rs2_value}
-        for val in vals:
-            vals[val] = to_uint(dec_to_twos_comp(vals[val], 32))
-        instr = int(self._instr, 2)
-        res = f'PC={self._pc:08x}'
-        res += f' [{instr:08x}]'
-        res += f' x{self.get_rd():02d}={vals["rd"]:08x}'
-        res += f' x{self.get_rs1():02d}={vals["rs1"]:08x}'
-        res += f' x{self.get_rs2():02d}={vals["rs2"]:08x}'
-        res += f' {self.name():<8}' + self.mnem()
-        return res
-
-    def is_end(self):
-        return False
+    __slots__ = ('op', 'name', 'handler', 'is_end', 'synced', 'word', 'pc', 'rd', 'rs1', 'rs2', 'imm', 'next_pc',
+                 'target', '_mnem', '_template')
+    # instructions retired per step, as opposed to fused pairs
+    size = 1
+
+    def __init__(self, op: OpDescriptor, word: int, pc: int):
+        self.op = op
+        self.name = op.name
+        self.handler = op.handler
+        self.is_end = op.is_end
+        # needs the simulator state up to date before it runs
+        self.synced = op.is_end or op.reads_clock
+        self.word = word
+        self.pc = pc
+        self.rd = (word >> 7) & 0x1f
+        self.rs1 = (word >> 15) & 0x1f
+        self.rs2 = (word >> 20) & 0x1f
+        if op.registers is not None:
+            self.rd, self.rs1, self.rs2 = op.registers
+        self.imm = IMMEDIATES[op.format](word)
+        self.next_pc = (pc + 4) & MASK_32
+        self.target = (pc + self.imm) & MASK_32
+        self._mnem = None
+        self._template = None
+
+    def exec(self, register_bank: RegisterBank, memory: Memory):
+        self.handler(self, register_bank.regs, register_bank, memory)
+
+    def _format_mnem(self, dest) -> str:
+        return self.op.layout.format(
+            rd=REGISTER_ALIASES[self.rd], rs1=REGISTER_ALIASES[self.rs1], rs2=REGISTER_ALIASES[self.rs2],
+            imm=self.imm, uimm=self.imm >> 12 if self.op.format == 'U' else self.imm & 0xfff,
+            shamt=self.imm & 0x1f, target=self.target, dest=dest, csr=CSR_NAMES.get(self.imm, hex(self.imm)),
+            zimm=self.rs1)
+
+    def mnem(self, rs1_value: int = 0) -> str:
+        if self._mnem is not None:
+            return self._mnem
+        text = self._format_mnem((rs1_value + self.imm) & 0xfffffffe)
+        if self.op.static_mnem:
+            self._mnem = text
+        return text
+
+    def log_template(self) -> str:
+        # kept on the instruction, which the instructions cache keeps by pc for as long as the word is there
+        if self._template is None:
+            self._template = (f'PC={self.pc:08x} [{self.word:08x}] x{self.rd:02d}={{0:08x}}'
+                              f' x{self.rs1:02d}={{1:08x}} x{self.rs2:02d}={{2:08x}}'
+                              f' {self.name:<8}{self._format_mnem(_RuntimeField())}')
+        return self._template
+
+    def log(self, rd_value: int, rs1_value: int, rs2_value: int) -> str:
+        return (self._template or self.log_template()).format(
+            rd_value, rs1_value, rs2_value, (rs1_value + self.imm) & 0xfffffffe)
+
+def _table_key(opcode: int, funct3: int, funct7: int) -> int:
+    return opcode | funct3 << 7 | funct7 << 10
+
+def table_index(word: int) -> int:
+    return (word & 0x7f) | ((word >> 5) & 0x380) | ((word >> 15) & 0x1fc00)
+
+_TABLE: list[OpDescriptor | None] = [None] * (1 << 17)
+
+def _register(opcode: int, funct3s, funct7s, op: OpDescriptor):
+    for funct3 in funct3s:
+        for funct7 in funct7s:
+            _TABLE[_table_key(opcode, funct3, funct7)] = op
+
+ANY = range(128)
+ANY_FUNCT3 = range(8)
+
+def table_op(word: int) -> OpDescriptor | None:
+    # what the word decodes to without hooks
+    return _TABLE[table_index(word)]
 
 class Decoder:
-    _register_bank: RegisterBank
-    _memory: Memory
-
-    def __init__(self, register_bank: RegisterBank, memory: Memory):
-        self._register_bank = register_bank
-        self._memory = memory
-
-    def build_instruction(self, instruction: str) -> Instruction:
-        opcode = slice_instruction(instruction, 0, 6)
-        match opcode:
-            case '1100011':
-                return BTypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '0110111' | '0010111':
-                return UTypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '1101111':
-                return JTypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '0100011':
-                return STypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '0000011' | '0010011' | '1100111' :
-                return ITypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '0110011':
-                return RTypeInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case '1110011':
-                return EBreakInstruction(instruction=instruction, register_bank=self._register_bank, memory=self._memory)
-            case _:
-                raise Exception(f'Unknown opcode in instruction: {instruction}')
-
-class EBreakInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def exec(self):
-        return
-
-    def name(self):
-        return 'ebreak'
-
-    def mnem(self):
-        return ''
-
-    def is_end(self):
-        return True
-
-class BTypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_funct3(self):
-        return slice_instruction(self._instr, 12, 14)
-
-    def get_imm(self):
-        res = 20 * slice_instruction(self._instr, 31, 31)
-        res += slice_instruction(self._instr, 7, 7)
-        res += slice_instruction(self._instr, 25, 30)
-        res += slice_instruction(self._instr, 8, 11)
-        res += '0'
-        return res
-
-    def name(self):
-        match self.get_funct3():
-            case '000':
-                return 'beq'
-            case '001':
-                return 'bne'
-            case '100':
-                return 'blt'
-            case '101':
-                return 'bge'
-            case '110':
-                return 'bltu'
-            case '111':
-                return 'bgeu'
-            case _:
-                raise Exception(f'Unknown B-Type Instruction: {self._instr}')
-
-    def exec(self):
-        should_branch = False
-        u_rs1 = to_uint(dec_to_twos_comp(self._rs1_value, 32))
-        u_rs2 = to_uint(dec_to_twos_comp(self._rs2_value, 32))
-        match self.name():
-            case 'beq':
-                should_branch = self._rs1_value == self._rs2_value
-            case 'bne':
-                should_branch = self._rs1_value != self._rs2_value
-            case 'blt':
-                should_branch = self._rs1_value < self._rs2_value
-            case 'bge':
-                should_branch = self._rs1_value >= self._rs2_value
-            case 'bltu':
-                should_branch = u_rs1 < u_rs2
-            case 'bgeu':
-                should_branch = u_rs1 >= u_rs2
-        if should_branch:
-            imm_ = twos_comp_to_dec(self.get_imm())
-            self._register_bank.set_register('pc', self._pc + imm_)
-        else:
-            self._bump_pc()
-
-    def mnem(self):
-        rs1 = self._register_bank.get_alias(self.get_rs1())
-        rs2 = self._register_bank.get_alias(self.get_rs2())
-        imm = twos_comp_to_dec(self.get_imm())
-        return f'{rs1}, {rs2}, 0x{self._pc + imm:x}'
-
-class UTypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_imm(self) -> str:
-        return slice_instruction(self._instr, 12, 31) + 12 * '0'
-
-    def name(self) -> str:
-        opcode = slice_instruction(self._instr, 0, 6)
-        match opcode:
-            case '0110111':
-                return 'lui'
-            case '0010111':
-                return 'auipc'
-            case _:
-                raise Exception(f'Unknown U-Type Instruction: {self._instr}')
-    
-    def exec(self):
-        imm = twos_comp_to_dec(self.get_imm())
-        match self.name():
-            case 'lui':
-                self._register_bank.set_register(self.get_rd(), imm)
-            case 'auipc':
-                self._register_bank.set_register(self.get_rd(), self._pc + imm)
-        self._bump_pc()
-    
-    def mnem(self):
-        imm = to_uint(self.get_imm()[:-12])
-        rd = self._register_bank.get_alias(self.get_rd())
-        return f'{rd}, {imm}'
-
-class JTypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_imm(self):
-        res = 12 * slice_instruction(self._instr, 31, 31)
-        res += slice_instruction(self._instr, 12, 19)
-        res += slice_instruction(self._instr, 20, 20)
-        res += slice_instruction(self._instr, 21, 30)
-        res += '0'
-        return res
-
-    def name(self):
-        return 'jal'
-
-    def exec(self):
-        imm = twos_comp_to_dec(self.get_imm())
-        self._register_bank.set_register(self.get_rd(), self._pc + 4)
-        self._register_bank.set_register('pc', self._pc + imm)
-    
-    def mnem(self):
-        rd = self._register_bank.get_alias(self.get_rd())
-        imm = twos_comp_to_dec(self.get_imm())
-        return f'{rd}, 0x{self._pc + imm:x}'
-    
-class STypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_imm(self):
-        res = slice_instruction(self._instr, 25, 31)
-        res += slice_instruction(self._instr, 7, 11)
-        return res
-
-    def get_funct3(self):
-        return slice_instruction(self._instr, 12, 14)
-
-    def name(self) -> str:
-        match self.get_funct3():
-            case '000':
-                return 'sb'
-            case '001':
-                return 'sh'
-            case '010':
-                return 'sw'
-            case _:
-                raise Exception(f'Unknown S-Type Instruction: {self._instr}')
-
-    def exec(self):
-        imm = twos_comp_to_dec(self.get_imm())
-        rs1 = self._register_bank.get_register(self.get_rs1())
-        rs2 = self._register_bank.get_register(self.get_rs2())
-
-        width = 2 ** int(self.get_funct3(), base=2)
-        value = dec_to_twos_comp(rs2, 32)
-
-        for i in range(width):
-            value_slice = slice_instruction(value, i*8, i*8 + 7)
-            # print(self.name(), rs1 + imm + width - i - 1, i, value, value_slice)
-            self._memory.save_byte(rs1 + imm + i, value_slice)
-        self._bump_pc()
-    
-    def mnem(self):
-        imm = twos_comp_to_dec(self.get_imm())
-        rs1 = self._register_bank.get_alias(self.get_rs1())
-        rs2 = self._register_bank.get_alias(self.get_rs2())
-        return f'{rs2}, {imm}({rs1})'
-
-class ITypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_imm(self):
-        res = slice_instruction(self._instr, 20, 31)
-        return res
-
-    def get_funct3(self):
-        return slice_instruction(self._instr, 12, 14)
-    
-    def name(self) -> str:
-        opcode = slice_instruction(self._instr, 0, 6)
-        upper_imm = self.get_imm()[:7]
-        if opcode == '1100111':
-            return 'jalr'
-        elif opcode == '0000011':
-            match self.get_funct3():
-                case '000':
-                    return 'lb'
-                case '001':
-                    return 'lh'
-                case '010':
-                    return 'lw'
-                case '100':
-                    return 'lbu'
-                case '101':
-                    return 'lhu'
-                case _:
-                    raise Exception(f'Unknown S-Type Instruction: {self._instr}')
-        elif opcode == '0010011':
-            match self.get_funct3():
-                case '000':
-                    return 'addi'
-                case '010':
-                    return 'slti'
-                case '011':
-                    return 'sltiu'
-                case '100':
-                    return 'xori'
-                case '110':
-                    return 'ori'
-                case '111':
-                    return 'andi'
-                case '001':
-                    return 'slli'
-                case '101':
-                    if upper_imm == '0000000':
-                        return 'srli'
-                    elif upper_imm == '0100000':
-                        return 'srai'
-                    else:
-                        raise Exception(f'Unknown S-Type Instruction: {self._instr}')
-                case _:
-                    raise Exception(f'Unknown S-Type Instruction: {self._instr}')
-        else:
-            raise Exception(f'Unknown S-Type Instruction: {self._instr}')
-
-    def exec(self):
-        imm = twos_comp_to_dec(self.get_imm())
-        rs1 = self._register_bank.get_register(self.get_rs1())
-
-        if self.name() == 'jalr':
-            dest = dec_to_twos_comp(rs1 + imm, 32)
-            dest = dest[:-1] + '0'
-            dest = twos_comp_to_dec(dest)
-            self._register_bank.set_register(self.get_rd(), self._pc + 4)
-            self._register_bank.set_register('pc', dest)
-            return
-
-        self._bump_pc()
-        if self.name()[0] == 'l':
-            width = 2 ** int(slice_instruction(self._instr, 12, 13), base=2)
-            value = []
-
-            for i in range(width):
-                a = self._memory.load_byte(rs1 + imm + i)
-                value.append(self._memory.load_byte(rs1 + imm + i))
-                # print(self.name(), value, a, width, i, rs1 + imm + i)
-            value = ''.join(reversed(value))
-
-            if slice_instruction(self._instr, 14, 14) == '1': # unsigned
-                self._register_bank.set_register(self.get_rd(), to_uint(value))
-            else:
-                self._register_bank.set_register(self.get_rd(), twos_comp_to_dec(value))
-            return
-
-        b_rs1 = dec_to_twos_comp(self._rs1_value, 32)
-        u_rs1 = to_uint(b_rs1)
-        b_imm = extend_signal(self.get_imm(), 32)
-        u_imm = to_uint(b_imm)
-        shamt = to_uint(self.get_imm()[-5:])
-        val = None
-        match self.name():
-            case 'addi':
-                val = self._rs1_value + imm
-            case 'slti':
-                val = 1 if self._rs1_value < imm else 0
-            case 'sltiu':
-                val = 1 if u_rs1 < u_imm else 0
-            case 'xori':
-                val = twos_comp_to_dec(''.join(str(int(x != y)) for x, y in zip(b_imm, b_rs1)))
-            case 'ori':
-                val = twos_comp_to_dec(''.join(str(int('1' in (x, y))) for x, y in zip(b_imm, b_rs1)))
-            case 'andi':
-                val = twos_comp_to_dec(''.join(str(int(x == y == '1')) for x, y in zip(b_imm, b_rs1)))
-            case 'slli':
-                val = twos_comp_to_dec((b_rs1 + shamt * '0')[-32:])
-                # if self._pc == 0x164:
-                #     print(self._rs1_value, b_rs1, self.get_imm(), shamt, val)
-                #     input()
-            case 'srli':
-                val = twos_comp_to_dec((shamt * '0' + b_rs1)[:32])
-            case 'srai':
-                val = twos_comp_to_dec((shamt * b_rs1[0] + b_rs1)[:32])
-        self._register_bank.set_register(self.get_rd(), val)
-
-    def mnem(self):
-        rs1 = self._register_bank.get_alias(self.get_rs1())
-        rd = self._register_bank.get_alias(self.get_rd())
-        imm = twos_comp_to_dec(self.get_imm())
-        pc = self._register_bank.get_register('pc')
-        name = self.name()
-        if name == 'jalr':
-            return f'{rd}, {rs1}, 0x{pc:x}'
-        elif name[0] == 'l':
-            return f'{rd}, {imm}({rs1})'
-        elif name == 'sltiu':
-            return f'{rd}, {rs1}, {to_uint(self.get_imm())}'
-        elif name != 'slti' and name[0] == 's':
-            imm = to_uint(self.get_imm()[-5:])
-        return f'{rd}, {rs1}, {imm}'
-
-class RTypeInstruction(Instruction):
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
-
-    def get_imm(self):
-        return slice_instruction(self._instr, 20, 31)
-
-    def get_funct3(self):
-        return slice_instruction(self._instr, 12, 14)
-
-    def get_funct7(self):
-        return slice_instruction(self._instr, 25, 31)
-    
-    def name(self) -> str:
-        opcode = slice_instruction(self._instr, 0, 6)
-        funct3 = self.get_funct3()
-        funct7 = self.get_funct7()
-        return rtype_helper.get_name(opcode, funct3, funct7, self._instr)
-
-    def exec(self):
-        imm = self.get_imm()
-        rs1 = self._register_bank.get_register(self.get_rs1())
-        rs2 = self._register_bank.get_register(self.get_rs2())
-        name = self.name()
-        # print(self._memory._memory)
-        # print(self._instr)
-
-        value = rtype_helper.exec(name, rs1, rs2, imm) & 0xffffffff
-
-        self._register_bank.set_register(self.get_rd(), value)
-        self._bump_pc()
-
-    def mnem(self):
-        opcode = slice_instruction(self._instr, 0, 6)
-        rs1 = self._register_bank.get_alias(self.get_rs1())
-        rd = self._register_bank.get_alias(self.get_rd())
-        if opcode == '0010011':
-            imm = twos_comp_to_dec(self.get_imm())
-            return f'{rd}, {rs1}, {imm}'
-        rs2 = self._register_bank.get_alias(self.get_rs2())
-        return f'{rd}, {rs1}, {rs2}'
\ No newline at end of file
+    _hooks: dict[int, OpDescriptor]
+    _ecall: OpDescriptor | None
+
+    def __init__(self):
+        self._hooks = {}
+        self._ecall = None
+
+    def hook(self, pc: int, op: OpDescriptor) -> None:
+        # whatever word is at pc decodes as op, also after a store to it invalidates the decoded copy
+        self._hooks[pc] = op
+
+    def on_ecall(self, op: OpDescriptor) -> None:
+        # without a handler ecall decodes like ebreak and ends the program
+        self._ecall = op
+
+    def build_instruction(self, instruction: int, pc: int) -> Instruction:
+        if self._hooks or self._ecall is not None:
+            op = self._hooks.get(pc) or (self._ecall if instruction == ECALL else None)
+            if op is not None:
+                return Instruction(op, instruction, pc)
+        op = _TABLE[table_index(instruction)]
+        if op is None:
+            fmt = FORMAT_NAMES.get(instruction & 0x7f)
+            if fmt is None:
+                raise Exception(f'Unknown opcode in instruction: {instruction:08x}')
+            raise Exception(f'Unknown {fmt}-Type Instruction: {instruction:08x}')
+        return Instruction(op, instruction, pc)
+
+def _encode_i(imm: int) -> int:
+    return (imm & 0xfff) << 20
+
+def _encode_s(imm: int) -> int:
+    return (imm & 0xfe0) << 20 | (imm & 0x1f) << 7
+
+def _encode_b(imm: int) -> int:
+    return ((imm >> 12) & 1) << 31 | ((imm >> 5) & 0x3f) << 25 | ((imm >> 1) & 0xf) << 8 | ((imm >> 11) & 1) << 7
+
+def _encode_u(imm: int) -> int:
+    return imm & 0xfffff000
+
+def _encode_j(imm: int) -> int:
+    return (((imm >> 20) & 1) << 31 | ((imm >> 1) & 0x3ff) << 21 | ((imm >> 11) & 1) << 20
+            | ((imm >> 12) & 0xff) << 12)
+
+IMMEDIATE_ENCODERS = {'R': _imm_r, 'I': _encode_i, 'S': _encode_s, 'B': _encode_b, 'U': _encode_u, 'J': _encode_j,
+                      'E': _encode_i, 'C': _encode_i}
+
+def encode(name: str, rd: int = 0, rs1: int = 0, rs2: int = 0, imm: int = 0) -> int:
+    key = _ENCODINGS.get(name)
+    if key is None:
+        raise Exception(f'Unknown instruction: {name}')
+    op = _TABLE[key]
+    word = (key & 0x7f) | ((key >> 7) & 0x7) << 12 | (key >> 10) << 25
+    if op.format in ('B', 'S'):
+        rd = 0
+    if op.format in ('U', 'J'):
+        rs1 = 0
+    if op.format != 'R' and op.format not in ('B', 'S'):
+        rs2 = 0
+    if name in ('slli', 'srli', 'srai'):
+        return word | rd << 7 | rs1 << 15 | (imm & 0x1f) << 20
+    return word | rd << 7 | rs1 << 15 | rs2 << 20 | IMMEDIATE_ENCODERS[op.format](imm)
+
+def descriptors() -> list[OpDescriptor]:
+    seen = {}
+    for op in _TABLE:
+        if op is not None:
+            seen.setdefault(op.name, op)
+    return list(seen.values())
+
+def _ebreak(i, regs, bank, memory):
+    return
+
+def csr_effects(instr: Instruction) -> tuple[bool, bool]:
+    # csrrw skips the read when rd is x0, csrrs and csrrc skip the write when rs1 (or the immediate) is 0
+    if instr.name in ('csrrw', 'csrrwi'):
+        return instr.rd != 0, True
+    return True, instr.rs1 != 0
+
+def csr_access(bank: RegisterBank, csr: int, reads: bool, writes: bool, offset: int = 0) -> int:
+    # every implemented CSR is read-only; the counters are the instructions retired before this one, offset
+    # by those a block ran since the clock was last updated, and time ticks with them so runs are reproducible
+    name = CSR_NAMES.get(csr)
+    if name is None:
+        raise Exception(f'Unsupported CSR: 0x{csr:03x}')
+    if writes:
+        raise Exception(f'CSR {name} is read-only')
+    if not reads:
+        return 0
+    if csr == CSR_MHARTID:
+        return bank.hartid
+    value = bank.retired() + offset
+    return (value >> 32 if csr & 0x80 else value) & MASK_32
+
+def _csr(i, regs, bank, memory):
+    value = csr_access(bank, i.imm, *csr_effects(i))
+    if i.rd:
+        regs[i.rd] = value
+    bank.pc = i.next_pc
+
+def _beq(i, regs, bank, memory):
+    bank.pc = i.target if regs[i.rs1] == regs[i.rs2] else i.next_pc
+
+def _bne(i, regs, bank, memory):
+    bank.pc = i.target if regs[i.rs1] != regs[i.rs2] else i.next_pc
+
+def _blt(i, regs, bank, memory):
+    bank.pc = i.target if (regs[i.rs1] ^ 0x80000000) < (regs[i.rs2] ^ 0x80000000) else i.next_pc
+
+def _bge(i, regs, bank, memory):
+    bank.pc = i.target if (regs[i.rs1] ^ 0x80000000) >= (regs[i.rs2] ^ 0x80000000) else i.next_pc
+
+def _bltu(i, regs, bank, memory):
+    bank.pc = i.target if regs[i.rs1] < regs[i.rs2] else i.next_pc
+
+def _bgeu(i, regs, bank, memory):
+    bank.pc = i.target if regs[i.rs1] >= regs[i.rs2] else i.next_pc
+
+def _lui(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = i.imm
+    bank.pc = i.next_pc
+
+def _auipc(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = i.target
+    bank.pc = i.next_pc
+
+def _jal(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = i.next_pc
+    bank.pc = i.target
+
+def _jalr(i, regs, bank, memory):
+    dest = (regs[i.rs1] + i.imm) & 0xfffffffe
+    if i.rd:
+        regs[i.rd] = i.next_pc
+    bank.pc = dest
+
+def _sb(i, regs, bank, memory):
+    memory.store_byte((regs[i.rs1] + i.imm) & MASK_32, regs[i.rs2])
+    bank.pc = i.next_pc
+
+def _sh(i, regs, bank, memory):
+    memory.store_half((regs[i.rs1] + i.imm) & MASK_32, regs[i.rs2])
+    bank.pc = i.next_pc
+
+def _sw(i, regs, bank, memory):
+    memory.store_word((regs[i.rs1] + i.imm) & MASK_32, regs[i.rs2])
+    bank.pc = i.next_pc
+
+def _lb(i, regs, bank, memory):
+    value = memory.load_byte((regs[i.rs1] + i.imm) & MASK_32)
+    if i.rd:
+        regs[i.rd] = ((value ^ 0x80) - 0x80) & MASK_32
+    bank.pc = i.next_pc
+
+def _lh(i, regs, bank, memory):
+    value = memory.load_half((regs[i.rs1] + i.imm) & MASK_32)
+    if i.rd:
+        regs[i.rd] = ((value ^ 0x8000) - 0x8000) & MASK_32
+    bank.pc = i.next_pc
+
+def _lw(i, regs, bank, memory):
+    value = memory.load_word((regs[i.rs1] + i.imm) & MASK_32)
+    if i.rd:
+        regs[i.rd] = value
+    bank.pc = i.next_pc
+
+def _lbu(i, regs, bank, memory):
+    value = memory.load_byte((regs[i.rs1] + i.imm) & MASK_32)
+    if i.rd:
+        regs[i.rd] = value
+    bank.pc = i.next_pc
+
+def _lhu(i, regs, bank, memory):
+    value = memory.load_half((regs[i.rs1] + i.imm) & MASK_32)
+    if i.rd:
+        regs[i.rd] = value
+    bank.pc = i.next_pc
+
+def _addi(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (regs[i.rs1] + i.imm) & MASK_32
+    bank.pc = i.next_pc
+
+def _slti(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = 1 if twos_comp_to_dec(regs[i.rs1]) < i.imm else 0
+    bank.pc = i.next_pc
+
+def _sltiu(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = 1 if regs[i.rs1] < (i.imm & MASK_32) else 0
+    bank.pc = i.next_pc
+
+def _xori(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (regs[i.rs1] ^ i.imm) & MASK_32
+    bank.pc = i.next_pc
+
+def _ori(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (regs[i.rs1] | i.imm) & MASK_32
+    bank.pc = i.next_pc
+
+def _andi(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (regs[i.rs1] & i.imm) & MASK_32
+    bank.pc = i.next_pc
+
+def _slli(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (regs[i.rs1] << (i.imm & 0x1f)) & MASK_32
+    bank.pc = i.next_pc
+
+def _srli(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = regs[i.rs1] >> (i.imm & 0x1f)
+    bank.pc = i.next_pc
+
+def _srai(i, regs, bank, memory):
+    if i.rd:
+        regs[i.rd] = (twos_comp_to_dec(regs[i.rs1]) >> (i.imm & 0x1f)) & MASK_32
+    bank.pc = i.next_pc
+
+def _rtype(function):
+    def handler(i, regs, bank, memory):
+        if i.rd:
+            regs[i.rd] = function(regs[i.rs1], regs[i.rs2]) & MASK_32
+        bank.pc = i.next_pc
+    return handler
+
+_register(0b1110011, ANY_FUNCT3, ANY, OpDescriptor('ebreak', 'E', _ebreak, '', is_end=True))
+for _funct3, _name, _layout in [(0b001, 'csrrw', '{rd}, {csr}, {rs1}'), (0b010, 'csrrs', '{rd}, {csr}, {rs1}'),
+                                (0b011, 'csrrc', '{rd}, {csr}, {rs1}'), (0b101, 'csrrwi', '{rd}, {csr}, {zimm}'),
+                                (0b110, 'csrrsi', '{rd}, {csr}, {zimm}'), (0b111, 'csrrci', '{rd}, {csr}, {zimm}')]:
+    _register(0b1110011, [_funct3], ANY, OpDescriptor(_name, 'C', _csr, _layout))
+
+for _funct3, _name, _handler in [(0b000, 'beq', _beq), (0b001, 'bne', _bne), (0b100, 'blt', _blt),
+                                 (0b101, 'bge', _bge), (0b110, 'bltu', _bltu), (0b111, 'bgeu', _bgeu)]:
+    _register(0b1100011, [_funct3], ANY, OpDescriptor(_name, 'B', _handler, '{rs1}, {rs2}, 0x{target:x}'))
+
+_register(0b0110111, ANY_FUNCT3, ANY, OpDescriptor('lui', 'U', _lui, '{rd}, {uimm}'))
+_register(0b0010111, ANY_FUNCT3, ANY, OpDescriptor('auipc', 'U', _auipc, '{rd}, {uimm}'))
+_register(0b1101111, ANY_FUNCT3, ANY, OpDescriptor('jal', 'J', _jal, '{rd}, 0x{target:x}'))
+_register(0b1100111, [0b000], ANY, OpDescriptor('jalr', 'I', _jalr, '{rd}, {rs1}, 0x{dest:x}'))
+
+for _funct3, _name, _handler in [(0b000, 'sb', _sb), (0b001, 'sh', _sh), (0b010, 'sw', _sw)]:
+    _register(0b0100011, [_funct3], ANY, OpDescriptor(_name, 'S', _handler, '{rs2}, {imm}({rs1})'))
+
+for _funct3, _name, _handler in [(0b000, 'lb', _lb), (0b001, 'lh', _lh), (0b010, 'lw', _lw),
+                                 (0b100, 'lbu', _lbu), (0b101, 'lhu', _lhu)]:
+    _register(0b0000011, [_funct3], ANY, OpDescriptor(_name, 'I', _handler, '{rd}, {imm}({rs1})'))
+
+for _funct3, _name, _handler, _layout in [(0b000, 'addi', _addi, '{rd}, {rs1}, {imm}'),
+                                          (0b010, 'slti', _slti, '{rd}, {rs1}, {imm}'),
+                                          (0b011, 'sltiu', _sltiu, '{rd}, {rs1}, {uimm}'),
+                                          (0b100, 'xori', _xori, '{rd}, {rs1}, {imm}'),
+                                          (0b110, 'ori', _ori, '{rd}, {rs1}, {imm}'),
+                                          (0b111, 'andi', _andi, '{rd}, {rs1}, {imm}')]:
+    _register(0b0010011, [_funct3], ANY, OpDescriptor(_name, 'I', _handler, _layout))
+
+_register(0b0010011, [0b001], [0b0000000], OpDescriptor('slli', 'I', _slli, '{rd}, {rs1}, {shamt}'))
+_register(0b0010011, [0b101], [0b0000000], OpDescriptor('srli', 'I', _srli, '{rd}, {rs1}, {shamt}'))
+_register(0b0010011, [0b101], [0b0100000], OpDescriptor('srai', 'I', _srai, '{rd}, {rs1}, {shamt}'))
+
+for (_funct3, _funct7), (_name, _function) in rtype_helper.OPERATIONS.items():
+    _register(0b0110011, [_funct3], [_funct7], OpDescriptor(_name, 'R', _rtype(_function), '{rd}, {rs1}, {rs2}'))
+
+_ENCODINGS = {}
+for _key, _op in enumerate(_TABLE):
+    if _op is not None:
+        _ENCODINGS.setdefault(_op.name, _key)
@@ -0,0 +1,176 @@
+import mmap
+import struct
+
+from memory import Memory
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+EM_RISCV = 243
+
+PT_LOAD = 1
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+SHT_SYMTAB = 2
+
+STT_NAMES = {0: 'notype', 1: 'object', 2: 'func', 3: 'section', 4: 'file', 6: 'tls'}
+
+_ident = struct.Struct('<4sBBB9x')
+# e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags, e_ehsize, e_phentsize, e_phnum,
+# e_shentsize, e_shnum, e_shstrndx
+_header = struct.Struct('<HHIIIIIHHHHHH')
+# p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align
+_program_header = struct.Struct('<IIIIIIII')
+# sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info, sh_addralign, sh_entsize
+_section_header = struct.Struct('<IIIIIIIIII')
+# st_name, st_value, st_size, st_info, st_other, st_shndx
+_symbol = struct.Struct('<IIIBBH')
+
+class Segment:
+    address: int
+    offset: int
+    file_size: int
+    memory_size: int
+    flags: int
+
+    def __init__(self, address: int, offset: int, file_size: int, memory_size: int, flags: int):
+        self.address = address
+        self.offset = offset
+        self.file_size = file_size
+        self.memory_size = memory_size
+        self.flags = flags
+
+    @property
+    def end(self) -> int:
+        return self.address + self.memory_size
+
+    @property
+    def executable(self) -> bool:
+        return bool(self.flags & PF_X)
+
+class Symbol:
+    name: str
+    address: int
+    size: int
+    kind: str
+
+    def __init__(self, name: str, address: int, size: int, kind: str):
+        self.name = name
+        self.address = address
+        self.size = size
+        self.kind = kind
+
+    def __repr__(self):
+        return f'Symbol({self.name!r}, 0x{self.address:08x}, {self.size}, {self.kind!r})'
+
+class ElfFile:
+    path: str
+    entry: int
+    segments: list[Segment]
+    _file: object
+    _data: mmap.mmap
+    _sections: list[tuple]
+    _symbols: dict[str, Symbol] | None
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+        self._symbols = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        data = getattr(self, '_data', None)
+        if data is not None:
+            data.close()
+            self._data = None
+        self._file.close()
+
+    def _parse(self) -> None:
+        data = self._data
+        if len(data) < _ident.size + _header.size:
+            raise Exception(f'Not an ELF file: {self.path}')
+        magic, elf_class, encoding, _ = _ident.unpack_from(data, 0)
+        if magic != ELF_MAGIC:
+            raise Exception(f'Not an ELF file: {self.path}')
+        if elf_class != ELFCLASS32 or encoding != ELFDATA2LSB:
+            raise Exception(f'Only little-endian ELF32 files are supported: {self.path}')
+        (_, machine, _, self.entry, phoff, shoff, _, _, phentsize, phnum,
+         shentsize, shnum, _) = _header.unpack_from(data, _ident.size)
+        if machine != EM_RISCV:
+            raise Exception(f'Not a RISC-V ELF file (machine {machine}): {self.path}')
+
+        self.segments = []
+        for i in range(phnum):
+            p_type, offset, address, _, file_size, memory_size, flags, _ = \
+                _program_header.unpack_from(data, phoff + i * phentsize)
+            if p_type == PT_LOAD and memory_size:
+                self.segments.append(Segment(address, offset, file_size, memory_size, flags))
+        self._sections = [_section_header.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+
+    def load(self, memory: Memory) -> None:
+        view = memoryview(self._data)
+        try:
+            for n, segment in enumerate(self.segments):
+                # the zero-filled tail (.bss) is left unmapped; its pages are allocated on first write
+                if segment.file_size:
+                    memory.load_image(segment.address, view[segment.offset:segment.offset + segment.file_size],
+                                      f'segment{n}')
+        finally:
+            view.release()
+
+    def end(self) -> int:
+        # past the zero-filled tail of the highest segment
+        return max(segment.end for segment in self.segments)
+
+    def code_range(self) -> tuple[int, int]:
+        code = [segment for segment in self.segments if segment.executable] or self.segments
+        if not code:
+            raise Exception(f'ELF file has no loadable segments: {self.path}')
+        return min(segment.address for segment in code), max(segment.end for segment in code)
+
+    def _string(self, table_offset: int, offset: int) -> str:
+        start = table_offset + offset
+        return self._data[start:self._data.find(b'\0', start)].decode()
+
+    def symbols(self) -> dict[str, Symbol]:
+        if self._symbols is not None:
+            return self._symbols
+        symbols = {}
+        for _, sh_type, _, _, offset, size, link, _, _, entsize in self._sections:
+            if sh_type != SHT_SYMTAB:
+                continue
+            strings = self._sections[link][4]
+            for i in range(1, size // entsize):
+                name, value, sym_size, info, _, shndx = _symbol.unpack_from(self._data, offset + i * entsize)
+                kind = STT_NAMES.get(info & 0xf, 'other')
+                if name == 0 or kind in ('section', 'file') or shndx == 0:
+                    continue
+                name = self._string(strings, name)
+                if name not in symbols or symbols[name].kind == 'notype':
+                    symbols[name] = Symbol(name, value, sym_size, kind)
+        self._symbols = symbols
+        return symbols
+
+    def symbol(self, name: str) -> Symbol | None:
+        return self.symbols().get(name)
+
+    def symbol_at(self, address: int) -> Symbol | None:
+        best = None
+        for symbol in self.symbols().values():
+            if symbol.address <= address and (best is None or symbol.address > best.address):
+                if symbol.size == 0 or address < symbol.address + symbol.size:
+                    best = symbol
+        return best
@@ -0,0 +1,113 @@
+from decoder import Instruction
+from utils import *
+
+class Fused:
+    # two consecutive instructions run by one handler; `first` alone is used when only one more fits
+    __slots__ = ('first', 'second', 'handler', 'pc')
+    size = 2
+    is_end = False
+    synced = False
+
+    def __init__(self, first: Instruction, second: Instruction, handler):
+        self.first = first
+        self.second = second
+        self.handler = handler
+        self.pc = first.pc
+
+def _constant(writes: list[tuple[int, int]], next_pc: int):
+    # both results are known when the pair is decoded; a later write to the same register wins
+    values = {}
+    for rd, value in writes:
+        if rd:
+            values.pop(rd, None)
+            values[rd] = value
+    if len(values) == 1:
+        (rd, value), = values.items()
+
+        def handler(i, regs, bank, memory):
+            regs[rd] = value
+            bank.pc = next_pc
+        return handler
+    (rd1, value1), (rd2, value2) = values.items()
+
+    def handler(i, regs, bank, memory):
+        regs[rd1] = value1
+        regs[rd2] = value2
+        bank.pc = next_pc
+    return handler
+
+def _lui_addi(first: Instruction, second: Instruction):
+    # li/la of a 32-bit constant
+    if second.rs1 != first.rd:
+        return None
+    return _constant([(first.rd, first.imm), (second.rd, (first.imm + second.imm) & MASK_32)], second.next_pc)
+
+def _auipc_addi(first: Instruction, second: Instruction):
+    if second.rs1 != first.rd:
+        return None
+    return _constant([(first.rd, first.target), (second.rd, (first.target + second.imm) & MASK_32)],
+                     second.next_pc)
+
+def _auipc_jalr(first: Instruction, second: Instruction):
+    # call/tail to a pc-relative address
+    if second.rs1 != first.rd:
+        return None
+    target = (first.target + second.imm) & 0xfffffffe
+    return _constant([(first.rd, first.target), (second.rd, second.next_pc)], target)
+
+def _slli_add(first: Instruction, second: Instruction):
+    # scaled array index; the add reads its operands after the shift wrote rd, as in two separate steps
+    if second.rd == 0 or first.rd not in (second.rs1, second.rs2):
+        return None
+    rd1, rs, shamt = first.rd, first.rs1, first.imm & 0x1f
+    rd2, a, b = second.rd, second.rs1, second.rs2
+    next_pc = second.next_pc
+
+    def handler(i, regs, bank, memory):
+        regs[rd1] = (regs[rs] << shamt) & MASK_32
+        regs[rd2] = (regs[a] + regs[b]) & MASK_32
+        bank.pc = next_pc
+    return handler
+
+_COMPARES = {
+    'slt': lambda regs, a, b: int((regs[a] ^ 0x80000000) < (regs[b] ^ 0x80000000)),
+    'sltu': lambda regs, a, b: int(regs[a] < regs[b]),
+    'slti': lambda regs, a, b: int((regs[a] ^ 0x80000000) < (b ^ 0x80000000)),
+    'sltiu': lambda regs, a, b: int(regs[a] < b),
+}
+
+def _compare_branch(first: Instruction, second: Instruction):
+    # set-less-than feeding beq/bne
+    if first.rd not in (second.rs1, second.rs2):
+        return None
+    compare = _COMPARES[first.name]
+    rd, a = first.rd, first.rs1
+    b = first.rs2 if first.op.format == 'R' else first.imm & MASK_32
+    x, y = second.rs1, second.rs2
+    on_equal = second.name == 'beq'
+    target, next_pc = second.target, second.next_pc
+
+    def handler(i, regs, bank, memory):
+        regs[rd] = compare(regs, a, b)
+        bank.pc = target if (regs[x] == regs[y]) == on_equal else next_pc
+    return handler
+
+PATTERNS = {
+    ('lui', 'addi'): _lui_addi,
+    ('auipc', 'addi'): _auipc_addi,
+    ('auipc', 'jalr'): _auipc_jalr,
+    ('slli', 'add'): _slli_add,
+}
+for _compare in _COMPARES:
+    for _branch in ('beq', 'bne'):
+        PATTERNS[_compare, _branch] = _compare_branch
+
+def fuse(first: Instruction, second: Instruction) -> Fused | None:
+    build = PATTERNS.get((first.name, second.name))
+    if build is None or first.rd == 0 or second.pc != first.next_pc:
+        return None
+    if first.handler is not first.op.handler or second.handler is not second.op.handler:
+        # an observer wrapped one of them
+        return None
+    handler = build(first, second)
+    return None if handler is None else Fused(first, second, handler)
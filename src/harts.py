@@ -0,0 +1,212 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import elf
+import main
+import tracing
+from instructions import InstructionsCache
+from memory import Memory, page_align, page_align_up
+from register import RegisterBank
+from simulator import Simulator
+
+SCHEDULERS = ('round-robin', 'parallel')
+DEFAULT_QUANTUM = 1000
+
+class Layout:
+    # where the program lives in the shared block: regions are (name, base, size), packed in order
+    regions: list[tuple[str, int, int]]
+    size: int
+
+    def __init__(self, regions: list[tuple[str, int, int]]):
+        self.regions = regions
+        self.size = sum(size for _, _, size in regions)
+
+def layout(path: str, harts: int) -> Layout:
+    # every address the program can reach through its image, .bss or stacks, merged into page-aligned
+    # regions; pages outside them would be private to each worker process
+    if path.endswith('.bin'):
+        # a flat binary has no segment table, so its .bss and heap can be anywhere up to the stacks
+        ranges = [(main.MEM_OFFSET, main.STACK_TOP)]
+    else:
+        with elf.ElfFile(path) as program:
+            ranges = [(segment.address, segment.end) for segment in program.segments]
+    ranges.append((main.STACK_TOP - harts * main.STACK_SIZE, main.STACK_TOP))
+    merged = []
+    for start, end in sorted((page_align(start), page_align_up(end)) for start, end in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return Layout([(f'shared{n}', start, end - start) for n, (start, end) in enumerate(merged)])
+
+def attach(block: shared_memory.SharedMemory, program_layout: Layout) -> Memory:
+    memory = Memory()
+    offset = 0
+    for name, base, size in program_layout.regions:
+        memory.add_region(name, base, size, block.buf[offset:offset + size])
+        offset += size
+    return memory
+
+def _open_trace(path: str, hartid: int, trace_level: str):
+    name = os.path.join('test/', f'{main.program_name(path)}.hart{hartid}')
+    return tracing.open_trace(name, trace_level, 'text')
+
+class Hart:
+    simulator: Simulator
+    trace_file: object
+
+    def __init__(self, simulator: Simulator, trace_file):
+        self.simulator = simulator
+        self.trace_file = trace_file
+
+def build_hart(path: str, memory: Memory, cache: InstructionsCache, entry: int, hartid: int,
+               trace_level: str) -> Hart:
+    # harts start at the entry point with zeroed registers; guests pick their stacks from mhartid
+    trace, trace_file = _open_trace(path, hartid, trace_level)
+    sim = Simulator(cache, RegisterBank(hartid=hartid), memory, trace, entry)
+    sim.reset()
+    return Hart(sim, trace_file)
+
+def _result(hartid: int, sim: Simulator, status: str, error: str | None = None) -> dict:
+    bank = sim.register_bank
+    return {'hart': hartid, 'status': status, 'instructions': sim.clock, 'pc': bank.pc,
+            'registers': list(bank.regs), 'error': error}
+
+def run_round_robin(path: str, harts: int, quantum: int = DEFAULT_QUANTUM, engine: str = 'interpreter',
+                    max_instructions: int | None = None, trace_level: str = 'off') -> list[dict]:
+    # one process, harts interleaved in fixed quanta: every run gives the same interleaving
+    memory = Memory()
+    for name, base, size in layout(path, harts).regions:
+        memory.add_region(name, base, size)
+    entry, code_start, code_end = main.load_program(path, memory)
+    cache = InstructionsCache(4, memory, code_start, code_end)
+    machines = [build_hart(path, memory, cache, entry, hartid, trace_level) for hartid in range(harts)]
+    results = [None] * harts
+    running = list(range(harts))
+    try:
+        while running:
+            for hartid in list(running):
+                sim = machines[hartid].simulator
+                budget = quantum if max_instructions is None else min(quantum, max_instructions - sim.clock)
+                # the harts share the memory, so watchpoints report the pc of the one that is running
+                memory.pc_source = lambda bank=sim.register_bank: bank.pc
+                try:
+                    sim.run_for(budget, engine == 'block')
+                except Exception:
+                    results[hartid] = _result(hartid, sim, 'error', traceback.format_exc())
+                    running.remove(hartid)
+                    continue
+                if sim.finished or sim.clock == max_instructions:
+                    results[hartid] = _result(hartid, sim, 'ok' if sim.finished else 'budget')
+                    running.remove(hartid)
+    finally:
+        for hart in machines:
+            hart.simulator.finish_trace()
+            if hart.trace_file is not None:
+                hart.trace_file.close()
+    return results
+
+def _run_hart(path: str, block: shared_memory.SharedMemory, program_layout: Layout, code_range: tuple[int, int],
+              entry: int, hartid: int, engine: str, max_instructions: int | None, trace_level: str) -> dict:
+    memory = attach(block, program_layout)
+    hart = build_hart(path, memory, InstructionsCache(4, memory, *code_range), entry, hartid, trace_level)
+    sim = hart.simulator
+    try:
+        if engine == 'block':
+            sim.simulate_blocks(max_instructions, resume=True)
+        else:
+            sim.simulate(max_instructions, resume=True)
+        return _result(hartid, sim, 'ok' if sim.finished else 'budget')
+    except Exception:
+        return _result(hartid, sim, 'error', traceback.format_exc())
+    finally:
+        if hart.trace_file is not None:
+            hart.trace_file.close()
+
+def _hart_worker(path: str, block_name: str, program_layout: Layout, code_range: tuple[int, int], entry: int,
+                 hartid: int, engine: str, max_instructions: int | None, trace_level: str, results) -> None:
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        results.put(_run_hart(path, block, program_layout, code_range, entry, hartid, engine, max_instructions,
+                              trace_level))
+    finally:
+        # the simulator and its memory reference each other, so their views into the block only go away
+        # once the cycle is collected
+        gc.collect()
+        block.close()
+
+def _load_shared(path: str, block: shared_memory.SharedMemory, program_layout: Layout) -> tuple[int, int, int]:
+    return main.load_program(path, attach(block, program_layout))
+
+def run_parallel(path: str, harts: int, engine: str = 'interpreter', max_instructions: int | None = None,
+                 trace_level: str = 'off') -> list[dict]:
+    # one process per hart over a shared_memory block; the interleaving is up to the host scheduler, and
+    # stores to code are only seen by the hart that made them
+    program_layout = layout(path, harts)
+    block = shared_memory.SharedMemory(create=True, size=program_layout.size)
+    try:
+        entry, code_start, code_end = _load_shared(path, block, program_layout)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_hart_worker, args=(
+            path, block.name, program_layout, (code_start, code_end), entry, hartid, engine, max_instructions,
+            trace_level, results)) for hartid in range(harts)]
+        for worker in workers:
+            worker.start()
+        collected = {}
+        while len(collected) < harts:
+            try:
+                result = results.get(timeout=0.5)
+            except queue.Empty:
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                break
+            collected[result['hart']] = result
+        for worker in workers:
+            worker.join()
+        for hartid, worker in enumerate(workers):
+            if hartid not in collected:
+                collected[hartid] = {'hart': hartid, 'status': 'error', 'instructions': 0, 'pc': 0,
+                                     'registers': [0] * 32, 'error': f'worker exited with code {worker.exitcode}\n'}
+        return [collected[hartid] for hartid in range(harts)]
+    finally:
+        block.close()
+        block.unlink()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a program on several harts that share its memory')
+    parser.add_argument('program')
+    parser.add_argument('--harts', type=int, default=2)
+    parser.add_argument('--schedule', choices=SCHEDULERS, default='round-robin',
+                        help='deterministic quanta in one process, or one worker process per hart')
+    parser.add_argument('--quantum', type=int, default=DEFAULT_QUANTUM,
+                        help='instructions each hart runs before the next one in round-robin mode')
+    parser.add_argument('--engine', choices=['interpreter', 'block'], default='interpreter')
+    parser.add_argument('--max-instructions', type=int, default=None, help='instruction budget of each hart')
+    parser.add_argument('--trace', choices=['off', 'full'], default='off',
+                        help='write test/<program>.hart<N>.log for every hart')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = time.perf_counter()
+    if args.schedule == 'parallel':
+        results = run_parallel(args.program, args.harts, args.engine, args.max_instructions, args.trace)
+    else:
+        results = run_round_robin(args.program, args.harts, args.quantum, args.engine, args.max_instructions,
+                                  args.trace)
+    seconds = time.perf_counter() - start
+    for result in results:
+        print(f'hart {result["hart"]}: {result["status"]} {result["instructions"]} instructions'
+              f' pc={result["pc"]:08x} a0={result["registers"][10]:08x}')
+        if result['error']:
+            print(result['error'], end='')
+    total = sum(result['instructions'] for result in results)
+    print(f'{total} instructions in {seconds:.2f}s ({total / seconds / 1e6:.3f} MIPS)')
+    sys.exit(1 if any(result['status'] == 'error' for result in results) else 0)
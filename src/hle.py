@@ -0,0 +1,204 @@
+import argparse
+import json
+import sys
+from collections.abc import Callable
+
+import decoder
+import elf
+from decoder import OpDescriptor
+from memory import Memory, PAGE_SIZE, page_align, page_align_up
+from utils import *
+
+# Linux numbering, as used by newlib and the RISC-V proxy kernels: a7 selects the call, a0-a2 are the
+# arguments and a0 the result
+SYS_CLOSE = 57
+SYS_WRITE = 64
+SYS_EXIT = 93
+SYS_EXIT_GROUP = 94
+SYS_BRK = 214
+
+EBADF = 9
+ENOSYS = 38
+
+STDOUT = 1
+STDERR = 2
+
+def _memcpy(memory: Memory, dest: int, src: int, size: int) -> int:
+    memory.write(dest, memory.read(src, size))
+    return dest
+
+def _memset(memory: Memory, dest: int, value: int, size: int) -> int:
+    # writes a page at a time, so a huge size only costs the pages the guest really fills
+    fill = bytes([value & 0xff]) * PAGE_SIZE
+    address = dest
+    while size:
+        chunk = min(size, page_align(address) + PAGE_SIZE - address)
+        memory.write(address, fill[:chunk])
+        address = (address + chunk) & MASK_32
+        size -= chunk
+    return dest
+
+def _string(memory: Memory, address: int) -> bytes:
+    # reads a page at a time up to the terminating zero
+    data = b''
+    while True:
+        chunk = memory.read(address, page_align(address) + PAGE_SIZE - address)
+        end = chunk.find(b'\0')
+        if end >= 0:
+            return data + chunk[:end]
+        data += chunk
+        address = (address + len(chunk)) & MASK_32
+
+def _strlen(memory: Memory, address: int, _, __) -> int:
+    return len(_string(memory, address))
+
+def _compare(first: bytes, second: bytes) -> int:
+    for a, b in zip(first, second):
+        if a != b:
+            return a - b
+    return 0
+
+def _memcmp(memory: Memory, first: int, second: int, size: int) -> int:
+    return _compare(memory.read(first, size), memory.read(second, size))
+
+def _strcmp(memory: Memory, first: int, second: int, _) -> int:
+    a = _string(memory, first) + b'\0'
+    b = _string(memory, second) + b'\0'
+    return _compare(a, b)
+
+# routines run on the host with a0-a2 as arguments; the result goes to a0 and execution returns to ra
+ROUTINES = {
+    'memcpy': _memcpy,
+    'memmove': _memcpy,
+    'memset': _memset,
+    'strlen': _strlen,
+    'memcmp': _memcmp,
+    'strcmp': _strcmp,
+}
+
+class HostServices:
+    output: object
+    exit_code: int | None
+    brk: int
+    _heap_start: int
+
+    def __init__(self, output, heap_start: int):
+        self.output = output
+        self.exit_code = None
+        self.brk = self._heap_start = heap_start
+
+    def state(self) -> dict[str, int]:
+        # what a checkpoint has to keep for the run to go on where it stopped
+        state = {'brk': self.brk}
+        if self.exit_code is not None:
+            state['exit_code'] = self.exit_code
+        return state
+
+    def restore(self, state: dict[str, int]) -> None:
+        self.brk = state.get('brk', self._heap_start)
+        self.exit_code = state.get('exit_code')
+
+    def install(self, decoder_: decoder.Decoder) -> None:
+        decoder_.on_ecall(OpDescriptor('ecall', 'E', self._ecall, '', is_end=True, registers=(10, 17, 10)))
+
+    def _ecall(self, i, regs, bank, memory):
+        number = regs[17]
+        if number in (SYS_EXIT, SYS_EXIT_GROUP):
+            # the pc stays on the ecall, which ends the program
+            self.exit_code = twos_comp_to_dec(regs[10])
+            return
+        if number == SYS_WRITE:
+            result = self._write(memory, regs[10], regs[11], regs[12])
+        elif number == SYS_BRK:
+            result = self._brk(regs[10])
+        elif number == SYS_CLOSE:
+            result = 0
+        else:
+            result = -ENOSYS
+        regs[10] = result & MASK_32
+        bank.pc = i.next_pc
+
+    def _write(self, memory: Memory, fd: int, address: int, size: int) -> int:
+        if fd not in (STDOUT, STDERR):
+            return -EBADF
+        self.output.write(memory.read(address, size))
+        return size
+
+    def _brk(self, address: int) -> int:
+        # pages are mapped on first use, so moving the break only has to remember it
+        if address >= self._heap_start:
+            self.brk = address
+        return self.brk
+
+def _routine(function: Callable[[Memory, int, int, int], int]) -> Callable:
+    def handler(i, regs, bank, memory):
+        regs[10] = function(memory, regs[10], regs[11], regs[12]) & MASK_32
+        bank.pc = regs[1] & 0xfffffffe
+    return handler
+
+def intercept(decoder_: decoder.Decoder, routines: dict[str, int]) -> None:
+    # a call to the routine's entry runs the host version in one step and returns to ra
+    for name, address in routines.items():
+        decoder_.hook(address, OpDescriptor('hle', 'E', _routine(ROUTINES[name]), name, is_terminator=True,
+                                            registers=(10, 10, 11)))
+
+def heap_start(program_end: int) -> int:
+    # program_end covers the .bss, which is only mapped once written
+    return page_align_up(program_end)
+
+def load_signatures(path: str) -> dict[str, list[bytes]]:
+    # {"memcpy": ["00050793", ...], ...}: the instruction words of each known compiled routine
+    with open(path) as f:
+        entries = json.load(f)
+    signatures = {}
+    for name, words in entries.items():
+        if name not in ROUTINES:
+            raise Exception(f'Unknown routine in {path}: {name}')
+        if words and isinstance(words[0], str):
+            words = [words]
+        signatures[name] = [b''.join(int(word, 16).to_bytes(4, 'little') for word in body) for body in words]
+    return signatures
+
+def find_routines(path: str, image: bytes, image_start: int, names: list[str],
+                  signatures: dict[str, list[bytes]] | None = None) -> dict[str, int]:
+    # by symbol when the ELF has one, otherwise by the first aligned copy of a known body in the code
+    symbols = {}
+    if not path.endswith('.bin'):
+        with elf.ElfFile(path) as program:
+            symbols = program.symbols()
+    found = {}
+    for name in names:
+        symbol = symbols.get(name)
+        if symbol is not None and symbol.kind == 'func':
+            found[name] = symbol.address
+            continue
+        for body in (signatures or {}).get(name, []):
+            offset = image.find(body)
+            while offset >= 0 and (image_start + offset) % 4:
+                offset = image.find(body, offset + 1)
+            if offset >= 0:
+                found[name] = image_start + offset
+                break
+    return found
+
+def signature(path: str, name: str) -> list[str]:
+    with elf.ElfFile(path) as program:
+        symbol = program.symbol(name)
+        if symbol is None or not symbol.size:
+            raise Exception(f'No sized symbol {name} in {path}')
+        memory = Memory()
+        program.load(memory)
+    data = memory.read(symbol.address, symbol.size)
+    return [f'{int.from_bytes(data[i:i + 4], "little"):08x}' for i in range(0, len(data), 4)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Print the signature of routines of an ELF program, to find'
+                                                 ' them by their code in programs without symbols')
+    parser.add_argument('program')
+    parser.add_argument('routines', nargs='+', choices=sorted(ROUTINES))
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    json.dump({name: signature(args.program, name) for name in args.routines}, sys.stdout, indent=1)
+    print()
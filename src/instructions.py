@@ -1,29 +1,52 @@
-import io
 from memory import Memory
-from utils import dec_to_twos_comp
 
 class InstructionsCache:
     _memory: Memory
     _instr_size: int
+    _decoded: dict
+    _listeners: list
+    start: int
+    end: int
 
-    def __init__(self, path: str, instr_size: int, memory: Memory, offset: int):
+    def __init__(self, instr_size: int, memory: Memory, start: int, end: int):
         self._instr_size = instr_size
         self._memory = memory
-        self._fill_memory(path, offset)
+        self._decoded = {}
+        self._listeners = []
+        self.start = start
+        self.end = end
+        memory.watch_code(start, end, self.invalidate)
 
-    def _fill_memory(self, path, offset):
-        i = offset
-        with open(path, 'rb') as f:
-            while True:
-                value = f.read(1)
-                if value == b'': break
-                value = dec_to_twos_comp(int.from_bytes(value, 'little'), 8)
-                self._memory.save_byte(i, value)
-                i += 1
+    def load_instruction(self, address: int) -> int:
+        # fetches are not data reads, so they skip read watchpoints
+        return Memory.load_word(self._memory, address)
 
-    def close(self):
-        self._file.close()
+    def get_decoded(self, address: int):
+        return self._decoded.get(address)
 
-    def load_instruction(self, address: int) -> int:
-        return ''.join(
-            reversed([self._memory.load_byte(address + i) for i in range(4)]))
\ No newline at end of file
+    def store_decoded(self, address: int, instruction) -> None:
+        self._decoded[address] = instruction
+
+    def code_image(self) -> bytes:
+        return self._memory.read(self.start, self.end - self.start)
+
+    def fork(self, memory: Memory) -> 'InstructionsCache':
+        # decoded instructions hold no machine state, so the child starts with the same ones
+        child = InstructionsCache(self._instr_size, memory, self.start, self.end)
+        child._decoded = dict(self._decoded)
+        return child
+
+    def clear(self) -> None:
+        self._decoded.clear()
+
+    def on_invalidate(self, listener) -> None:
+        self._listeners.append(listener)
+
+    def invalidate(self, address: int, width: int) -> None:
+        mask = ~(self._instr_size - 1)
+        first = address & mask
+        last = (address + width - 1) & mask
+        for word in {first, last}:
+            self._decoded.pop(word, None)
+            for listener in self._listeners:
+                listener(word)
@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import random
+import sys
+
+import checkpoint
+import decoder
+import main
+from instructions import InstructionsCache
+from memory import Memory, PAGE_BITS
+from register import RegisterBank, REGISTER_ALIASES
+from simulator import Simulator
+import tracing
+from utils import MASK_32
+
+ENGINES = main.ENGINES
+DEFAULT_INTERVAL = 1000
+
+FUZZ_BASE = 0x1000
+FUZZ_DATA = 0x40000
+FUZZ_DATA_SIZE = 0x2000
+# x31 holds the data pointer used by loads and stores, x30 the base of jalr jumps
+_DATA_REG = 31
+_JUMP_REG = 30
+_FUZZ_REGS = range(1, 30)
+
+class Engine:
+    name: str
+    simulator: Simulator
+    dirty: set[int]
+    error: str | None
+
+    def __init__(self, name: str, simulator: Simulator):
+        self.name = name
+        self.simulator = simulator
+        self.dirty = simulator.memory.track_dirty()
+        self.error = None
+        simulator.reset()
+
+    def advance(self, limit: int) -> None:
+        if self.error is not None or self.simulator.finished:
+            return
+        try:
+            if self.name == 'block':
+                self.simulator.simulate_blocks(limit, resume=True)
+            elif self.name == 'fused':
+                self.simulator.simulate_fused(limit, resume=True)
+            else:
+                self.simulator.simulate(limit, resume=True)
+        except Exception as error:
+            self.error = f'{type(error).__name__}: {error}'
+
+    def save(self) -> checkpoint.Checkpoint:
+        return self.simulator.snapshot()
+
+    def restore(self, state: checkpoint.Checkpoint) -> None:
+        self.simulator.restore(state)
+        self.dirty.clear()
+        self.error = None
+
+class Divergence:
+    instruction: int
+    pc: int
+    disassembly: str
+    differences: list[str]
+
+    def __init__(self, instruction: int, pc: int, disassembly: str, differences: list[str]):
+        self.instruction = instruction
+        self.pc = pc
+        self.disassembly = disassembly
+        self.differences = differences
+
+    def report(self) -> str:
+        lines = [f'Engines diverge at instruction {self.instruction}, PC={self.pc:08x}: {self.disassembly}']
+        lines += ['  ' + difference for difference in self.differences]
+        return '\n'.join(lines)
+
+def _page_hash(memory: Memory, page: int) -> bytes:
+    return hashlib.blake2b(memory.page_data(page), digest_size=16).digest()
+
+def compare(a: Engine, b: Engine, pages: set[int]) -> list[str]:
+    sim_a, sim_b = a.simulator, b.simulator
+    differences = []
+    if a.error != b.error:
+        differences.append(f'error: {a.name} {a.error}, {b.name} {b.error}')
+    if sim_a.finished != sim_b.finished:
+        differences.append(f'finished: {a.name} {sim_a.finished}, {b.name} {sim_b.finished}')
+    if sim_a.clock != sim_b.clock:
+        differences.append(f'instructions: {a.name} {sim_a.clock}, {b.name} {sim_b.clock}')
+    bank_a, bank_b = sim_a.register_bank, sim_b.register_bank
+    if bank_a.pc != bank_b.pc:
+        differences.append(f'pc: {a.name} {bank_a.pc:08x}, {b.name} {bank_b.pc:08x}')
+    for idx, (value_a, value_b) in enumerate(zip(bank_a.regs, bank_b.regs)):
+        if value_a != value_b:
+            differences.append(f'x{idx:02d} ({REGISTER_ALIASES[idx]}): {a.name} {value_a:08x}, {b.name} {value_b:08x}')
+    for page in sorted(pages):
+        if _page_hash(sim_a.memory, page) == _page_hash(sim_b.memory, page):
+            continue
+        data_a, data_b = sim_a.memory.page_data(page), sim_b.memory.page_data(page)
+        offset = next(i for i in range(len(data_a)) if data_a[i] != data_b[i])
+        address = (page << PAGE_BITS) + offset
+        differences.append(f'memory {address:08x}: {a.name} {data_a[offset]:02x}, {b.name} {data_b[offset]:02x}')
+    return differences
+
+def _check(a: Engine, b: Engine) -> list[str]:
+    pages = a.dirty | b.dirty
+    a.dirty.clear()
+    b.dirty.clear()
+    return compare(a, b, pages)
+
+def _describe(engine: Engine) -> tuple[int, str]:
+    sim = engine.simulator
+    pc = sim.register_bank.pc
+    try:
+        instr = sim.decoder.build_instruction(sim.memory.load_word(pc), pc)
+        return pc, f'{instr.name} {instr.mnem(sim.register_bank.regs[instr.rs1])}'.rstrip()
+    except Exception as error:
+        return pc, f'<{error}>'
+
+def bisect(a: Engine, b: Engine, states: tuple, good: int, bad: int) -> Divergence:
+    # states holds both engines' snapshots taken after `good` instructions, where they agreed
+    while bad - good > 1:
+        middle = (good + bad) // 2
+        a.restore(states[0])
+        b.restore(states[1])
+        a.advance(middle)
+        b.advance(middle)
+        if _check(a, b):
+            bad = middle
+        else:
+            good = middle
+            states = (a.save(), b.save())
+    a.restore(states[0])
+    b.restore(states[1])
+    pc, disassembly = _describe(a)
+    a.advance(bad)
+    b.advance(bad)
+    return Divergence(good, pc, disassembly, _check(a, b))
+
+def run(a: Engine, b: Engine, interval: int = DEFAULT_INTERVAL, max_instructions: int | None = None) -> Divergence | None:
+    good = 0
+    states = (a.save(), b.save())
+    while True:
+        limit = good + interval
+        if max_instructions is not None:
+            limit = min(limit, max_instructions)
+        a.advance(limit)
+        b.advance(limit)
+        if _check(a, b):
+            return bisect(a, b, states, good, limit)
+        done = a.simulator.finished or a.error is not None
+        if done or limit == max_instructions:
+            return None
+        good = limit
+        states = (a.save(), b.save())
+
+def _signed(value: int) -> int:
+    return value - (1 << 32) if value & 0x80000000 else value
+
+def _spec_div(a: int, b: int) -> int:
+    # rounds toward zero; division by zero gives all ones and -2**31 / -1 overflows back to -2**31
+    a, b = _signed(a), _signed(b)
+    if b == 0:
+        return -1
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def _spec_rem(a: int, b: int) -> int:
+    # whatever makes quotient * divisor + remainder the dividend; by zero the dividend itself
+    if b == 0:
+        return a
+    return _signed(a) - _signed(b) * _spec_div(a, b)
+
+def _spec_divu(a: int, b: int) -> int:
+    return MASK_32 if b == 0 else a // b
+
+def _spec_remu(a: int, b: int) -> int:
+    return a if b == 0 else a - b * (a // b)
+
+# the RV32IM ALU as the spec describes it, written apart from rtype_helper, which every engine shares; operands
+# and results are unsigned 32-bit values, and the I-type forms get the sign-extended immediate as b
+SPEC = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'sll': lambda a, b: a << (b & 0x1f),
+    'srl': lambda a, b: a >> (b & 0x1f),
+    'sra': lambda a, b: _signed(a) >> (b & 0x1f),
+    'slt': lambda a, b: int(_signed(a) < _signed(b)),
+    'sltu': lambda a, b: int(a < b),
+    'xor': lambda a, b: a ^ b,
+    'or': lambda a, b: a | b,
+    'and': lambda a, b: a & b,
+    'mul': lambda a, b: a * b,
+    'mulh': lambda a, b: (_signed(a) * _signed(b)) >> 32,
+    'mulhsu': lambda a, b: (_signed(a) * b) >> 32,
+    'mulhu': lambda a, b: (a * b) >> 32,
+    'div': _spec_div,
+    'divu': _spec_divu,
+    'rem': _spec_rem,
+    'remu': _spec_remu,
+}
+for _immediate, _name in [('addi', 'add'), ('slti', 'slt'), ('sltiu', 'sltu'), ('xori', 'xor'), ('ori', 'or'),
+                          ('andi', 'and'), ('slli', 'sll'), ('srli', 'srl'), ('srai', 'sra')]:
+    SPEC[_immediate] = SPEC[_name]
+
+class SpecCheck(tracing.TraceSink):
+    # checks the result of every retired ALU and M instruction against SPEC
+    mismatches: dict[str, None]
+
+    def __init__(self):
+        self.mismatches = {}
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        spec = SPEC.get(instr.name)
+        if spec is None or instr.rd == 0:
+            return
+        b = rs2_value if instr.op.format == 'R' else instr.imm & MASK_32
+        expected = spec(rs1_value, b) & MASK_32
+        if rd_value != expected:
+            # an ordered set, as bisecting runs instructions again
+            self.mismatches[f'{instr.pc:08x} {instr.name} {rs1_value:08x}, {b:08x}: {rd_value:08x},'
+                            f' expected {expected:08x}'] = None
+
+def engines_for_program(path: str, names: tuple[str, str]) -> tuple[Engine, Engine]:
+    return tuple(Engine(name, main.build_simulator(path)) for name in names)
+
+def engines_for_image(image: bytes, address: int, names: tuple[str, str],
+                      check: bool = False) -> tuple[Engine, Engine]:
+    # with check, each engine also feeds a SpecCheck through its trace
+    engines = []
+    for name in names:
+        memory = Memory()
+        memory.add_region('data', FUZZ_DATA, FUZZ_DATA_SIZE)
+        memory.load_image(address, image)
+        cache = InstructionsCache(4, memory, address, address + len(image))
+        trace = SpecCheck() if check else None
+        engines.append(Engine(name, Simulator(cache, RegisterBank(), memory, trace, address)))
+    return tuple(engines)
+
+_FUZZ_R = ['add', 'sub', 'sll', 'slt', 'sltu', 'xor', 'srl', 'sra', 'or', 'and',
+           'mul', 'mulh', 'mulhsu', 'mulhu', 'div', 'divu', 'rem', 'remu']
+_FUZZ_I = ['addi', 'slti', 'sltiu', 'xori', 'ori', 'andi']
+_FUZZ_SHIFTS = ['slli', 'srli', 'srai']
+_FUZZ_LOADS = ['lb', 'lh', 'lw', 'lbu', 'lhu']
+_FUZZ_STORES = ['sb', 'sh', 'sw']
+_FUZZ_BRANCHES = ['beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu']
+_FUZZ_CSRS = [decoder.CSR_CYCLE, decoder.CSR_TIME, decoder.CSR_INSTRET, decoder.CSR_CYCLEH, decoder.CSR_MHARTID]
+_INTERESTING = [0, 1, 2, 0x7fffffff, 0x80000000, 0xffffffff, 0xfffffffe, 0x80000001, 31, 32, 0xffff, 0x8000]
+
+def _load_constant(words: list[int], rd: int, value: int) -> None:
+    upper = ((value + 0x800) >> 12) & 0xfffff
+    lower = value - (upper << 12)
+    lower = ((lower + 0x800) & 0xfff) - 0x800
+    words.append(decoder.encode('lui', rd, imm=upper << 12))
+    words.append(decoder.encode('addi', rd, rd, imm=lower))
+
+def generate(seed: int, length: int = 200) -> bytes:
+    rng = random.Random(seed)
+    words = []
+    _load_constant(words, _DATA_REG, FUZZ_DATA + FUZZ_DATA_SIZE // 2)
+    _load_constant(words, _JUMP_REG, FUZZ_BASE)
+    for rd in _FUZZ_REGS:
+        value = rng.choice(_INTERESTING) if rng.random() < 0.3 else rng.getrandbits(32)
+        _load_constant(words, rd, value)
+    body_start = len(words)
+    end = body_start + length
+    while len(words) < end:
+        kind = rng.random()
+        rd, rs1, rs2 = rng.choice(_FUZZ_REGS), rng.choice(_FUZZ_REGS), rng.choice(_FUZZ_REGS)
+        remaining = end - len(words)
+        if kind < 0.34:
+            words.append(decoder.encode(rng.choice(_FUZZ_R), rd, rs1, rs2))
+        elif kind < 0.35:
+            words.append(decoder.encode(rng.choice(['csrrs', 'csrrc']), rd, imm=rng.choice(_FUZZ_CSRS)))
+        elif kind < 0.55:
+            words.append(decoder.encode(rng.choice(_FUZZ_I), rd, rs1, imm=rng.randrange(-2048, 2048)))
+        elif kind < 0.62:
+            words.append(decoder.encode(rng.choice(_FUZZ_SHIFTS), rd, rs1, imm=rng.randrange(32)))
+        elif kind < 0.67:
+            words.append(decoder.encode(rng.choice(['lui', 'auipc']), rd, imm=rng.getrandbits(20) << 12))
+        elif kind < 0.77:
+            words.append(decoder.encode(rng.choice(_FUZZ_LOADS), rd, _DATA_REG, imm=rng.randrange(-2048, 2048)))
+        elif kind < 0.87:
+            words.append(decoder.encode(rng.choice(_FUZZ_STORES), rs1=_DATA_REG, rs2=rs2,
+                                        imm=rng.randrange(-2048, 2048)))
+        elif kind < 0.95:
+            offset = rng.randrange(1, min(remaining, 16) + 1) * 4
+            words.append(decoder.encode(rng.choice(_FUZZ_BRANCHES), rs1=rs1, rs2=rs2, imm=offset))
+        elif kind < 0.98 or remaining < 3:
+            offset = rng.randrange(1, min(remaining, 16) + 1) * 4
+            words.append(decoder.encode('jal', rng.choice([0, rd]), imm=offset))
+        else:
+            # auipc x30, 0; jalr rd, x30, forward
+            offset = rng.randrange(2, min(remaining, 16) + 1) * 4
+            words.append(decoder.encode('auipc', _JUMP_REG, imm=0))
+            words.append(decoder.encode('jalr', rng.choice([0, rd]), _JUMP_REG, imm=offset))
+    words.append(decoder.encode('ebreak', imm=1))
+    return b''.join(word.to_bytes(4, 'little') for word in words)
+
+def fuzz(count: int, seed: int, length: int, names: tuple[str, str], interval: int):
+    for n in range(count):
+        program_seed = seed + n
+        a, b = engines_for_image(generate(program_seed, length), FUZZ_BASE, names, check=True)
+        divergence = run(a, b, interval, max_instructions=10 * length + 100)
+        mismatches = [f'{engine.name}: {mismatch}' for engine in (a, b)
+                      for mismatch in engine.simulator.trace.mismatches]
+        yield program_seed, divergence, mismatches
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run two engines side by side and report where they diverge')
+    parser.add_argument('programs', nargs='*', help='programs to compare (default: every test program)')
+    parser.add_argument('--engines', default='interpreter,block',
+                        help='two comma-separated engines: ' + ', '.join(ENGINES))
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL,
+                        help='instructions between state comparisons')
+    parser.add_argument('--max-instructions', type=int, default=None)
+    parser.add_argument('--fuzz', type=int, default=0, metavar='COUNT',
+                        help='compare COUNT randomly generated RV32IM programs instead of the test programs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first generated program')
+    parser.add_argument('--length', type=int, default=200, help='instructions in each generated program')
+    args = parser.parse_args()
+    args.engines = tuple(args.engines.split(','))
+    if len(args.engines) != 2 or any(name not in ENGINES for name in args.engines):
+        parser.error(f'--engines needs two of: {", ".join(ENGINES)}')
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    failures = 0
+    if args.fuzz:
+        for seed, divergence, mismatches in fuzz(args.fuzz, args.seed, args.length, args.engines, args.interval):
+            if divergence is not None or mismatches:
+                failures += 1
+                print(f'seed {seed}:')
+            if divergence is not None:
+                print(divergence.report())
+            for mismatch in mismatches:
+                print(f'  spec: {mismatch}')
+        print(f'{args.fuzz - failures}/{args.fuzz} generated programs match')
+    else:
+        paths = args.programs or [test.path for test in main.find_tests()]
+        for path in paths:
+            a, b = engines_for_program(path, args.engines)
+            divergence = run(a, b, args.interval, args.max_instructions)
+            if divergence is None:
+                print(f'{main.program_name(path)}: match ({a.simulator.clock} instructions)')
+            else:
+                failures += 1
+                print(f'{main.program_name(path)}:')
+                print(divergence.report())
+    sys.exit(1 if failures else 0)
@@ -1,30 +1,433 @@
+import argparse
+import contextlib
+import json
 import os
+import signal
+import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from simulator import Simulator
 from instructions import InstructionsCache
 from memory import Memory
 from register import RegisterBank
+import checkpoint
+import elf
+import hle
+import pipeline
+import profiler
+import progcache
+import stats
+import tracing
+import translator
 
+ELF_DIR = './test/build/elf'
+BIN_DIR = './test/build/bin'
+# load and entry addresses of raw binaries extracted with objcopy
 MEM_OFFSET = 0x154
 EXE_OFFSET = 0x1d8
+STACK_TOP = 0x500000
+STACK_SIZE = 0x80000
+ENGINES = ('interpreter', 'block', 'fused')
+
+class ProgramTimeout(Exception):
+    pass
+
+def program_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def find_programs(folder: str) -> [os.DirEntry]:
+    if not os.path.isdir(folder):
+        return []
+    return [test for test in os.scandir(folder) if test.name.endswith(('.riscv', '.bin'))]
 
 def find_tests() -> [os.DirEntry]:
-    return sorted([test for test in os.scandir('./test/build/bin') if test.name.endswith('.bin')], key= lambda x: x.name)
+    tests = {}
+    for test in find_programs(BIN_DIR) + find_programs(ELF_DIR):
+        tests[program_name(test.name)] = test
+    return sorted(tests.values(), key= lambda x: x.name)
+
+def load_program(path: str, memory: Memory) -> tuple[int, int, int]:
+    if path.endswith('.bin'):
+        with open(path, 'rb') as f:
+            data = f.read()
+        memory.load_image(MEM_OFFSET, data)
+        return EXE_OFFSET, MEM_OFFSET, MEM_OFFSET + len(data)
+    with elf.ElfFile(path) as program:
+        program.load(memory)
+        start, end = program.code_range()
+        return program.entry, start, end
+
+def program_end(path: str) -> int:
+    # the end of the image and its .bss, where the heap can start
+    if path.endswith('.bin'):
+        return MEM_OFFSET + os.path.getsize(path)
+    with elf.ElfFile(path) as program:
+        return program.end()
+
+def _on_timeout(signum, frame):
+    raise ProgramTimeout()
+
+@contextlib.contextmanager
+def time_limit(seconds: float | None):
+    if seconds is None or not hasattr(signal, 'setitimer'):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
 
-def run_test(file: os.DirEntry):
+def resolve_address(path: str, target: str) -> tuple[int, int | None]:
+    # a number, or the address and size of a symbol of an ELF program
+    try:
+        return int(target, 0), None
+    except ValueError:
+        pass
+    if path.endswith('.bin'):
+        raise Exception(f'Cannot resolve symbol {target}: {program_name(path)} has no symbol table')
+    with elf.ElfFile(path) as program:
+        symbol = program.symbol(target)
+    if symbol is None:
+        raise Exception(f'Unknown symbol {target} in {program_name(path)}')
+    return symbol.address, symbol.size
+
+def resolve_watch(path: str, spec: str) -> tuple[int, int, str]:
+    # ADDRESS[:SIZE][:KINDS]
+    target, *rest = spec.split(':')
+    start, size = resolve_address(path, target)
+    if rest and rest[0]:
+        size = int(rest[0], 0)
+    kinds = rest[1] if len(rest) > 1 else 'w'
+    return start, start + (size or 4), kinds
+
+def build_simulator(path: str, trace: tracing.TraceSink | None = None) -> Simulator:
     bank = RegisterBank()
     memory = Memory()
-    cache = InstructionsCache(file.path, 4, memory, MEM_OFFSET)
-    with open(os.path.join('test/', file.name[:-4] + '.log'), 'tw') as log:
-        sim = Simulator(cache, bank, memory, log, EXE_OFFSET)
-        sim.simulate()
+    memory.add_region('stack', STACK_TOP - STACK_SIZE, STACK_SIZE)
+    entry, code_start, code_end = load_program(path, memory)
+    cache = InstructionsCache(4, memory, code_start, code_end)
+    return Simulator(cache, bank, memory, trace, entry)
 
+@dataclass
+class RunOptions:
+    engine: str = 'interpreter'
+    trace_level: str = 'full'
+    trace_format: str = 'text'
+    index_interval: int = tracing.DEFAULT_INDEX_INTERVAL
+    trace_compression: str = 'none'
+    max_instructions: int | None = None
+    timeout: float | None = None
+    checkpoint_every: int | None = None
+    checkpoint_compression: str = 'none'
+    resume: str | None = None
+    golden: str | None = None
+    context: int = tracing.DEFAULT_CONTEXT
+    cache: str | None = None
+    cache_size: int = progcache.DEFAULT_MAX_BYTES
+    watches: list[str] | None = None
+    host_calls: bool = False
+    intercepts: list[str] | None = None
+    signatures: str | None = None
+    profile_interval: int | None = None
+    profile_map: str | None = None
+    profile_top: int = profiler.DEFAULT_TOP
+    stats_sample: int | None = None
+    progress: int | None = None
+    cprofile: bool = False
+    pipeline_predictor: str | None = None
+    predictor_bits: int = pipeline.DEFAULT_PREDICTOR_BITS
+    forwarding: bool = True
+    mul_latency: int = pipeline.DEFAULT_MUL_LATENCY
+    div_latency: int = pipeline.DEFAULT_DIV_LATENCY
 
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'RunOptions':
+        return cls(engine=args.engine, trace_level=args.trace, trace_format=args.trace_format,
+                   index_interval=args.index_interval, trace_compression=args.trace_compression,
+                   max_instructions=args.max_instructions, timeout=args.timeout,
+                   checkpoint_every=args.checkpoint_every, checkpoint_compression=args.checkpoint_compression,
+                   resume=args.resume, golden=args.golden, context=args.context, cache=args.cache,
+                   cache_size=args.cache_size << 20, watches=args.watch, host_calls=args.hle,
+                   intercepts=args.intercept, signatures=args.hle_signatures, profile_interval=args.profile,
+                   profile_map=args.profile_map, profile_top=args.profile_top, stats_sample=args.stats,
+                   progress=args.progress, cprofile=args.cprofile, pipeline_predictor=args.pipeline,
+                   predictor_bits=args.predictor_bits, forwarding=not args.no_forwarding,
+                   mul_latency=args.mul_latency, div_latency=args.div_latency)
 
-if __name__ == '__main__':
-    for test in find_tests():
+def output_path(path: str, suffix: str) -> str:
+    return os.path.join('test/', program_name(path) + suffix)
+
+def open_trace(path: str, options: RunOptions) -> tuple[tracing.TraceSink | None, object]:
+    if options.golden is not None:
+        reference = tracing.find_reference(options.golden, program_name(path))
+        if reference is None:
+            raise Exception(f'No reference trace for {program_name(path)} in {options.golden}')
+        trace = tracing.GoldenTrace(reference, options.context)
+        return trace, trace
+    return tracing.open_trace(output_path(path, ''), options.trace_level, options.trace_format,
+                              options.index_interval, options.trace_compression)
+
+def build_pipeline(options: RunOptions) -> pipeline.PipelineModel | None:
+    if options.pipeline_predictor is None:
+        return None
+    predictor = pipeline.build_predictor(options.pipeline_predictor, options.predictor_bits)
+    return pipeline.PipelineModel(predictor, options.forwarding, options.mul_latency, options.div_latency)
+
+def install_host(sim: Simulator, path: str, options: RunOptions,
+                 output_file) -> tuple[hle.HostServices | None, dict]:
+    services = None
+    if output_file is not None:
+        services = hle.HostServices(output_file, hle.heap_start(program_end(path)))
+        services.install(sim.decoder)
+    routines = {}
+    if options.intercepts:
+        names = sorted(hle.ROUTINES) if 'all' in options.intercepts else options.intercepts
+        start, _ = sim.code_range()
+        routines = hle.find_routines(path, sim.code_image(), start, names,
+                                     None if options.signatures is None else hle.load_signatures(options.signatures))
+        hle.intercept(sim.decoder, routines)
+    return services, routines
+
+def install_watches(sim: Simulator, path: str, options: RunOptions, watch_file) -> None:
+    for spec in options.watches or []:
+        start, end, kinds = resolve_watch(path, spec)
+        sim.memory.watch(start, end, kinds, lambda access: watch_file.write(f'{access}\n'))
+
+def build_profiler(sim: Simulator, path: str, options: RunOptions) -> profiler.Profiler | None:
+    if not options.profile_interval:
+        return None
+    if options.profile_map is not None:
+        symbols = profiler.Symbols.from_map(options.profile_map)
+    else:
+        symbols = None if path.endswith('.bin') else profiler.Symbols.from_elf(path)
+    profile = profiler.Profiler(symbols, options.profile_interval)
+    profile.attach(sim)
+    return profile
+
+def write_profile(path: str, profile: profiler.Profiler, options: RunOptions) -> None:
+    with open(output_path(path, '.folded'), 'w') as f:
+        f.write(profile.collapsed())
+    with open(output_path(path, '.prof'), 'w') as f:
+        f.write(profile.hotspots(options.profile_top))
+
+def write_summary(path: str, suffix: str, summary: dict) -> None:
+    with open(output_path(path, suffix), 'w') as f:
+        json.dump({'program': program_name(path), **summary}, f, indent=1)
+
+def simulate(sim: Simulator, options: RunOptions) -> None:
+    resumed = options.resume is not None
+    if options.engine == 'block':
+        sim.simulate_blocks(options.max_instructions, resumed)
+    elif options.engine == 'fused':
+        sim.simulate_fused(options.max_instructions, resumed)
+    else:
+        sim.simulate(options.max_instructions, resumed)
+
+def run_test(path: str, options: RunOptions | None = None) -> tuple[Simulator, str]:
+    options = options or RunOptions()
+    trace, trace_file = open_trace(path, options)
+    # the timing model sees the retired instructions as one more trace
+    sink = model = build_pipeline(options)
+    if model is None:
+        sink = trace
+    elif trace is not None:
+        sink = tracing.TeeTrace([trace, model])
+    sim = build_simulator(path, sink)
+    with contextlib.ExitStack() as files:
+        if trace_file is not None:
+            files.callback(trace_file.close)
+        output_file = files.enter_context(open(output_path(path, '.out'), 'wb')) if options.host_calls else None
+        services, routines = install_host(sim, path, options, output_file)
+        if options.resume is not None:
+            state = checkpoint.read(options.resume)
+            sim.restore(state)
+            if services is not None:
+                services.restore(state.host)
+        if options.watches:
+            install_watches(sim, path, options, files.enter_context(open(output_path(path, '.watch'), 'tw')))
+        profile = build_profiler(sim, path, options)
+        run_stats = None
+        if options.stats_sample:
+            run_stats = stats.Stats(options.stats_sample)
+            run_stats.attach(sim)
+        if options.progress:
+            sim.every('progress', options.progress, stats.Progress(program_name(path), clock=sim.clock))
+        if options.checkpoint_every:
+            def save(sim):
+                state = sim.snapshot(path)
+                if services is not None:
+                    state.host = services.state()
+                checkpoint.write(output_path(path, f'.{sim.clock}.ckpt'), state, options.checkpoint_compression)
+            sim.checkpoint_every(options.checkpoint_every, save)
+        if options.cache is not None:
+            program_cache = progcache.ProgramCache(options.cache, options.cache_size)
+            variant = f'{options.host_calls} {sorted(routines.items())} {profile is not None}'
+            key = program_cache.key(sim.code_image(), sim.code_range()[0], sim.entry, translator.trace_mode(sink),
+                                    variant)
+            cached = program_cache.load(key)
+            if cached is not None:
+                sim.preload(cached)
+        status = 'ok'
         try:
-            run_test(test)
-        except:
-            print(f'Error while running test {test.name}:')
-            print(traceback.format_exc())
\ No newline at end of file
+            host_profile = output_path(path, '.pstats') if options.cprofile else None
+            with time_limit(options.timeout), stats.host_profile(host_profile):
+                simulate(sim, options)
+            if not sim.finished:
+                status = 'budget'
+            elif services is not None and services.exit_code:
+                status = f'exit {services.exit_code}'
+            elif options.golden is not None:
+                trace.check_end()
+            if options.cache is not None:
+                code = progcache.merge(cached, sim.export_code())
+                if cached is None or len(code['blocks']) > len(cached['blocks']):
+                    program_cache.store(key, code)
+        except ProgramTimeout:
+            status = 'timeout'
+        finally:
+            if profile is not None:
+                profile.sample(sim)
+                write_profile(path, profile, options)
+    if run_stats is not None:
+        write_summary(path, '.stats.json', {'engine': options.engine, 'status': status, **run_stats.summary()})
+    if model is not None:
+        write_summary(path, '.pipeline.json', {'status': status, **model.summary()})
+    return sim, status
+
+def run_job(path: str, options: RunOptions) -> dict:
+    result = {'name': os.path.basename(path), 'status': 'ok', 'instructions': 0, 'seconds': 0.0, 'error': None}
+    start = time.perf_counter()
+    try:
+        sim, result['status'] = run_test(path, options)
+        result['instructions'] = sim.clock
+    except tracing.TraceMismatch as mismatch:
+        result['status'] = 'mismatch'
+        result['instructions'] = mismatch.instruction
+        result['error'] = str(mismatch)
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def run_all(paths: list[str], options: RunOptions, jobs: int = 1):
+    if jobs <= 1:
+        for path in paths:
+            yield run_job(path, options)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_job, path, options) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+def mips(result: dict) -> float:
+    if result['seconds'] <= 0:
+        return 0.0
+    return result['instructions'] / result['seconds'] / 1e6
+
+def format_table(results: list[dict]) -> str:
+    lines = [f'{"program":<24} {"status":<8} {"instructions":>14} {"seconds":>9} {"MIPS":>7}']
+    for result in sorted(results, key=lambda x: x['name']):
+        lines.append(f'{result["name"]:<24} {result["status"]:<8} {result["instructions"]:>14}'
+                     f' {result["seconds"]:>9.2f} {mips(result):>7.3f}')
+    return '\n'.join(lines)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', choices=ENGINES, default='interpreter',
+                        help='execute one instruction at a time, translated basic blocks, or the interpreter with'
+                             ' common instruction pairs fused (only when the trace is off)')
+    parser.add_argument('--trace', choices=tracing.TRACE_LEVELS, default='full',
+                        help='off, only a final summary with a trace hash, or every retired instruction')
+    parser.add_argument('--trace-format', choices=tracing.TRACE_FORMATS, default='text',
+                        help='format of the full trace: the .log text or packed binary records')
+    parser.add_argument('--trace-compression', choices=tracing.TRACE_COMPRESSIONS, default='none',
+                        help='write the text log as .log.gz or .log.xz, compressed by a background thread')
+    parser.add_argument('--index-interval', type=int, default=tracing.DEFAULT_INDEX_INTERVAL,
+                        help='instructions between seek index entries in binary traces')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of programs simulated in parallel worker processes')
+    parser.add_argument('--max-instructions', type=int, default=None,
+                        help='stop each program after this many retired instructions')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='wall-clock limit in seconds for each program')
+    parser.add_argument('--checkpoint-every', type=int, default=None,
+                        help='save the machine state to test/<program>.<instructions>.ckpt every N instructions')
+    parser.add_argument('--checkpoint-compression', choices=checkpoint.COMPRESSIONS, default='none',
+                        help='compression used for the checkpoint files')
+    parser.add_argument('--golden', default=None,
+                        help='compare each retired instruction with the reference traces in this folder'
+                             ' (<program>.log, .log.gz, .log.xz or .trace) and stop at the first difference')
+    parser.add_argument('--context', type=int, default=tracing.DEFAULT_CONTEXT,
+                        help='instructions shown before a golden trace mismatch')
+    parser.add_argument('--cache', default=None,
+                        help='folder of the compiled block cache used by --engine block')
+    parser.add_argument('--cache-size', type=int, default=progcache.DEFAULT_MAX_BYTES >> 20,
+                        help='size limit of the program cache in MiB; least recently used entries are removed')
+    parser.add_argument('--watch', action='append', default=None, metavar='ADDRESS[:SIZE][:KINDS]',
+                        help='log reads (r), writes (w, the default) or execution (x) of an address range or an'
+                             ' ELF symbol to test/<program>.watch; may be repeated')
+    parser.add_argument('--hle', action='store_true',
+                        help='handle ecall as a system call (exit, write, brk, close) instead of ending the program;'
+                             ' output written to stdout and stderr goes to test/<program>.out')
+    parser.add_argument('--intercept', action='append', default=None, choices=sorted(hle.ROUTINES) + ['all'],
+                        help='run calls to this routine on the host, found by ELF symbol or by a signature from'
+                             ' --hle-signatures; logged as hle in the trace; may be repeated')
+    parser.add_argument('--hle-signatures', default=None,
+                        help='JSON file with the code of known routines, as printed by src/hle.py')
+    parser.add_argument('--profile', type=int, nargs='?', const=profiler.DEFAULT_INTERVAL, default=None,
+                        metavar='INTERVAL',
+                        help='profile the guest: follow calls and returns and charge the current call path every'
+                             f' INTERVAL instructions (default {profiler.DEFAULT_INTERVAL}), writing'
+                             ' test/<program>.folded for flamegraphs and the hotspots to test/<program>.prof')
+    parser.add_argument('--profile-map', default=None,
+                        help='symbols as "ADDRESS [TYPE] NAME" lines (nm output), instead of the ELF symbol table')
+    parser.add_argument('--profile-top', type=int, default=profiler.DEFAULT_TOP,
+                        help='functions listed in test/<program>.prof')
+    parser.add_argument('--stats', type=int, nargs='?', const=stats.DEFAULT_SAMPLE, default=None, metavar='SAMPLE',
+                        help='write test/<program>.stats.json with host-side counters: decode time, and with the'
+                             ' interpreter the instructions per mnemonic and format and the time of fetch, exec and'
+                             f' trace measured on one cycle in SAMPLE (default {stats.DEFAULT_SAMPLE})')
+    parser.add_argument('--progress', type=int, default=None, metavar='INSTRUCTIONS',
+                        help='print the current and average MIPS to stderr every INSTRUCTIONS instructions')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='run the simulation under cProfile and save test/<program>.pstats')
+    parser.add_argument('--pipeline', choices=sorted(pipeline.PREDICTORS), default=None, metavar='PREDICTOR',
+                        help='time the run on a 5-stage in-order pipeline with this branch predictor (static,'
+                             ' bimodal or gshare) and write cycles, CPI and stalls to test/<program>.pipeline.json')
+    parser.add_argument('--predictor-bits', type=int, default=pipeline.DEFAULT_PREDICTOR_BITS,
+                        help='log2 of the counters of the bimodal and gshare predictors')
+    parser.add_argument('--no-forwarding', action='store_true',
+                        help='model a pipeline without forwarding, where operands wait for write back')
+    parser.add_argument('--mul-latency', type=int, default=pipeline.DEFAULT_MUL_LATENCY,
+                        help='cycles the multiplications hold the EX stage')
+    parser.add_argument('--div-latency', type=int, default=pipeline.DEFAULT_DIV_LATENCY,
+                        help='cycles the divisions and remainders hold the EX stage')
+    parser.add_argument('--resume', default=None,
+                        help='continue the program saved in a checkpoint file instead of running every test')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.stats and args.engine != 'interpreter':
+        print(f'Warning: with --engine {args.engine}, --stats only reports totals; the per-mnemonic counts and'
+              ' the phase times need --engine interpreter')
+    if args.resume is not None:
+        paths = [checkpoint.read(args.resume).program]
+    else:
+        paths = [test.path for test in find_tests()]
+    results = []
+    for result in run_all(paths, RunOptions.from_args(args), args.jobs):
+        results.append(result)
+        print(f'[{len(results)}/{len(paths)}] {result["name"]}: {result["status"]}'
+              f' ({result["instructions"]} instructions, {result["seconds"]:.2f}s)', flush=True)
+        if result['status'] == 'mismatch':
+            print(result['error'])
+        elif result['error'] is not None:
+            print(f'Error while running test {result["name"]}:')
+            print(result['error'])
+    print(format_table(results))
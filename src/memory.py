@@ -1,18 +1,383 @@
+import struct
+from collections.abc import Callable
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+_half = struct.Struct('<H')
+_word = struct.Struct('<I')
+_unpack_half = _half.unpack_from
+_unpack_word = _word.unpack_from
+_pack_half = _half.pack_into
+_pack_word = _word.pack_into
+
+WATCH_KINDS = 'rwx'
+_LOADS = (('load_byte', 1), ('load_half', 2), ('load_word', 4))
+_STORES = (('store_byte', 1), ('store_half', 2), ('store_word', 4))
+
+def page_align(address: int) -> int:
+    return address & ~PAGE_MASK
+
+def page_align_up(address: int) -> int:
+    return (address + PAGE_MASK) & ~PAGE_MASK
+
+class Region:
+    name: str
+    base: int
+    size: int
+    data: bytearray
+
+    def __init__(self, name: str, base: int, size: int, buffer=None):
+        self.name = name
+        self.base = page_align(base)
+        self.size = page_align_up(base + size) - self.base
+        if buffer is None:
+            self.data = bytearray(self.size)
+        elif len(buffer) != self.size:
+            raise Exception(f'Region {name} needs a buffer of {self.size} bytes, got {len(buffer)}')
+        else:
+            self.data = buffer
+
+    def contains(self, address: int) -> bool:
+        return self.base <= address < self.base + self.size
+
+class Access:
+    kind: str
+    address: int
+    width: int
+    value: int
+    pc: int | None
+
+    def __init__(self, kind: str, address: int, width: int, value: int, pc: int | None):
+        self.kind = kind
+        self.address = address
+        self.width = width
+        self.value = value
+        self.pc = pc
+
+    def __str__(self):
+        pc = '????????' if self.pc is None else f'{self.pc:08x}'
+        return f'PC={pc} {self.kind} {self.address:08x} [{self.width}] {self.value:0{2 * self.width}x}'
+
+class Watchpoint:
+    start: int
+    end: int
+    kinds: str
+    callback: Callable[[Access], None] | None
+    events: list[Access]
+
+    def __init__(self, start: int, end: int, kinds: str, callback: Callable[[Access], None] | None = None):
+        self.start = start
+        self.end = end
+        self.kinds = kinds
+        self.callback = callback
+        self.events = []
+
+    def hit(self, access: Access) -> None:
+        if self.callback is None:
+            self.events.append(access)
+        else:
+            self.callback(access)
+
 class Memory:
-    _memory: dict[int, str]
-    _default: str
+    _regions: list[Region]
+    _pages: dict[int, memoryview]
+    _code_start: int
+    _code_end: int
+    _code_listener: Callable[[int, int], None] | None
+    _watchpoints: list[Watchpoint]
+    _watched_pages: dict[str, dict[int, list[Watchpoint]]]
+    _unwatched: dict[str, object]
+    _watch_listeners: list[Callable[[], None]]
+    pc_source: Callable[[], int] | None
+
+    def __init__(self):
+        self._regions = []
+        self._pages = {}
+        self._code_start = 0
+        self._code_end = 0
+        self._code_listener = None
+        self._watchpoints = []
+        self._watched_pages = {kind: {} for kind in WATCH_KINDS}
+        self._unwatched = {}
+        self._watch_listeners = []
+        self.pc_source = None
+
+    def watch_code(self, start: int, end: int, listener: Callable[[int, int], None]) -> None:
+        # stores that overlap [start, end) call listener(address, width)
+        self._code_start = start - 3
+        self._code_end = end
+        self._code_listener = listener
+
+    def add_region(self, name: str, base: int, size: int, buffer=None) -> Region:
+        # buffer, if given, backs the region instead of a private bytearray (e.g. shared memory)
+        region = Region(name, base, size, buffer)
+        for other in self._regions:
+            if region.base < other.base + other.size and other.base < region.base + region.size:
+                raise Exception(f'Region {name} overlaps region {other.name}')
+        view = memoryview(region.data)
+        for offset in range(0, region.size, PAGE_SIZE):
+            page = (region.base + offset) >> PAGE_BITS
+            old = self._pages.get(page)
+            if old is not None:
+                view[offset:offset + PAGE_SIZE] = old
+            self._pages[page] = view[offset:offset + PAGE_SIZE]
+        self._regions.append(region)
+        return region
+
+    def watch(self, start: int, end: int, kinds: str = 'w',
+              callback: Callable[[Access], None] | None = None) -> Watchpoint:
+        # reads and writes overlapping [start, end) and instructions executed there call
+        # callback(access), or are recorded in the watchpoint's events without a callback
+        if not kinds or any(kind not in WATCH_KINDS for kind in kinds):
+            raise Exception(f'Invalid watch kinds: {kinds}')
+        if end <= start:
+            raise Exception(f'Empty watch range {start:08x}-{end:08x}')
+        watchpoint = Watchpoint(start, end, kinds, callback)
+        self._watchpoints.append(watchpoint)
+        self._update_watches()
+        return watchpoint
+
+    def unwatch(self, watchpoint: Watchpoint) -> None:
+        self._watchpoints.remove(watchpoint)
+        self._update_watches()
+
+    def on_watch_change(self, listener: Callable[[], None]) -> None:
+        self._watch_listeners.append(listener)
+
+    def watching(self, kinds: str = WATCH_KINDS) -> bool:
+        return any(self._watched_pages[kind] for kind in kinds)
+
+    def exec_watched(self, pc: int) -> bool:
+        pages = self._watched_pages['x'].get(pc >> PAGE_BITS)
+        return pages is not None and any(w.start < pc + 4 and pc < w.end for w in pages)
+
+    def executed(self, pc: int) -> None:
+        self._fire('x', pc, 4, Memory.load_word(self, pc))
+
+    def _update_watches(self) -> None:
+        # accessors are only shadowed while some page is watched, so unwatched memory keeps the plain
+        # methods; users that bound the accessors (the block translator) rebind from the listeners
+        for name, original in self._unwatched.items():
+            if original is None:
+                del self.__dict__[name]
+            else:
+                self.__dict__[name] = original
+        self._unwatched = {}
+        for kind, pages in self._watched_pages.items():
+            pages.clear()
+            for watchpoint in self._watchpoints:
+                if kind in watchpoint.kinds:
+                    for page in range(watchpoint.start >> PAGE_BITS, ((watchpoint.end - 1) >> PAGE_BITS) + 1):
+                        pages.setdefault(page, []).append(watchpoint)
+        if self._watched_pages['r']:
+            for name, width in _LOADS:
+                self._shadow(name, self._watched_load(getattr(self, name), width))
+        if self._watched_pages['w']:
+            for name, width in _STORES:
+                self._shadow(name, self._watched_store(getattr(self, name), width))
+        for listener in self._watch_listeners:
+            listener()
+
+    def _shadow(self, name: str, function: Callable) -> None:
+        self._unwatched[name] = self.__dict__.get(name)
+        self.__dict__[name] = function
+
+    def _watched_load(self, load: Callable[[int], int], width: int) -> Callable[[int], int]:
+        pages = self._watched_pages['r']
+        fire = self._fire
+
+        def watched(address: int) -> int:
+            value = load(address)
+            if address >> PAGE_BITS in pages or (address + width - 1) >> PAGE_BITS in pages:
+                fire('r', address, width, value)
+            return value
+        return watched
+
+    def _watched_store(self, store: Callable[[int, int], None], width: int) -> Callable[[int, int], None]:
+        pages = self._watched_pages['w']
+        fire = self._fire
+        mask = (1 << 8 * width) - 1
+
+        def watched(address: int, value: int) -> None:
+            store(address, value)
+            if address >> PAGE_BITS in pages or (address + width - 1) >> PAGE_BITS in pages:
+                fire('w', address, width, value & mask)
+        return watched
+
+    def _fire(self, kind: str, address: int, width: int, value: int) -> None:
+        pages = self._watched_pages[kind]
+        end = address + width
+        watchpoints = pages.get(address >> PAGE_BITS, [])
+        if (end - 1) >> PAGE_BITS != address >> PAGE_BITS:
+            watchpoints = watchpoints + [w for w in pages.get((end - 1) >> PAGE_BITS, []) if w not in watchpoints]
+        access = None
+        for watchpoint in watchpoints:
+            if watchpoint.start < end and address < watchpoint.end:
+                if access is None:
+                    pc = None if self.pc_source is None else self.pc_source()
+                    access = Access(kind, address, width, value, pc)
+                watchpoint.hit(access)
+
+    def regions(self) -> list[Region]:
+        return list(self._regions)
+
+    def find_region(self, address: int) -> Region | None:
+        for region in self._regions:
+            if region.contains(address):
+                return region
+        return None
+
+    def _page(self, address: int) -> memoryview:
+        page = self._pages.get(address >> PAGE_BITS)
+        if page is None:
+            page = memoryview(bytearray(PAGE_SIZE))
+            self._pages[address >> PAGE_BITS] = page
+        elif page.readonly:
+            page = self._unshare(address)
+        return page
+
+    def _unshare(self, address: int) -> memoryview:
+        # first write to a page shared with a fork: copy it
+        page = memoryview(bytearray(self._pages[address >> PAGE_BITS]))
+        self._pages[address >> PAGE_BITS] = page
+        return page
+
+    def fork(self) -> 'Memory':
+        # both sides keep read-only views of the same pages and copy a page when they first store to it;
+        # the child has no code listener or watchpoints of its own
+        for page, view in self._pages.items():
+            if not view.readonly:
+                self._pages[page] = view.toreadonly()
+        child = Memory()
+        child._regions = list(self._regions)
+        child._pages = dict(self._pages)
+        return child
+
+    def _copy_in(self, address: int, data: bytes) -> None:
+        data = memoryview(data)
+        while data:
+            offset = address & PAGE_MASK
+            chunk = min(len(data), PAGE_SIZE - offset)
+            self._page(address)[offset:offset + chunk] = data[:chunk]
+            address += chunk
+            data = data[chunk:]
+
+    def load_image(self, address: int, data: bytes, name: str = 'image') -> None:
+        if self.find_region(address) is None:
+            self.add_region(name, address, len(data))
+        self._copy_in(address, data)
+
+    def write(self, address: int, data: bytes) -> None:
+        # bulk store that skips watchpoints but still drops decoded code it overwrites
+        self._copy_in(address, data)
+        end = address + len(data)
+        if self._code_listener is not None and address < self._code_end and end > self._code_start:
+            for word in range(max(address, self._code_start + 3) & ~3, min(end, self._code_end), 4):
+                self._code_listener(word, 4)
+
+    def track_dirty(self) -> set[int]:
+        # shadows the store methods on this instance; must run before a translator binds them
+        dirty = set()
+        store_byte, store_half, store_word = self.store_byte, self.store_half, self.store_word
+
+        def tracked_byte(address: int, value: int) -> None:
+            dirty.add(address >> PAGE_BITS)
+            store_byte(address, value)
+
+        def tracked_half(address: int, value: int) -> None:
+            dirty.add(address >> PAGE_BITS)
+            dirty.add((address + 1) >> PAGE_BITS)
+            store_half(address, value)
+
+        def tracked_word(address: int, value: int) -> None:
+            dirty.add(address >> PAGE_BITS)
+            dirty.add((address + 3) >> PAGE_BITS)
+            store_word(address, value)
+
+        self.store_byte = tracked_byte
+        self.store_half = tracked_half
+        self.store_word = tracked_word
+        return dirty
+
+    def read(self, address: int, size: int) -> bytes:
+        data = bytearray()
+        end = address + size
+        while address < end:
+            chunk = min(end, page_align(address) + PAGE_SIZE) - address
+            page = self._pages.get(address >> PAGE_BITS)
+            offset = address & PAGE_MASK
+            data += bytes(chunk) if page is None else page[offset:offset + chunk]
+            address += chunk
+        return bytes(data)
+
+    def page_data(self, page: int) -> bytes:
+        view = self._pages.get(page)
+        return bytes(PAGE_SIZE) if view is None else view.tobytes()
+
+    def pages(self) -> list[tuple[int, memoryview]]:
+        return sorted(self._pages.items())
+
+    def write_page(self, page: int, data: bytes) -> None:
+        # bypasses the code listener; callers restoring whole images must drop decoded code themselves
+        self._page(page << PAGE_BITS)[:] = data
+
+    def load_byte(self, address: int) -> int:
+        page = self._pages.get(address >> PAGE_BITS)
+        if page is None:
+            return 0
+        return page[address & PAGE_MASK]
+
+    def load_half(self, address: int) -> int:
+        page = self._pages.get(address >> PAGE_BITS)
+        offset = address & PAGE_MASK
+        if page is None or offset > PAGE_SIZE - 2:
+            return Memory.load_byte(self, address) | Memory.load_byte(self, address + 1) << 8
+        return _unpack_half(page, offset)[0]
 
-    def __init__(self, default: str = '00000000'):
-        self._memory = {}
-        self._default = default
+    def load_word(self, address: int) -> int:
+        page = self._pages.get(address >> PAGE_BITS)
+        offset = address & PAGE_MASK
+        if page is None or offset > PAGE_SIZE - 4:
+            return Memory.load_half(self, address) | Memory.load_half(self, address + 2) << 16
+        return _unpack_word(page, offset)[0]
 
-    def load_byte(self, address: int) -> str:
-        return self._memory.get(address, self._default)
+    def store_byte(self, address: int, value: int) -> None:
+        page = self._pages.get(address >> PAGE_BITS)
+        if page is None:
+            page = self._page(address)
+        try:
+            page[address & PAGE_MASK] = value & 0xff
+        except TypeError:
+            self._unshare(address)[address & PAGE_MASK] = value & 0xff
+        if self._code_start <= address < self._code_end:
+            self._code_listener(address, 1)
 
-    def save_byte(self, address: int, value: str) -> None:
-        if value != self._default:
-            self._memory[address] = value
-        elif address in self._memory:
-            del self._memory[address]
+    def store_half(self, address: int, value: int) -> None:
+        page = self._pages.get(address >> PAGE_BITS)
+        offset = address & PAGE_MASK
+        if page is None or offset > PAGE_SIZE - 2:
+            Memory.store_byte(self, address, value)
+            Memory.store_byte(self, address + 1, value >> 8)
+            return
+        try:
+            _pack_half(page, offset, value & 0xffff)
+        except TypeError:
+            _pack_half(self._unshare(address), offset, value & 0xffff)
+        if self._code_start <= address < self._code_end:
+            self._code_listener(address, 2)
 
-    # TODO: implementar helpers para acessar bytes específicos
\ No newline at end of file
+    def store_word(self, address: int, value: int) -> None:
+        page = self._pages.get(address >> PAGE_BITS)
+        offset = address & PAGE_MASK
+        if page is None or offset > PAGE_SIZE - 4:
+            Memory.store_half(self, address, value)
+            Memory.store_half(self, address + 2, value >> 16)
+            return
+        try:
+            _pack_word(page, offset, value & 0xffffffff)
+        except TypeError:
+            _pack_word(self._unshare(address), offset, value & 0xffffffff)
+        if self._code_start <= address < self._code_end:
+            self._code_listener(address, 4)
@@ -0,0 +1,237 @@
+import decoder
+import tracing
+
+DEFAULT_MUL_LATENCY = 3
+DEFAULT_DIV_LATENCY = 34
+DEFAULT_PREDICTOR_BITS = 12
+# bubbles after a branch or jump: a taken direction predicted in ID redirects fetch one cycle late, and anything
+# known only in EX (a misprediction, the jalr target) flushes IF and ID
+TAKEN_PENALTY = 1
+MISPREDICT_PENALTY = 2
+STALLS = ('load-use', 'raw', 'mul', 'div', 'taken', 'mispredict', 'jump')
+
+_LOADS = ('lb', 'lh', 'lw', 'lbu', 'lhu')
+_MULS = ('mul', 'mulh', 'mulhsu', 'mulhu')
+_DIVS = ('div', 'divu', 'rem', 'remu')
+_BRANCHES = ('beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu')
+
+class StaticPredictor:
+    # backward taken, forward not taken
+    name = 'static'
+
+    def resolve(self, instr: decoder.Instruction, taken: bool) -> bool:
+        return instr.imm < 0
+
+class BimodalPredictor:
+    # two-bit saturating counters indexed by the pc
+    name = 'bimodal'
+    _counters: bytearray
+    _mask: int
+
+    def __init__(self, bits: int = DEFAULT_PREDICTOR_BITS):
+        self._counters = bytearray([1]) * (1 << bits)
+        self._mask = (1 << bits) - 1
+
+    def _index(self, pc: int) -> int:
+        return (pc >> 2) & self._mask
+
+    def resolve(self, instr: decoder.Instruction, taken: bool) -> bool:
+        # the prediction made before the outcome, then trains on it
+        index = self._index(instr.pc)
+        counter = self._counters[index]
+        if taken:
+            self._counters[index] = min(counter + 1, 3)
+        else:
+            self._counters[index] = max(counter - 1, 0)
+        return counter >= 2
+
+class GsharePredictor(BimodalPredictor):
+    # the counters indexed by the pc xor the global history of branch outcomes
+    name = 'gshare'
+    _history: int
+
+    def __init__(self, bits: int = DEFAULT_PREDICTOR_BITS):
+        super().__init__(bits)
+        self._history = 0
+
+    def _index(self, pc: int) -> int:
+        return ((pc >> 2) ^ self._history) & self._mask
+
+    def resolve(self, instr: decoder.Instruction, taken: bool) -> bool:
+        prediction = super().resolve(instr, taken)
+        self._history = ((self._history << 1) | taken) & self._mask
+        return prediction
+
+PREDICTORS = {predictor.name: predictor for predictor in (StaticPredictor, BimodalPredictor, GsharePredictor)}
+
+def build_predictor(name: str, bits: int = DEFAULT_PREDICTOR_BITS):
+    if name not in PREDICTORS:
+        raise Exception(f'Unknown branch predictor: {name}')
+    return StaticPredictor() if name == 'static' else PREDICTORS[name](bits)
+
+class _Timing:
+    # what the model needs of a decoded instruction, worked out on its first retirement
+    __slots__ = ('reads', 'writes', 'kind', 'latency')
+
+    def __init__(self, reads: tuple[int, ...], writes: int, kind: str, latency: int):
+        self.reads = reads
+        self.writes = writes
+        self.kind = kind
+        self.latency = latency
+
+class PipelineModel(tracing.TraceSink):
+    # a cycle-approximate IF/ID/EX/MEM/WB in-order pipeline fed with the retired instructions: it times when each
+    # one can be in EX, given the one before it, its operands and the branch predictor, and charges every cycle
+    # beyond one per instruction to the hazard that caused it
+    predictor: object
+    forwarding: bool
+    mul_latency: int
+    div_latency: int
+    instructions: int
+    stalls: dict[str, int]
+    branches: int
+    mispredictions: int
+    _timings: dict
+    _ready: list[int]
+    _producers: list[str]
+    _execute: int
+    _busy: int
+    _busy_kind: str
+    _pending: tuple | None
+
+    def __init__(self, predictor=None, forwarding: bool = True, mul_latency: int = DEFAULT_MUL_LATENCY,
+                 div_latency: int = DEFAULT_DIV_LATENCY):
+        self.predictor = predictor if predictor is not None else StaticPredictor()
+        self.forwarding = forwarding
+        self.mul_latency = mul_latency
+        self.div_latency = div_latency
+        self.instructions = 0
+        self.stalls = dict.fromkeys(STALLS, 0)
+        self.branches = 0
+        self.mispredictions = 0
+        self._timings = {}
+        # the first cycle each register can be used in EX, and the kind of instruction that writes it
+        self._ready = [0] * 32
+        self._producers = ['alu'] * 32
+        # the EX cycle of the previous instruction, and how long it holds the stage; the first one is in EX
+        # on cycle 3
+        self._execute = 2
+        self._busy = 1
+        self._busy_kind = 'alu'
+        self._pending = None
+
+    def _timing(self, instr: decoder.Instruction) -> _Timing:
+        name = instr.name
+        writes = instr.rd
+        match instr.op.format:
+            case 'R':
+                reads = (instr.rs1, instr.rs2)
+            case 'S' | 'B':
+                reads = (instr.rs1, instr.rs2)
+                writes = 0
+            case 'I':
+                reads = (instr.rs1,)
+            case 'C':
+                reads = () if name.endswith('i') else (instr.rs1,)
+            case 'E' if instr.op.registers is not None:
+                # host calls use their fixed argument and result registers
+                reads = (instr.rs1, instr.rs2)
+            case 'E':
+                reads = ()
+                writes = 0
+            case _:
+                reads = ()
+        if name in _LOADS:
+            kind, latency = 'load', 1
+        elif name in _MULS:
+            kind, latency = 'mul', self.mul_latency
+        elif name in _DIVS:
+            kind, latency = 'div', self.div_latency
+        elif name in _BRANCHES:
+            kind, latency = 'branch', 1
+        elif name in ('jal', 'jalr'):
+            kind, latency = name, 1
+        else:
+            kind, latency = 'alu', 1
+        timing = _Timing(tuple(idx for idx in reads if idx), writes, kind, latency)
+        self._timings[instr] = timing
+        return timing
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        timing = self._timings.get(instr) or self._timing(instr)
+        stalls = self.stalls
+        # in order: after the previous instruction left EX and any fetch bubbles it caused
+        execute = self._execute + self._busy
+        if self._busy > 1:
+            stalls[self._busy_kind] += self._busy - 1
+        if self._pending is not None:
+            execute += self._control(instr.pc)
+        ready = execute
+        cause = None
+        for idx in timing.reads:
+            if self._ready[idx] > ready:
+                ready = self._ready[idx]
+                cause = self._producers[idx]
+        if cause is not None:
+            if not self.forwarding:
+                stalls['raw'] += ready - execute
+            elif cause == 'load':
+                stalls['load-use'] += ready - execute
+            else:
+                stalls[cause] += ready - execute
+            execute = ready
+        if timing.writes:
+            if self.forwarding:
+                # ALU results are forwarded from EX/MEM, loads from MEM/WB
+                available = execute + timing.latency + (timing.kind == 'load')
+            else:
+                # written back in WB and read in ID of the same cycle
+                available = execute + timing.latency + 2
+            self._ready[timing.writes] = available
+            self._producers[timing.writes] = timing.kind
+        self._execute = execute
+        self._busy = timing.latency
+        self._busy_kind = timing.kind
+        if timing.kind in ('branch', 'jal', 'jalr'):
+            self._pending = (instr, timing.kind)
+        self.instructions += 1
+
+    def _control(self, pc: int) -> int:
+        # the bubbles the last branch or jump caused, now that the next pc shows where it went
+        instr, kind = self._pending
+        self._pending = None
+        if kind == 'jal':
+            penalty = TAKEN_PENALTY
+        elif kind == 'jalr':
+            penalty = MISPREDICT_PENALTY
+        else:
+            taken = pc != instr.next_pc
+            self.branches += 1
+            if self.predictor.resolve(instr, taken) != taken:
+                self.mispredictions += 1
+                self.stalls['mispredict'] += MISPREDICT_PENALTY
+                return MISPREDICT_PENALTY
+            penalty = TAKEN_PENALTY if taken else 0
+            self.stalls['taken'] += penalty
+            return penalty
+        self.stalls['jump'] += penalty
+        return penalty
+
+    @property
+    def cycles(self) -> int:
+        # the last instruction still goes through MEM and WB
+        return self._execute + 2 if self.instructions else 0
+
+    def summary(self) -> dict:
+        cycles = self.cycles
+        return {
+            'predictor': self.predictor.name,
+            'forwarding': self.forwarding,
+            'instructions': self.instructions,
+            'cycles': cycles,
+            'cpi': cycles / self.instructions if self.instructions else 0.0,
+            'stalls': dict(self.stalls),
+            'branches': self.branches,
+            'mispredictions': self.mispredictions,
+            'misprediction_rate': self.mispredictions / self.branches if self.branches else 0.0,
+        }
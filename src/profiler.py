@@ -0,0 +1,155 @@
+import bisect
+import collections
+
+import elf
+from simulator import Simulator
+
+DEFAULT_INTERVAL = 1000
+DEFAULT_TOP = 20
+# rd of jal/jalr that makes them calls, and rs1 of jalr x0 that makes it a return (ra and the alternate t0)
+LINK_REGISTERS = (1, 5)
+
+class Symbols:
+    # function names by address, from an ELF symbol table or a map file
+    _starts: list[int]
+    _entries: list[tuple[int, int, str]]
+
+    def __init__(self, entries: list[tuple[int, int, str]]):
+        self._entries = sorted(entries)
+        self._starts = [address for address, _, _ in self._entries]
+
+    @classmethod
+    def from_elf(cls, path: str) -> 'Symbols':
+        with elf.ElfFile(path) as program:
+            symbols = program.symbols().values()
+        return cls([(symbol.address, symbol.size, symbol.name) for symbol in symbols if symbol.kind == 'func'])
+
+    @classmethod
+    def from_map(cls, path: str) -> 'Symbols':
+        # one "ADDRESS [TYPE] NAME" per line, as printed by nm; other lines are skipped
+        entries = []
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                try:
+                    address = int(fields[0], 16)
+                except ValueError:
+                    continue
+                entries.append((address, 0, fields[-1]))
+        return cls(entries)
+
+    def lookup(self, address: int) -> tuple[int, str] | None:
+        # the start and name of the symbol covering address; symbols without a size reach the next one
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0:
+            return None
+        start, size, name = self._entries[index]
+        if size and address >= start + size:
+            return None
+        return start, name
+
+class Profiler:
+    # keeps a shadow call stack from calls and returns, and every `interval` instructions charges them to
+    # the current call path
+    symbols: Symbols | None
+    interval: int
+    _stack: list[tuple[int, int]]
+    _samples: collections.Counter
+    _last: int
+
+    def __init__(self, symbols: Symbols | None = None, interval: int = DEFAULT_INTERVAL):
+        self.symbols = symbols
+        self.interval = interval
+        self._stack = []
+        self._samples = collections.Counter()
+        self._last = 0
+
+    def attach(self, sim: Simulator) -> None:
+        # wraps the handlers of calls and returns as they are decoded, so code decoded earlier is dropped
+        build = sim.decoder.build_instruction
+
+        def build_instruction(instruction: int, pc: int):
+            instr = build(instruction, pc)
+            self._wrap(instr)
+            return instr
+        sim.decoder.build_instruction = build_instruction
+        sim.drop_code()
+        self._stack[:] = [(sim.entry, None)]
+        self._last = sim.clock
+        sim.every('profile', self.interval, self.sample)
+
+    def _wrap(self, instr) -> None:
+        handler = instr.handler
+        stack = self._stack
+        if instr.name in ('jal', 'jalr') and instr.rd in LINK_REGISTERS:
+            def call(i, regs, bank, memory):
+                handler(i, regs, bank, memory)
+                stack.append((bank.pc, i.next_pc))
+            instr.handler = call
+        elif instr.name == 'jalr' and instr.rd == 0 and instr.rs1 in LINK_REGISTERS or instr.name == 'hle':
+            # an intercepted routine returns to ra right away
+            def ret(i, regs, bank, memory):
+                handler(i, regs, bank, memory)
+                self._return(bank.pc)
+            instr.handler = ret
+
+    def _return(self, address: int) -> None:
+        # unwinds to the frame that returns there; returns without one (longjmp, hand-written code) are ignored
+        stack = self._stack
+        for depth in range(len(stack) - 1, 0, -1):
+            if stack[depth][1] == address:
+                del stack[depth:]
+                return
+
+    def sample(self, sim: Simulator) -> None:
+        count = sim.clock - self._last
+        if count:
+            self._samples[tuple(entry for entry, _ in self._stack), sim.register_bank.pc] += count
+        self._last = sim.clock
+
+    def _lookup(self, address: int) -> tuple[int, str] | None:
+        return None if self.symbols is None else self.symbols.lookup(address)
+
+    def _frame_name(self, entry: int) -> str:
+        # a call target inside a symbol is a function the symbol table does not name
+        symbol = self._lookup(entry)
+        if symbol is None:
+            return f'0x{entry:08x}'
+        start, name = symbol
+        return name if start == entry else f'{name}+0x{entry - start:x}'
+
+    def paths(self) -> collections.Counter:
+        # instructions by call path, each a tuple of function names from the entry point down; the pc adds
+        # a last function when it is in another symbol than the innermost call (a tail call)
+        names = {}
+        paths = collections.Counter()
+        for (frames, pc), count in self._samples.items():
+            for entry in frames:
+                if entry not in names:
+                    names[entry] = self._frame_name(entry)
+            path = [names[entry] for entry in frames]
+            leaf = self._lookup(pc)
+            if leaf is not None and leaf != self._lookup(frames[-1]):
+                path.append(leaf[1])
+            paths[tuple(path)] += count
+        return paths
+
+    def collapsed(self) -> str:
+        # the folded format read by flamegraph.pl, speedscope and similar tools
+        return ''.join(f'{";".join(path)} {count}\n' for path, count in sorted(self.paths().items()))
+
+    def hotspots(self, top: int = DEFAULT_TOP) -> str:
+        own = collections.Counter()
+        total = collections.Counter()
+        for path, count in self.paths().items():
+            own[path[-1]] += count
+            for function in set(path):
+                total[function] += count
+        instructions = max(sum(own.values()), 1)
+        lines = [f'{"function":<32} {"self":>12} {"%":>6} {"total":>12} {"%":>6}']
+        for function, count in own.most_common(top):
+            lines.append(f'{function:<32} {count:>12} {100 * count / instructions:>6.2f}'
+                         f' {total[function]:>12} {100 * total[function] / instructions:>6.2f}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,92 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+
+import decoder
+import rtype_helper
+import translator
+
+DEFAULT_MAX_BYTES = 64 << 20
+SUFFIX = '.code'
+
+_version = None
+
+def version() -> bytes:
+    # generated code depends on the interpreter's bytecode and on the decoder/translator sources, and the
+    # entries on this module
+    global _version
+    if _version is None:
+        digest = hashlib.blake2b(importlib.util.MAGIC_NUMBER, digest_size=16)
+        for path in (decoder.__file__, rtype_helper.__file__, translator.__file__, __file__):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _version = digest.digest()
+    return _version
+
+class ProgramCache:
+    folder: str
+    max_bytes: int
+
+    def __init__(self, folder: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, image: bytes, start: int, entry: int, trace_mode: str | None, variant: str = '') -> str:
+        # blocks hold absolute pcs, so the same image loaded elsewhere is another program; variant names
+        # anything else that changes the generated code, such as host call hooks
+        digest = hashlib.blake2b(version(), digest_size=20)
+        digest.update(f'{start:08x} {entry:08x}'.encode())
+        digest.update(str(trace_mode).encode())
+        digest.update(variant.encode())
+        digest.update(image)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key + SUFFIX)
+
+    def load(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        os.utime(path)
+        return code
+
+    def store(self, key: str, code: dict) -> None:
+        handle, temporary = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def merge(old: dict | None, new: dict) -> dict:
+    if old is None:
+        return new
+    blocks = dict(old['blocks'])
+    blocks.update(new['blocks'])
+    return {'blocks': blocks}
@@ -1,22 +1,34 @@
+from collections.abc import Callable
+
+from utils import MASK_32
+
 REGISTER_ALIASES = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 's0',
                     's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7', 's2',
                     's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11',
                     't3', 't4', 't5', 't6']
 
+def _nothing_retired() -> int:
+    return 0
+
 class RegisterBank:
-    _bank: dict
-    _default: int
+    regs: list[int]
+    pc: int
+    hartid: int
+    # instructions retired so far, for the counter CSRs; the simulator running the bank supplies it
+    retired: Callable[[], int]
 
-    def __init__(self, default: int = 0):
-        self._bank = {}
-        self._default = default
+    def __init__(self, default: int = 0, hartid: int = 0):
+        self.regs = [0] + [default & MASK_32] * 31
+        self.pc = 0
+        self.hartid = hartid
+        self.retired = _nothing_retired
 
-    def set_register(self, name, value: int) -> None:
-        if name != 0:
-            self._bank[name] = value
+    def set_register(self, idx: int, value: int) -> None:
+        if idx != 0:
+            self.regs[idx] = value & MASK_32
 
-    def get_register(self, name) -> int:
-        return self._bank.get(name, self._default)
+    def get_register(self, idx: int) -> int:
+        return self.regs[idx]
 
     def get_alias(self, idx: int) -> str:
-        return REGISTER_ALIASES[idx]
\ No newline at end of file
+        return REGISTER_ALIASES[idx]
@@ -1,158 +1,107 @@
-from utils import *
-
-def get_name(opcode, funct3, funct7, _instr):
-    if funct7 == '0000001':
-        match funct3:
-            case '000':
-                return 'mul'
-            case '001':
-                return 'mulh'
-            case '010':
-                return 'mulhsu'
-            case '011':
-                return 'mulhu'
-            case '100':
-                return 'div'
-            case '101':
-                return 'divu'
-            case '110':
-                return 'rem'
-            case '111':
-                return 'remu'
-    match funct3:
-        case '000':
-            match funct7:
-                case '0000000':
-                    return 'add'
-                case '0100000':
-                    return 'sub'
-                case _:
-                    raise Exception(f'Unknown R-Type Instruction: {_instr}')
-        case '001':
-            return 'sll'
-        case '010':
-            return 'slt'
-        case '011':
-            return 'sltu'
-        case '100':
-            return 'xor'
-        case '110':
-            return 'or'
-        case '111':
-            return 'and'
-        case '101':
-            match funct7:
-                case '0000000':
-                    return 'srl'
-                case '0100000':
-                    return 'sra'
-                case _:
-                    raise Exception(f'Unknown R-Type Instruction: {_instr}')
-
-
-def add(rs1, rs2, imm):
-    return rs1 + rs2
-
-def sub(rs1, rs2, imm):
-    return rs1 - rs2
-
-def sll(rs1, rs2, imm):
-    return rs1 << rs2
-
-def srl(rs1, rs2, imm):
-    b_rs1 = dec_to_twos_comp(rs1, 32)
-    srl_rs1 = '0' * rs2 + b_rs1[:32-rs2]
-    return twos_comp_to_dec(srl_rs1)
-
-def sra(rs1, rs2, imm):
-    b_rs1 = dec_to_twos_comp(rs1, 32)
-    # print(rs1, rs2, b_rs1)
-    sra_rs1 = extend_signal(b_rs1[:32-rs2], 32)
-    return twos_comp_to_dec(sra_rs1)
-
-def slt(rs1, rs2, imm):
-    return 1 if rs1 < rs2 else 0
-
-def sltu(rs1, rs2, imm):
-    u_rs1 = to_uint(dec_to_twos_comp(rs1, 32))
-    u_rs2 = to_uint(dec_to_twos_comp(rs2, 32))
-    return int(u_rs1 < u_rs2)
-
-def xor(rs1, rs2, imm):
-    return rs1 ^ rs2
-
-def or_(rs1, rs2, imm):
-    return rs1 | rs2
-
-def and_(rs1, rs2, imm):
-    return rs1 & rs2
-
-def mul(rs1, rs2, imm):
-    return (rs1 * rs2) & 0b11111111111111111111111111111111
-
-def mulh(rs1, rs2, imm):
-    return ((rs1 * rs2) & 0xffffffff00000000) >> 32
-
-def mulhu(rs1, rs2, imm):
-    return ((int_to_uint(rs1) * int_to_uint(rs2)) & 0xffffffff00000000) >> 32
-
-def mulhsu(rs1, rs2, imm):
-    return ((rs1 * int_to_uint(rs2)) & 0xffffffff00000000) >> 32
-
-def div(rs1, rs2, imm):
-    if rs1 == -(2**31) and rs2 == -1:
-        return rs1
-    if rs2 == 0:
-        return -1
-    if rs1 < 0:
-        if rs2 < 0:
-            return (-rs1)//(-rs2)
-        return -((-rs1)//rs2)
-    if rs2 < 0:
-        return -(rs1//(-rs2))
-    return rs1 // rs2
-
-def divu(rs1, rs2, imm):
-    return int_to_uint(rs1) // int_to_uint(rs2)
-
-def rem(rs1, rs2, imm):
-    if rs1 == -(2**31) and rs2 == -1:
-        return 0
-    if rs2 == 0:
-        return rs1
-    if rs1 < 0:
-        if rs2 < 0:
-            return (-rs1)%(-rs2)
-        return -((-rs1)%rs2)
-    if rs2 < 0:
-        return -(rs1%(-rs2))
-    return rs1 % rs2
-
-def remu(rs1, rs2, imm):
-    if rs2 == 0:
-        return 2**32 - 1
-    return int_to_uint(rs1) % int_to_uint(rs2)
-
-__fundict = {
-    'remu': remu,
-    'rem': rem,
-    'divu': divu,
-    'div': div,
-    'mulhsu': mulhsu,
-    'mulh': mulh,
-    'mulhu': mulhu,
-    'mul': mul,
-    'and': and_,
-    'or': or_,
-    'xor': xor,
-    'sltu': sltu,
-    'slt': slt,
-    'sll': sll,
-    'srl': srl,
-    'sra': sra,
-    'sub': sub,
-    'add': add,
-}
-
-def exec(name, rs1, rs2, imm):
-    return __fundict[name](rs1, rs2, imm)
+from utils import *
+
+def add(rs1, rs2):
+    return rs1 + rs2
+
+def sub(rs1, rs2):
+    return rs1 - rs2
+
+def sll(rs1, rs2):
+    return rs1 << (rs2 & 0x1f)
+
+def srl(rs1, rs2):
+    return rs1 >> (rs2 & 0x1f)
+
+def sra(rs1, rs2):
+    return twos_comp_to_dec(rs1) >> (rs2 & 0x1f)
+
+def slt(rs1, rs2):
+    return 1 if twos_comp_to_dec(rs1) < twos_comp_to_dec(rs2) else 0
+
+def sltu(rs1, rs2):
+    return int(rs1 < rs2)
+
+def xor(rs1, rs2):
+    return rs1 ^ rs2
+
+def or_(rs1, rs2):
+    return rs1 | rs2
+
+def and_(rs1, rs2):
+    return rs1 & rs2
+
+def mul(rs1, rs2):
+    return (rs1 * rs2) & MASK_32
+
+def mulh(rs1, rs2):
+    return (twos_comp_to_dec(rs1) * twos_comp_to_dec(rs2)) >> 32
+
+def mulhu(rs1, rs2):
+    return (rs1 * rs2) >> 32
+
+def mulhsu(rs1, rs2):
+    return (twos_comp_to_dec(rs1) * rs2) >> 32
+
+# the division results follow the RV32M specification where the original string-based helpers did not, so
+# the logs of programs that reach these cases differ from the ones it produced:
+#   divu by zero gives 2**32 - 1 (it raised ZeroDivisionError)
+#   remu by zero gives the dividend (it gave 2**32 - 1)
+#   rem of a positive dividend by a negative divisor is positive (it took the sign of the divisor)
+# div, and rem by zero or of -2**31 by -1, give the same results as before
+
+def div(rs1, rs2):
+    rs1 = twos_comp_to_dec(rs1)
+    rs2 = twos_comp_to_dec(rs2)
+    if rs1 == -(2**31) and rs2 == -1:
+        return rs1
+    if rs2 == 0:
+        return -1
+    if rs1 < 0:
+        if rs2 < 0:
+            return (-rs1)//(-rs2)
+        return -((-rs1)//rs2)
+    if rs2 < 0:
+        return -(rs1//(-rs2))
+    return rs1 // rs2
+
+def divu(rs1, rs2):
+    if rs2 == 0:
+        return MASK_32
+    return rs1 // rs2
+
+def rem(rs1, rs2):
+    rs1 = twos_comp_to_dec(rs1)
+    rs2 = twos_comp_to_dec(rs2)
+    if rs2 == 0:
+        return rs1
+    # the division truncates, so the remainder takes the sign of the dividend (and -2**31 % -1 is 0)
+    remainder = abs(rs1) % abs(rs2)
+    return -remainder if rs1 < 0 else remainder
+
+def remu(rs1, rs2):
+    if rs2 == 0:
+        return rs1
+    return rs1 % rs2
+
+OPERATIONS = {
+    (0b000, 0b0000000): ('add', add),
+    (0b000, 0b0100000): ('sub', sub),
+    (0b001, 0b0000000): ('sll', sll),
+    (0b010, 0b0000000): ('slt', slt),
+    (0b011, 0b0000000): ('sltu', sltu),
+    (0b100, 0b0000000): ('xor', xor),
+    (0b101, 0b0000000): ('srl', srl),
+    (0b101, 0b0100000): ('sra', sra),
+    (0b110, 0b0000000): ('or', or_),
+    (0b111, 0b0000000): ('and', and_),
+    (0b000, 0b0000001): ('mul', mul),
+    (0b001, 0b0000001): ('mulh', mulh),
+    (0b010, 0b0000001): ('mulhsu', mulhsu),
+    (0b011, 0b0000001): ('mulhu', mulhu),
+    (0b100, 0b0000001): ('div', div),
+    (0b101, 0b0000001): ('divu', divu),
+    (0b110, 0b0000001): ('rem', rem),
+    (0b111, 0b0000001): ('remu', remu),
+}
+
+FUNCTIONS = {name: function for name, function in OPERATIONS.values()}
@@ -1,30 +1,342 @@
 from instructions import InstructionsCache
 from register import RegisterBank
 from memory import Memory
+import time
+from collections.abc import Callable
+
+import checkpoint
 import decoder
+import fusion
+import translator
+import tracing
 from utils import *
 
 class Simulator:
-    def __init__(self, instructions_cache: InstructionsCache, register_bank: RegisterBank, memory: Memory, log_file, offset):
+    def __init__(self, instructions_cache: InstructionsCache, register_bank: RegisterBank, memory: Memory,
+                 trace: tracing.TraceSink | None, offset: int):
         self._instructions_cache = instructions_cache
         self._register_bank = register_bank
         self._memory = memory
-        self.decoder = decoder.Decoder(register_bank, memory)
-        self.log = log_file
+        self.decoder = decoder.Decoder()
+        self.trace = trace
         self._offset = offset
+        self._translator = None
+        self._fused = {}
+        self.clock = 0
+        self.finished = False
+        self._periodic = {}
+        self._stats = None
+        self._exec_watched = False
+        memory.pc_source = lambda: register_bank.pc
+        register_bank.retired = lambda: self.clock
+        memory.on_watch_change(self._watches_changed)
+        instructions_cache.on_invalidate(self._code_changed)
 
     def instruction_fetch(self) -> decoder.Instruction:
-        instr = self._instructions_cache.load_instruction(self._register_bank.get_register('pc'))
-        return self.decoder.build_instruction(instr)
+        return self._decode(self._register_bank.pc)
+
+    def _decode(self, pc: int) -> decoder.Instruction:
+        # the one place instructions are decoded and cached, for every engine
+        instr = self._instructions_cache.get_decoded(pc)
+        if instr is None:
+            instr = self.decoder.build_instruction(self._instructions_cache.load_instruction(pc), pc)
+            self._instructions_cache.store_decoded(pc, instr)
+        return instr
 
     def simulate_cycle(self) -> bool:
+        bank = self._register_bank
+        instr = self._decode(bank.pc)
+        regs = bank.regs
+        rs1_value = regs[instr.rs1]
+        rs2_value = regs[instr.rs2]
+        instr.handler(instr, regs, bank, self._memory)
+        if self.trace is not None:
+            self.trace.record(instr, regs[instr.rd], rs1_value, rs2_value)
+        # an ending instruction that moved the pc on (an ecall that did not exit) keeps the program running
+        return not instr.is_end or bank.pc != instr.pc
+
+    def _simulate_watched_cycle(self) -> bool:
+        pc = self._register_bank.pc
+        if self._memory.exec_watched(pc):
+            self._memory.executed(pc)
+        return Simulator.simulate_cycle(self)
+
+    def _simulate_measured_cycle(self) -> bool:
+        # counts every retired instruction and times the phases of one cycle in stats.sample
+        stats = self._stats
+        bank = self._register_bank
+        regs = bank.regs
+        if self._exec_watched and self._memory.exec_watched(bank.pc):
+            self._memory.executed(bank.pc)
+        if self.clock % stats.sample:
+            instr = self.instruction_fetch()
+            rs1_value = regs[instr.rs1]
+            rs2_value = regs[instr.rs2]
+            instr.handler(instr, regs, bank, self._memory)
+            if self.trace is not None:
+                self.trace.record(instr, regs[instr.rd], rs1_value, rs2_value)
+            stats.retired[instr] += 1
+            return not instr.is_end or bank.pc != instr.pc
+        now = time.perf_counter_ns
+        # a miss decodes inside the fetch; stats times every decode on its own, so fetch leaves it out
+        decoding = stats.decode_ns
+        start = now()
         instr = self.instruction_fetch()
-        instr.exec()
-        self.log.write(instr.log() + '\n')
-        return not instr.is_end()
-
-    def simulate(self):
-        self._register_bank.set_register('pc', self._offset)
-        clock = 0
-        while self.simulate_cycle():
-            clock += 1
\ No newline at end of file
+        fetched = now()
+        decoded = stats.decode_ns - decoding
+        rs1_value = regs[instr.rs1]
+        rs2_value = regs[instr.rs2]
+        instr.handler(instr, regs, bank, self._memory)
+        executed = now()
+        if self.trace is not None:
+            self.trace.record(instr, regs[instr.rd], rs1_value, rs2_value)
+        stats.timed(instr, fetched - start - decoded, executed - fetched, now() - executed)
+        return not instr.is_end or bank.pc != instr.pc
+
+    def measure(self, stats) -> None:
+        # stats.Stats; interpreted cycles are counted and sampled from now on
+        self._stats = stats
+        self._select_cycle()
+
+    def _select_cycle(self) -> None:
+        # the checking cycles are only installed while they have something to do
+        self._exec_watched = self._memory.watching('x')
+        if self._stats is not None:
+            self.simulate_cycle = self._simulate_measured_cycle
+        elif self._memory.watching('x'):
+            self.simulate_cycle = self._simulate_watched_cycle
+        else:
+            self.__dict__.pop('simulate_cycle', None)
+
+    def _fuse_at(self, pc: int):
+        # pairs are keyed by the pc of their first instruction, so a jump to the second one runs it alone
+        op = instr = self._decode(pc)
+        if not instr.op.is_terminator:
+            try:
+                second = self._decode(instr.next_pc)
+            except Exception:
+                second = None
+            if second is not None and not second.is_end:
+                op = fusion.fuse(instr, second) or instr
+        self._fused[pc] = op
+        return op
+
+    def _code_changed(self, address: int) -> None:
+        self._fused.pop(address, None)
+        self._fused.pop(address - 4, None)
+
+    def _run_fused(self, limit: int) -> bool:
+        # the interpreter with the fetch inlined and fused pairs; a pair that would cross the limit runs
+        # only its first instruction
+        bank = self._register_bank
+        regs = bank.regs
+        memory = self._memory
+        fused = self._fused
+        clock = self.clock
+        try:
+            while clock != limit:
+                pc = bank.pc
+                op = fused.get(pc)
+                if op is None:
+                    op = self._fuse_at(pc)
+                if op.synced:
+                    # counter reads see the instructions retired so far
+                    self.clock = clock
+                    op.handler(op, regs, bank, memory)
+                    clock += 1
+                    if op.is_end and bank.pc == pc:
+                        return False
+                    continue
+                if op.size == 2 and clock + 1 == limit:
+                    op = op.first
+                op.handler(op, regs, bank, memory)
+                clock += op.size
+            return True
+        finally:
+            self.clock = clock
+
+    def _watches_changed(self) -> None:
+        self._select_cycle()
+        if self._translator is not None:
+            self._translator.rebind()
+
+    def _run_cycles(self, limit: int) -> bool:
+        running = True
+        while running and self.clock != limit:
+            running = self.simulate_cycle()
+            self.clock += 1
+        return running
+
+    @property
+    def register_bank(self) -> RegisterBank:
+        return self._register_bank
+
+    @property
+    def memory(self) -> Memory:
+        return self._memory
+
+    def reset(self) -> None:
+        self._register_bank.pc = self._offset
+        self.clock = 0
+        self.finished = False
+
+    def _start(self, resume: bool) -> None:
+        if not resume:
+            self.reset()
+
+    def checkpoint_every(self, interval: int | None, callback: Callable[['Simulator'], None] | None = None) -> None:
+        self.every('checkpoint', interval, callback)
+
+    def every(self, name: str, interval: int | None,
+              callback: Callable[['Simulator'], None] | None = None) -> None:
+        # runs stop exactly every `interval` retired instructions to call callback(simulator)
+        if interval:
+            self._periodic[name] = (interval, callback)
+        else:
+            self._periodic.pop(name, None)
+
+    @property
+    def entry(self) -> int:
+        return self._offset
+
+    def drop_code(self) -> None:
+        # forgets decoded and translated code, e.g. after the decoder changed
+        self._instructions_cache.clear()
+        self._fused.clear()
+        if self._translator is not None:
+            self._translator.reset()
+
+    def snapshot(self, program: str = '') -> checkpoint.Checkpoint:
+        return checkpoint.capture(self._register_bank, self._memory, self.clock, program)
+
+    def restore(self, state: checkpoint.Checkpoint) -> None:
+        checkpoint.apply(state, self._register_bank, self._memory)
+        self.drop_code()
+        self.clock = state.clock
+        self.finished = False
+
+    def fork(self, trace: tracing.TraceSink | None = None) -> 'Simulator':
+        # an independent machine in the same state; memory pages are shared copy-on-write and the
+        # child reuses the decoded instructions and compiled blocks
+        memory = self._memory.fork()
+        bank = RegisterBank(hartid=self._register_bank.hartid)
+        bank.regs[:] = self._register_bank.regs
+        bank.pc = self._register_bank.pc
+        child = Simulator(self._instructions_cache.fork(memory), bank, memory, trace, self._offset)
+        child.decoder = self.decoder
+        child.clock = self.clock
+        child.finished = self.finished
+        compiled = None if self._translator is None else self._translator.export()
+        if compiled and translator.trace_mode(trace) == translator.trace_mode(self.trace):
+            child._block_translator().preload(compiled)
+        return child
+
+    def run_until(self, pc: int, max_instructions: int | None = None) -> bool:
+        # runs until the next instruction is at pc; False if the program ends or the budget runs out first
+        bank = self._register_bank
+        while bank.pc != pc:
+            if self.finished or self.clock == max_instructions:
+                return False
+            self.finished = not self.simulate_cycle()
+            self.clock += 1
+        return True
+
+    def _drive(self, run, max_instructions: int | None) -> bool:
+        periodic = list(self._periodic.values())
+        while True:
+            limit = -1 if max_instructions is None else max_instructions
+            stop = None
+            if periodic:
+                stop = min((self.clock // interval + 1) * interval for interval, _ in periodic)
+                if limit < 0 or stop < limit:
+                    limit = stop
+            running = run(limit)
+            if not running or self.clock != stop:
+                break
+            for interval, callback in periodic:
+                if self.clock % interval == 0:
+                    callback(self)
+        self.finished = not running
+        self.finish_trace()
+        return self.finished
+
+    def run_for(self, instructions: int, blocks: bool = False) -> bool:
+        # one scheduling quantum from the current state; unlike simulate() it leaves the trace open
+        run = self._run_blocks if blocks else self._run_cycles
+        self.finished = not run(self.clock + instructions)
+        return self.finished
+
+    def simulate(self, max_instructions: int | None = None, resume: bool = False) -> bool:
+        self._start(resume)
+        return self._drive(self._run_cycles, max_instructions)
+
+    def simulate_fused(self, max_instructions: int | None = None, resume: bool = False) -> bool:
+        # traced runs and exec watchpoints need every instruction on its own, so they use the interpreter
+        self._start(resume)
+        if self.trace is not None or self._memory.watching('x'):
+            return self._drive(self._run_cycles, max_instructions)
+        return self._drive(self._run_fused, max_instructions)
+
+    def finish_trace(self):
+        if self.trace is not None:
+            self.trace.finish(self._register_bank, self.clock)
+
+    def simulate_blocks(self, max_instructions: int | None = None, resume: bool = False) -> bool:
+        self._start(resume)
+        return self._drive(self._run_blocks, max_instructions)
+
+    def _block_translator(self) -> translator.BlockTranslator:
+        if self._translator is None:
+            self._translator = translator.BlockTranslator(
+                self._instructions_cache, self._register_bank, self._memory, self._decode, self.trace)
+        return self._translator
+
+    def code_range(self) -> tuple[int, int]:
+        return self._instructions_cache.start, self._instructions_cache.end
+
+    def code_image(self) -> bytes:
+        return self._instructions_cache.code_image()
+
+    def export_code(self) -> dict:
+        # only the compiled blocks: rebuilding a decoded instruction costs about as much as decoding it again
+        blocks = None if self._translator is None else self._translator.export()
+        return {'blocks': blocks or {}}
+
+    def preload(self, code: dict) -> None:
+        if code['blocks']:
+            self._block_translator().preload(code['blocks'])
+
+    def _run_blocks(self, limit: int) -> bool:
+        blocks = self._block_translator()
+        state = blocks.state
+        regs = self._register_bank.regs
+        emit = translator.trace_emitter(self.trace)
+        if self.clock == limit:
+            return True
+        block = blocks.get_block(self._register_bank.pc)
+        running = True
+        while True:
+            if limit >= 0 and self.clock + block.size > limit:
+                # the budget or a periodic stop falls inside the block: the interpreter runs up to it, so
+                # no truncated copy of the block is compiled for every stop
+                self._register_bank.pc = block.start
+                return self._run_cycles(limit)
+            state[0] = False
+            pc, count = block.run(regs, emit, state)
+            self.clock += count
+            if block.is_end and count == block.size and pc == block.end - 4:
+                running = False
+                break
+            if self.clock == limit:
+                break
+            successor = block.successors.get(pc)
+            if successor is None or not successor.valid:
+                try:
+                    successor = blocks.get_block(pc)
+                except Exception:
+                    self._register_bank.pc = pc
+                    raise
+                block.successors[pc] = successor
+            block = successor
+        self._register_bank.pc = pc
+        return running
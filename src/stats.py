@@ -0,0 +1,131 @@
+import collections
+import contextlib
+import cProfile
+import sys
+import time
+
+from simulator import Simulator
+
+DEFAULT_SAMPLE = 64
+PHASES = ('fetch', 'exec', 'trace')
+
+class Stats:
+    # host-side counters of one run: instructions retired by the interpreter, the time of its fetch, exec and
+    # trace phases measured on one cycle in `sample`, and every decode in any engine; a run resumed from a
+    # checkpoint only counts the instructions retired after attach()
+    sample: int
+    retired: collections.Counter
+    phases: dict[str, int]
+    samples: int
+    decoded: int
+    decode_ns: int
+    _sim: Simulator | None
+    _start: float
+    _start_clock: int
+
+    def __init__(self, sample: int = DEFAULT_SAMPLE):
+        self.sample = sample
+        self.retired = collections.Counter()
+        self.phases = dict.fromkeys(PHASES, 0)
+        self.samples = 0
+        self.decoded = 0
+        self.decode_ns = 0
+        self._sim = None
+        self._start = time.perf_counter()
+        self._start_clock = 0
+
+    def attach(self, sim: Simulator) -> None:
+        build = sim.decoder.build_instruction
+        now = time.perf_counter_ns
+
+        def build_instruction(instruction: int, pc: int):
+            start = now()
+            try:
+                return build(instruction, pc)
+            finally:
+                self.decode_ns += now() - start
+                self.decoded += 1
+        sim.decoder.build_instruction = build_instruction
+        sim.measure(self)
+        self._sim = sim
+        self._start = time.perf_counter()
+        self._start_clock = sim.clock
+
+    def timed(self, instr, fetch: int, execute: int, trace: int) -> None:
+        self.retired[instr] += 1
+        self.samples += 1
+        phases = self.phases
+        phases['fetch'] += fetch
+        phases['exec'] += execute
+        phases['trace'] += trace
+
+    def mnemonics(self) -> collections.Counter:
+        counts = collections.Counter()
+        for instr, count in self.retired.items():
+            counts[instr.name] += count
+        return counts
+
+    def formats(self) -> collections.Counter:
+        counts = collections.Counter()
+        for instr, count in self.retired.items():
+            counts[instr.op.format] += count
+        return counts
+
+    def summary(self) -> dict:
+        seconds = time.perf_counter() - self._start
+        instructions = self._sim.clock - self._start_clock if self._sim is not None else 0
+        interpreted = sum(self.retired.values())
+        result = {
+            'instructions': instructions,
+            'seconds': seconds,
+            'mips': instructions / seconds / 1e6 if seconds > 0 else 0.0,
+            'decode': {'count': self.decoded, 'seconds': self.decode_ns / 1e9},
+        }
+        if self.samples:
+            # the sampled cycles stand for every interpreted one
+            scale = interpreted / self.samples / 1e9
+            result['phases'] = {phase: total * scale for phase, total in self.phases.items()}
+            result['phases']['samples'] = self.samples
+        if interpreted:
+            result['mnemonics'] = dict(self.mnemonics().most_common())
+            result['formats'] = dict(self.formats().most_common())
+        return result
+
+class Progress:
+    # a periodic callback printing the speed since the previous report and since the start; clock is where
+    # the run starts, e.g. the one restored from a checkpoint
+    name: str
+    out: object
+    _start: float
+    _start_clock: int
+    _last_time: float
+    _last_clock: int
+
+    def __init__(self, name: str, out=None, clock: int = 0):
+        self.name = name
+        self.out = out if out is not None else sys.stderr
+        self._start = self._last_time = time.perf_counter()
+        self._start_clock = self._last_clock = clock
+
+    def __call__(self, sim: Simulator) -> None:
+        now = time.perf_counter()
+        current = (sim.clock - self._last_clock) / max(now - self._last_time, 1e-9) / 1e6
+        average = (sim.clock - self._start_clock) / max(now - self._start, 1e-9) / 1e6
+        print(f'{self.name}: {sim.clock} instructions, {current:.3f} MIPS ({average:.3f} average)',
+              file=self.out, flush=True)
+        self._last_time = now
+        self._last_clock = sim.clock
+
+@contextlib.contextmanager
+def host_profile(path: str | None):
+    # runs the body under cProfile and saves the result for pstats or snakeviz
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
@@ -0,0 +1,148 @@
+import argparse
+import itertools
+import os
+import pickle
+import sys
+import time
+import traceback
+from collections.abc import Callable
+
+import batch
+import main
+from register import REGISTER_ALIASES
+from simulator import Simulator
+
+def prepare(path: str, at: int | None = None, max_instructions: int | None = None) -> Simulator:
+    sim = main.build_simulator(path)
+    sim.reset()
+    if at is not None and not sim.run_until(at, max_instructions):
+        raise Exception(f'{main.program_name(path)} does not reach pc {at:08x}')
+    return sim
+
+def apply_patches(sim: Simulator, patches: list[tuple[int, bytes]]) -> None:
+    for address, data in patches:
+        sim.memory.write(address, data)
+
+def outcome(sim: Simulator) -> dict:
+    bank = sim.register_bank
+    return {'pc': bank.pc, 'registers': list(bank.regs)}
+
+def run_variant(parent: Simulator, patches: list[tuple[int, bytes]], engine: str = 'interpreter',
+                max_instructions: int | None = None, collect: Callable[[Simulator], dict] = outcome) -> dict:
+    child = parent.fork()
+    apply_patches(child, patches)
+    result = {'status': 'ok', 'instructions': 0, 'error': None}
+    try:
+        limit = None if max_instructions is None else child.clock + max_instructions
+        if engine == 'block':
+            child.simulate_blocks(limit, resume=True)
+        elif engine == 'fused':
+            child.simulate_fused(limit, resume=True)
+        else:
+            child.simulate(limit, resume=True)
+        if not child.finished:
+            result['status'] = 'budget'
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+    result['instructions'] = child.clock - parent.clock
+    result.update(collect(child))
+    return result
+
+def _run_forked(parent: Simulator, variants: list, workers: int, **options) -> list[dict]:
+    # each worker process inherits the prepared machine and forks it again for every variant
+    processes = []
+    for worker in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            code = 0
+            try:
+                results = [(n, run_variant(parent, variants[n], **options))
+                           for n in range(worker, len(variants), workers)]
+                with os.fdopen(write, 'wb') as f:
+                    pickle.dump(results, f)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        os.close(write)
+        processes.append((pid, read))
+    results = [None] * len(variants)
+    for pid, read in processes:
+        with os.fdopen(read, 'rb') as f:
+            data = f.read()
+        _, status = os.waitpid(pid, 0)
+        if status != 0 or not data:
+            raise Exception(f'Sweep worker {pid} failed')
+        for n, result in pickle.loads(data):
+            results[n] = result
+    return results
+
+def run(parent: Simulator, variants: list[list[tuple[int, bytes]]], workers: int = 1, **options) -> list[dict]:
+    if options.get('engine') == 'batch':
+        return batch.run(parent, variants, options.get('max_instructions'))
+    if workers > 1 and hasattr(os, 'fork'):
+        return _run_forked(parent, variants, min(workers, len(variants)), **options)
+    return [run_variant(parent, patches, **options) for patches in variants]
+
+def parse_values(text: str) -> list[int]:
+    # comma-separated numbers and inclusive START..END ranges
+    values = []
+    for item in text.split(','):
+        if '..' in item:
+            first, last = item.split('..')
+            values += range(int(first, 0), int(last, 0) + 1)
+        else:
+            values.append(int(item, 0))
+    return values
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run one program many times with different values patched into memory')
+    parser.add_argument('program')
+    parser.add_argument('--at', default=None,
+                        help='address or ELF symbol to run to once before forking (default: the entry point)')
+    parser.add_argument('--patch', action='append', default=[], metavar='TARGET=VALUES',
+                        help='32-bit words written at an address or ELF symbol, e.g. n=1,2,8..16;'
+                             ' every combination of the patches is run')
+    parser.add_argument('--engine', choices=['interpreter', 'block', 'fused', 'batch'], default='interpreter',
+                        help='batch runs every variant at once as NumPy arrays, one instruction per group of'
+                             ' variants at the same pc')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of forked worker processes')
+    parser.add_argument('--max-instructions', type=int, default=None,
+                        help='instruction budget of each variant after the fork')
+    parser.add_argument('--registers', default='a0',
+                        help='comma-separated registers shown for each variant')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    at = None if args.at is None else main.resolve_address(args.program, args.at)[0]
+    targets, value_lists = [], []
+    for spec in args.patch:
+        target, _, values = spec.partition('=')
+        targets.append(target)
+        value_lists.append(parse_values(values))
+    addresses = [main.resolve_address(args.program, target)[0] for target in targets]
+    combinations = list(itertools.product(*value_lists))
+    variants = [[(address, (value & 0xffffffff).to_bytes(4, 'little')) for address, value in zip(addresses, values)]
+                for values in combinations]
+    shown = [REGISTER_ALIASES.index(name) for name in args.registers.split(',')]
+
+    start = time.perf_counter()
+    parent = prepare(args.program, at)
+    prepared = time.perf_counter()
+    results = run(parent, variants, args.jobs, engine=args.engine, max_instructions=args.max_instructions)
+    finished = time.perf_counter()
+    failures = 0
+    for values, result in zip(combinations, results):
+        name = ' '.join(f'{target}={value}' for target, value in zip(targets, values)) or '(no patches)'
+        registers = ' '.join(f'{REGISTER_ALIASES[idx]}={result["registers"][idx]:08x}' for idx in shown)
+        print(f'{name}: {result["status"]} {result["instructions"]} instructions {registers}')
+        if result['error']:
+            failures += 1
+            print(result['error'], end='')
+    print(f'{len(variants)} variants from pc {parent.register_bank.pc:08x} after {parent.clock} instructions:'
+          f' setup {prepared - start:.2f}s, sweep {finished - prepared:.2f}s')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,445 @@
+import argparse
+import array
+import collections
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+
+import decoder
+from register import RegisterBank
+
+TRACE_LEVELS = ('off', 'summary', 'full')
+TRACE_FORMATS = ('text', 'binary')
+TRACE_COMPRESSIONS = ('none', 'gzip', 'lzma')
+COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'lzma': '.xz'}
+
+MAGIC = b'RVTRACE1'
+FOOTER_MAGIC = b'RVTRIDX1'
+DEFAULT_INDEX_INTERVAL = 4096
+DEFAULT_CONTEXT = 10
+REFERENCE_SUFFIXES = ('.log', '.log.gz', '.log.xz', '.trace')
+BUFFER_RECORDS = 1 << 16
+WRITE_BUFFER_SIZE = 4 << 20
+
+# pc, word, rd, rs1, rs2, op, rd value, rs1 value, rs2 value; op is 0 for instructions decoded from their word,
+# otherwise 1 + the position of a host call in the table of ops stored before the footer
+_record = struct.Struct('<IIBBBBIII')
+_header = struct.Struct('<8sII')
+_index_entry = struct.Struct('<QQI')
+_footer = struct.Struct('<QQQ8s')
+RECORD_SIZE = _record.size
+
+class TraceSink:
+    def record(self, instr: decoder.Instruction, rd_value: int, rs1_value: int, rs2_value: int) -> None:
+        raise NotImplementedError()
+
+    def finish(self, register_bank: RegisterBank, instructions: int) -> None:
+        return
+
+class TextTrace(TraceSink):
+    def __init__(self, file):
+        self.write = file.write
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        self.write(instr.log(rd_value, rs1_value, rs2_value) + '\n')
+
+class BinaryTrace(TraceSink):
+    _file: object
+    _buffer: bytearray
+    _pos: int
+    _count: int
+    _index_interval: int
+    _index: list[tuple[int, int, int]]
+    _ops: dict
+    _op_table: list[tuple[str, str, str]]
+
+    def __init__(self, file, index_interval: int = DEFAULT_INDEX_INTERVAL):
+        self._file = file
+        self._buffer = bytearray(BUFFER_RECORDS * RECORD_SIZE)
+        self._pos = 0
+        self._count = 0
+        self._index_interval = index_interval
+        self._index = []
+        self._ops = {}
+        self._op_table = []
+        if file is not None:
+            file.write(_header.pack(MAGIC, RECORD_SIZE, index_interval))
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        op = self._ops.get(instr.op)
+        if op is None:
+            op = self._op_number(instr)
+        pos = self._pos
+        _record.pack_into(self._buffer, pos, instr.pc, instr.word, instr.rd, instr.rs1, instr.rs2, op,
+                          rd_value, rs1_value, rs2_value)
+        pos += RECORD_SIZE
+        if pos == len(self._buffer):
+            self._pos = pos
+            self._flush()
+            pos = 0
+        self._pos = pos
+
+    def _op_number(self, instr) -> int:
+        # host calls (ecall services, intercepted routines) are not what their word decodes to, so the
+        # reader needs their name and layout
+        op = instr.op
+        if decoder.table_op(instr.word) is op:
+            number = 0
+        else:
+            if len(self._op_table) == 255:
+                raise Exception('Too many host call ops for a binary trace')
+            self._op_table.append((op.name, op.format, op.layout))
+            number = len(self._op_table)
+        self._ops[op] = number
+        return number
+
+    def _flush(self) -> None:
+        view = memoryview(self._buffer)[:self._pos]
+        first = self._count
+        self._count += self._pos // RECORD_SIZE
+        n = -(-first // self._index_interval) * self._index_interval
+        while n < self._count:
+            offset = (n - first) * RECORD_SIZE
+            pc = _record.unpack_from(view, offset)[0]
+            self._index.append((n, _header.size + n * RECORD_SIZE, pc))
+            n += self._index_interval
+        self._file.write(view)
+        self._pos = 0
+
+    def finish(self, register_bank, instructions):
+        self._flush()
+        index_offset = _header.size + self._count * RECORD_SIZE
+        for entry in self._index:
+            self._file.write(_index_entry.pack(*entry))
+        if self._op_table:
+            self._file.write(json.dumps(self._op_table).encode())
+        self._file.write(_footer.pack(self._count, index_offset, len(self._index), FOOTER_MAGIC))
+
+class SummaryTrace(TraceSink):
+    # hashes the pc and rd value of each instruction, appended to an array and hashed in batches, instead of
+    # packing full binary records; the hash only compares summary runs with each other
+    _summary_file: object
+    _values: array.array
+
+    def __init__(self, file):
+        self._summary_file = file
+        self._values = array.array('I')
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        values = self._values
+        values.append(instr.pc)
+        values.append(rd_value)
+        if len(values) >= BUFFER_RECORDS:
+            self._hash.update(values)
+            del values[:]
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def finish(self, register_bank, instructions):
+        self._hash.update(self._values)
+        del self._values[:]
+        json.dump(summary(register_bank, instructions, self.hexdigest()), self._summary_file, indent=2)
+        self._summary_file.write('\n')
+
+class TeeTrace(TraceSink):
+    # feeds every retired instruction to several sinks, e.g. the log and a timing model
+    sinks: list[TraceSink]
+
+    def __init__(self, sinks: list[TraceSink]):
+        self.sinks = sinks
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        for sink in self.sinks:
+            sink.record(instr, rd_value, rs1_value, rs2_value)
+
+    def finish(self, register_bank, instructions):
+        for sink in self.sinks:
+            sink.finish(register_bank, instructions)
+
+def summary(register_bank: RegisterBank, instructions: int, trace_hash: str) -> dict:
+    return {
+        'instructions': instructions,
+        'trace_hash': trace_hash,
+        'pc': f'{register_bank.pc:08x}',
+        'registers': {f'x{idx:02d}': f'{value:08x}' for idx, value in enumerate(register_bank.regs)},
+    }
+
+class TraceReader:
+    _file: object
+    count: int
+    index_interval: int
+    index: list[tuple[int, int, int]]
+    ops: list[decoder.OpDescriptor]
+    _decoded: dict
+    _build: object
+
+    def __init__(self, file):
+        self._file = file
+        magic, record_size, self.index_interval = _header.unpack(file.read(_header.size))
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            raise Exception('Not a binary trace file')
+        footer_offset = file.seek(-_footer.size, 2)
+        self.count, index_offset, entries, footer_magic = _footer.unpack(file.read(_footer.size))
+        if footer_magic != FOOTER_MAGIC:
+            raise Exception('Truncated binary trace file')
+        file.seek(index_offset)
+        raw = file.read(entries * _index_entry.size)
+        self.index = [_index_entry.unpack_from(raw, i * _index_entry.size) for i in range(entries)]
+        table = file.read(footer_offset - file.tell())
+        self.ops = [decoder.OpDescriptor(name, format_, None, layout)
+                    for name, format_, layout in (json.loads(table) if table else [])]
+        self._decoded = {}
+        self._build = decoder.Decoder().build_instruction
+
+    def instruction(self, record: tuple) -> decoder.Instruction:
+        # the instruction a record was made by, with the fields it logged
+        pc, word, rd, rs1, rs2, op = record[:6]
+        instr = self._decoded.get((pc, word, op, rd, rs1, rs2))
+        if instr is None:
+            if op:
+                instr = decoder.Instruction(self.ops[op - 1], word, pc)
+                instr.rd, instr.rs1, instr.rs2 = rd, rs1, rs2
+            else:
+                instr = self._build(word, pc)
+            self._decoded[pc, word, op, rd, rs1, rs2] = instr
+        return instr
+
+    def render(self, record: tuple) -> str:
+        return self.instruction(record).log(*record[6:])
+
+    def _seek(self, start: int) -> None:
+        offset = _header.size
+        base = 0
+        for n, entry_offset, _ in self.index:
+            if n > start:
+                break
+            base, offset = n, entry_offset
+        self._file.seek(offset + (start - base) * RECORD_SIZE)
+
+    def records(self, start: int = 0, stop: int | None = None):
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        self._seek(start)
+        remaining = stop - start
+        while remaining:
+            chunk = self._file.read(min(remaining, BUFFER_RECORDS) * RECORD_SIZE)
+            yield from _record.iter_unpack(chunk)
+            remaining -= len(chunk) // RECORD_SIZE
+
+def render(reader: TraceReader, out, start: int = 0, stop: int | None = None) -> None:
+    for record in reader.records(start, stop):
+        out.write(reader.render(record) + '\n')
+
+_register_field = re.compile(r'x(\d\d)=([0-9a-f]{8})')
+
+class TraceMismatch(Exception):
+    instruction: int
+    expected: str | None
+    actual: str | None
+    context: list[str]
+
+    def __init__(self, instruction: int, expected: str | None, actual: str | None, context: list[str]):
+        self.instruction = instruction
+        self.expected = expected
+        self.actual = actual
+        self.context = context
+        super().__init__(self.report())
+
+    def report(self) -> str:
+        if self.expected is None:
+            lines = [f'Trace mismatch after {self.instruction} matching instructions: the reference ended',
+                     f'  actual:   {self.actual}']
+        elif self.actual is None:
+            lines = [f'Trace mismatch after {self.instruction} matching instructions: the program ended',
+                     f'  expected: {self.expected}']
+        else:
+            lines = [f'Trace mismatch after {self.instruction} matching instructions (PC={self.actual[3:11]}):',
+                     f'  expected: {self.expected}',
+                     f'  actual:   {self.actual}']
+            expected = _register_field.findall(self.expected)
+            actual = _register_field.findall(self.actual)
+            for (expected_reg, expected_value), (actual_reg, actual_value) in zip(expected, actual):
+                if expected_reg != actual_reg:
+                    lines.append(f'  expected x{expected_reg}={expected_value}, actual x{actual_reg}={actual_value}')
+                elif expected_value != actual_value:
+                    lines.append(f'  x{expected_reg}: expected {expected_value}, actual {actual_value}')
+        if self.context:
+            lines.append(f'previous {len(self.context)} instructions:')
+            lines += ['  ' + line for line in self.context]
+        return '\n'.join(lines)
+
+def find_reference(folder: str, name: str) -> str | None:
+    for suffix in REFERENCE_SUFFIXES:
+        path = os.path.join(folder, name + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+class GoldenTrace(TraceSink):
+    _file: object
+    _lines: object
+    _records: object
+    _reader: TraceReader | None
+    _context: collections.deque
+    _count: int
+
+    def __init__(self, path: str, context: int = DEFAULT_CONTEXT):
+        self._lines = None
+        self._records = self._reader = None
+        if path.endswith('.trace'):
+            self._file = open(path, 'rb')
+            self._reader = TraceReader(self._file)
+            self._records = self._reader.records()
+        else:
+            opener = gzip.open if path.endswith('.gz') else lzma.open if path.endswith('.xz') else open
+            self._file = opener(path, 'rt')
+            self._lines = iter(self._file)
+        self._context = collections.deque(maxlen=context)
+        self._count = 0
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _next(self) -> str | None:
+        if self._records is not None:
+            record = next(self._records, None)
+            return None if record is None else self._reader.render(record)
+        line = next(self._lines, None)
+        return None if line is None else line.rstrip('\n')
+
+    def record(self, instr, rd_value, rs1_value, rs2_value):
+        if self._records is not None:
+            expected = next(self._records, None)
+            same = expected is not None and expected[:5] + expected[6:] == (
+                instr.pc, instr.word, instr.rd, instr.rs1, instr.rs2, rd_value, rs1_value, rs2_value)
+            if not same or self._reader.instruction(expected).name != instr.name:
+                self._mismatch(None if expected is None else self._reader.render(expected),
+                               instr.log(rd_value, rs1_value, rs2_value))
+        else:
+            actual = instr.log(rd_value, rs1_value, rs2_value)
+            expected = next(self._lines, None)
+            if expected is None or expected.rstrip('\n') != actual:
+                self._mismatch(None if expected is None else expected.rstrip('\n'), actual)
+        self._count += 1
+        self._context.append((instr, rd_value, rs1_value, rs2_value))
+
+    def _mismatch(self, expected: str | None, actual: str | None):
+        context = [instr.log(*values) for instr, *values in self._context]
+        raise TraceMismatch(self._count, expected, actual, context)
+
+    def check_end(self) -> None:
+        # only meaningful once the program has finished; budget-limited runs compare a prefix
+        expected = self._next()
+        if expected is not None:
+            self._mismatch(expected, None)
+
+class BackgroundWriter:
+    # text file whose full buffers are compressed and written by a worker thread; at most one buffer
+    # waits in the queue while another is being filled, so memory stays bounded
+    _file: object
+    _chunks: list[str]
+    _size: int
+    _buffer_size: int
+    _queue: queue.Queue
+    _thread: threading.Thread
+    _error: BaseException | None
+
+    def __init__(self, path: str, compression: str = 'gzip', buffer_size: int = WRITE_BUFFER_SIZE):
+        if compression == 'gzip':
+            self._file = gzip.open(path, 'wb', compresslevel=1)
+        elif compression == 'lzma':
+            self._file = lzma.open(path, 'wb', preset=1)
+        elif compression == 'none':
+            self._file = open(path, 'wb')
+        else:
+            raise Exception(f'Unknown trace compression: {compression}')
+        self._chunks = []
+        self._size = 0
+        self._buffer_size = buffer_size
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def write(self, text: str) -> None:
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self._buffer_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        if self._error is not None:
+            raise Exception(f'Trace writer failed: {self._error}')
+        if self._chunks:
+            self._queue.put(''.join(self._chunks).encode())
+            self._chunks = []
+            self._size = 0
+
+    def _drain(self) -> None:
+        # zlib and lzma release the GIL while compressing, so this overlaps with the simulation
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is None:
+                try:
+                    self._file.write(data)
+                except BaseException as error:
+                    self._error = error
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        try:
+            self._submit()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+        if self._error is not None:
+            raise Exception(f'Trace writer failed: {self._error}')
+
+def open_trace(path: str, level: str, trace_format: str, index_interval: int = DEFAULT_INDEX_INTERVAL,
+               compression: str = 'none'):
+    if level == 'off':
+        return None, None
+    if level == 'summary':
+        file = open(path + '.summary.json', 'tw')
+        return SummaryTrace(file), file
+    if trace_format == 'binary':
+        file = open(path + '.trace', 'wb')
+        return BinaryTrace(file, index_interval), file
+    if compression != 'none':
+        file = BackgroundWriter(path + '.log' + COMPRESSION_SUFFIXES[compression], compression)
+        return TextTrace(file), file
+    file = open(path + '.log', 'tw')
+    return TextTrace(file), file
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Render a binary trace in the text log format')
+    parser.add_argument('trace')
+    parser.add_argument('--start', type=int, default=0, help='first instruction to render')
+    parser.add_argument('--stop', type=int, default=None, help='instruction to stop before')
+    parser.add_argument('-o', '--output', default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.trace, 'rb') as f:
+        out = open(args.output, 'tw') if args.output else sys.stdout
+        try:
+            render(TraceReader(f), out, args.start, args.stop)
+        finally:
+            if out is not sys.stdout:
+                out.close()
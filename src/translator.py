@@ -0,0 +1,395 @@
+from collections.abc import Callable
+
+from instructions import InstructionsCache
+from register import RegisterBank, REGISTER_ALIASES
+from memory import Memory
+import decoder
+import rtype_helper
+import tracing
+from utils import *
+
+MAX_BLOCK_SIZE = 64
+
+_SIGNED = '(({0} ^ 0x80000000) - 0x80000000)'
+
+_BRANCH_CONDITIONS = {
+    'beq': '{a} == {b}',
+    'bne': '{a} != {b}',
+    'blt': '({a} ^ 0x80000000) < ({b} ^ 0x80000000)',
+    'bge': '({a} ^ 0x80000000) >= ({b} ^ 0x80000000)',
+    'bltu': '{a} < {b}',
+    'bgeu': '{a} >= {b}',
+}
+
+_RTYPE_EXPRESSIONS = {
+    'add': '({a} + {b}) & 0xffffffff',
+    'sub': '({a} - {b}) & 0xffffffff',
+    'sll': '({a} << ({b} & 0x1f)) & 0xffffffff',
+    'srl': '{a} >> ({b} & 0x1f)',
+    'sra': '(' + _SIGNED.format('{a}') + ' >> ({b} & 0x1f)) & 0xffffffff',
+    'slt': 'int(({a} ^ 0x80000000) < ({b} ^ 0x80000000))',
+    'sltu': 'int({a} < {b})',
+    'xor': '{a} ^ {b}',
+    'or': '{a} | {b}',
+    'and': '{a} & {b}',
+    'mul': '({a} * {b}) & 0xffffffff',
+}
+
+_ITYPE_EXPRESSIONS = {
+    'addi': '({a} + {imm}) & 0xffffffff',
+    'slti': 'int(' + _SIGNED.format('{a}') + ' < {imm})',
+    'sltiu': 'int({a} < {uimm})',
+    'xori': '{a} ^ {uimm}',
+    'ori': '{a} | {uimm}',
+    'andi': '{a} & {uimm}',
+    'slli': '({a} << {shamt}) & 0xffffffff',
+    'srli': '{a} >> {shamt}',
+    'srai': '(' + _SIGNED.format('{a}') + ' >> {shamt}) & 0xffffffff',
+}
+
+_LOAD_EXPRESSIONS = {
+    'lb': '((load_byte({addr}) ^ 0x80) - 0x80) & 0xffffffff',
+    'lh': '((load_half({addr}) ^ 0x8000) - 0x8000) & 0xffffffff',
+    'lw': 'load_word({addr})',
+    'lbu': 'load_byte({addr})',
+    'lhu': 'load_half({addr})',
+}
+
+_STORE_FUNCTIONS = {'sb': 'store_byte', 'sh': 'store_half', 'sw': 'store_word'}
+
+HOST_CALLS = ('ecall', 'hle')
+
+class Block:
+    start: int
+    end: int
+    size: int
+    is_end: bool
+    valid: bool
+    successors: dict
+    # run(regs, emit, state) -> (next pc, instructions retired)
+    run: Callable[..., tuple[int, int]]
+
+    def __init__(self, start: int, end: int, size: int, is_end: bool, run: Callable[..., tuple[int, int]]):
+        self.start = start
+        self.end = end
+        self.size = size
+        self.is_end = is_end
+        self.valid = True
+        self.successors = {}
+        self.run = run
+
+class BlockTranslator:
+    _instructions_cache: InstructionsCache
+    _register_bank: RegisterBank
+    _memory: Memory
+    _decode: Callable[[int], decoder.Instruction]
+    _trace: str | None
+    _blocks: dict[int, Block]
+    _covering: dict[int, list[Block]]
+    _globals: dict
+    _compiled: dict[tuple[int, int], tuple] | None
+    _preloaded: dict[tuple[int, int], tuple]
+    _preloaded_words: set[int]
+    state: list[bool]
+
+    def __init__(self, instructions_cache: InstructionsCache, register_bank: RegisterBank, memory: Memory,
+                 decode: Callable[[int], decoder.Instruction], trace: tracing.TraceSink | None):
+        self._instructions_cache = instructions_cache
+        self._register_bank = register_bank
+        self._memory = memory
+        # the simulator's decoding, which caches the instructions it builds
+        self._decode = decode
+        self._trace = trace_mode(trace)
+        self._blocks = {}
+        self._covering = {}
+        self._compiled = {}
+        self._preloaded = {}
+        self._preloaded_words = set()
+        self.state = [False]
+        self._bind()
+        instructions_cache.on_invalidate(self.invalidate)
+
+    def _bind(self) -> None:
+        memory = self._memory
+        self._globals = {
+            'load_byte': memory.load_byte,
+            'load_half': memory.load_half,
+            'load_word': memory.load_word,
+            'store_byte': memory.store_byte,
+            'store_half': memory.store_half,
+            'store_word': memory.store_word,
+            'bank': self._register_bank,
+            'executed': memory.executed,
+            'memory': memory,
+            'csr_access': decoder.csr_access,
+        }
+        for name, function in rtype_helper.FUNCTIONS.items():
+            self._globals['_' + name] = function
+
+    def rebind(self) -> None:
+        # watchpoints swap the memory accessors; compiled code stays valid, only the blocks holding
+        # the old functions are dropped
+        self._bind()
+        self._drop_blocks()
+
+    def invalidate(self, address: int) -> None:
+        # compiled code only describes the loaded image until the program writes to an instruction it
+        # covers; stores to data that shares the code range (the globals of a .bin image) leave it alone
+        blocks = self._covering.pop(address, None)
+        if blocks or address in self._preloaded_words:
+            self._compiled = None
+            self._preloaded.clear()
+            self._preloaded_words.clear()
+        if not blocks:
+            return
+        for block in blocks:
+            if block.valid:
+                block.valid = False
+                if self._blocks.get(block.start) is block:
+                    del self._blocks[block.start]
+        self.state[0] = True
+
+    def reset(self) -> None:
+        self._compiled = None
+        self._preloaded.clear()
+        self._preloaded_words.clear()
+        self._drop_blocks()
+
+    def _drop_blocks(self) -> None:
+        for block in self._blocks.values():
+            block.valid = False
+        self._blocks.clear()
+        self._covering.clear()
+        self.state[0] = True
+
+    def get_block(self, pc: int) -> Block:
+        block = self._blocks.get(pc)
+        if block is None:
+            block = self._translate(pc)
+            self._blocks[pc] = block
+            self._cover(block)
+        return block
+
+    def _cover(self, block: Block) -> None:
+        for address in range(block.start, block.end, 4):
+            self._covering.setdefault(address, []).append(block)
+
+    def _collect(self, start: int, size: int) -> list[decoder.Instruction]:
+        instructions = []
+        pc = start
+        while len(instructions) < size:
+            try:
+                instr = self._decode(pc)
+            except Exception:
+                if not instructions:
+                    raise
+                break
+            instructions.append(instr)
+            if instr.op.is_terminator:
+                break
+            pc = instr.next_pc
+        return instructions
+
+    def export(self) -> dict[tuple[int, int], tuple] | None:
+        return self._compiled
+
+    def preload(self, compiled: dict[tuple[int, int], tuple]) -> None:
+        self._preloaded.update(compiled)
+        for (start, _), (_, count, _, _) in compiled.items():
+            self._preloaded_words.update(range(start, start + 4 * count, 4))
+
+    def _translate(self, start: int, size: int = MAX_BLOCK_SIZE) -> Block:
+        namespace = dict(self._globals)
+        # blocks built while watching call back into memory, so they bypass the code cache
+        watch = self._memory if self._memory.watching() else None
+        cached = None if watch else self._preloaded.get((start, size))
+        if cached is not None:
+            code, count, is_end, constants = cached
+            for name, pc in constants:
+                namespace[name] = self._decode(pc)
+        else:
+            instructions = self._collect(start, size)
+            block_source = _BlockSource(instructions, self._trace, watch)
+            code = compile(block_source.build(), f'<block {start:08x}>', 'exec')
+            namespace.update(block_source.constants)
+            count = len(instructions)
+            is_end = instructions[-1].is_end
+            constants = tuple((name, instr.pc) for name, instr in block_source.constants.items())
+        if self._compiled is not None and watch is None:
+            self._compiled[start, size] = (code, count, is_end, constants)
+        exec(code, namespace)
+        return Block(start, start + 4 * count, count, is_end, namespace['block'])
+
+def trace_mode(trace: tracing.TraceSink | None) -> str | None:
+    if trace is None:
+        return None
+    return 'text' if isinstance(trace, tracing.TextTrace) else 'records'
+
+def trace_emitter(trace: tracing.TraceSink | None):
+    mode = trace_mode(trace)
+    if mode is None:
+        return None
+    return trace.write if mode == 'text' else trace.record
+
+class _BlockSource:
+    _instructions: list[decoder.Instruction]
+    _trace: str | None
+    _lines: list[str]
+    _written: list[int]
+    _watch: Memory | None
+    constants: dict
+
+    def __init__(self, instructions: list[decoder.Instruction], trace: str | None, watch: Memory | None = None):
+        self._instructions = instructions
+        self._trace = trace
+        self._watch = watch
+        self._lines = []
+        self._written = []
+        self.constants = {}
+
+    def build(self) -> str:
+        loaded = set()
+        for instr in self._instructions:
+            used = {instr.rd, instr.rs1, instr.rs2} if self._trace else self._reads(instr)
+            loaded.update(idx for idx in used if idx not in self._written)
+            if self._writes(instr) and instr.rd not in self._written:
+                self._written.append(instr.rd)
+        self._written = []
+
+        header = ['def block(regs, trace, state):', '    x0 = 0']
+        header += [f'    x{idx} = regs[{idx}]' for idx in sorted(loaded) if idx != 0]
+        for count, instr in enumerate(self._instructions, 1):
+            self._emit(instr, count)
+        if not self._instructions[-1].op.is_terminator:
+            self._exit(f'({self._instructions[-1].next_pc}, {len(self._instructions)})')
+        return '\n'.join(header + self._lines) + '\n'
+
+    def _reads(self, instr: decoder.Instruction) -> set[int]:
+        match instr.op.format:
+            case 'U' | 'J' | 'E':
+                return set()
+            case 'I' | 'C':
+                return {instr.rs1}
+        return {instr.rs1, instr.rs2}
+
+    def _writes(self, instr: decoder.Instruction) -> bool:
+        return instr.rd != 0 and instr.op.format not in ('B', 'S', 'E')
+
+    def _line(self, text: str) -> None:
+        self._lines.append('    ' + text)
+
+    def _writeback(self, indent: str) -> None:
+        for idx in self._written:
+            self._lines.append(f'    {indent}regs[{idx}] = x{idx}')
+
+    def _exit(self, result: str, indent: str = '') -> None:
+        self._writeback(indent)
+        self._lines.append(f'    {indent}return {result}')
+
+    def _assign(self, instr: decoder.Instruction, expression: str, side_effect: bool = False) -> None:
+        if instr.rd == 0:
+            if side_effect:
+                self._line(expression)
+            return
+        self._line(f'x{instr.rd} = {expression}')
+        if instr.rd not in self._written:
+            self._written.append(instr.rd)
+
+    def _log(self, instr: decoder.Instruction, mnem: str) -> None:
+        if self._trace is None:
+            return
+        if self._trace == 'records':
+            name = f'_i{len(self.constants)}'
+            self.constants[name] = instr
+            self._line(f'trace({name}, x{instr.rd}, v1, v2)')
+            return
+        prefix = f'PC={instr.pc:08x} [{instr.word:08x}]'
+        name = f'{instr.name:<8}'
+        self._line(f"trace(f'{prefix} x{instr.rd:02d}={{x{instr.rd}:08x}}"
+                   f" x{instr.rs1:02d}={{v1:08x}} x{instr.rs2:02d}={{v2:08x}} {name}{mnem}\\n')")
+
+    def _sync(self, instr: decoder.Instruction) -> None:
+        # watch callbacks see the registers and pc of the instruction that triggered them
+        exec_watched = self._watch.exec_watched(instr.pc)
+        if exec_watched or instr.name in _LOAD_EXPRESSIONS or instr.name in _STORE_FUNCTIONS:
+            self._writeback('')
+            self._line(f'bank.pc = {instr.pc}')
+        if exec_watched:
+            self._line(f'executed({instr.pc})')
+
+    def _emit(self, instr: decoder.Instruction, count: int) -> None:
+        name = instr.name
+        a = f'x{instr.rs1}'
+        b = f'x{instr.rs2}'
+        pc = instr.pc
+        self._line(f'# {pc:08x}: {name}')
+        if self._watch is not None:
+            self._sync(instr)
+        if self._trace:
+            self._line(f'v1 = {a}; v2 = {b}')
+            a, b = 'v1', 'v2'
+        static_mnem = instr.mnem() if instr.op.static_mnem else None
+
+        if name == 'ebreak':
+            self._log(instr, static_mnem)
+            self._exit(f'({pc}, {count})')
+        elif name in HOST_CALLS or instr.handler is not instr.op.handler:
+            # host calls and instructions wrapped by an observer run their handler on the register file; a
+            # host call may end the program by leaving the pc alone
+            self._writeback('')
+            handler = f'_h{len(self.constants)}'
+            self.constants[handler] = instr
+            self._line(f'bank.pc = {pc}')
+            self._line(f'{handler}.handler({handler}, regs, bank, memory)')
+            if self._trace:
+                self._line(f'x{instr.rd} = regs[{instr.rd}]')
+            if static_mnem is None:
+                self._line('target = bank.pc')
+                static_mnem = f'{REGISTER_ALIASES[instr.rd]}, {REGISTER_ALIASES[instr.rs1]}, 0x{{target:x}}'
+            self._log(instr, static_mnem)
+            self._lines.append(f'    return (bank.pc, {count})')
+        elif name == 'jal':
+            self._assign(instr, str(instr.next_pc))
+            self._log(instr, static_mnem)
+            self._exit(f'({instr.target}, {count})')
+        elif name == 'jalr':
+            self._line(f'target = ({a} + {instr.imm}) & 0xfffffffe')
+            self._assign(instr, str(instr.next_pc))
+            rd = REGISTER_ALIASES[instr.rd]
+            rs1 = REGISTER_ALIASES[instr.rs1]
+            self._log(instr, f'{rd}, {rs1}, 0x{{target:x}}')
+            self._exit(f'(target, {count})')
+        elif name in _BRANCH_CONDITIONS:
+            self._log(instr, static_mnem)
+            self._line('if ' + _BRANCH_CONDITIONS[name].format(a=a, b=b) + ':')
+            self._exit(f'({instr.target}, {count})', indent='    ')
+            self._exit(f'({instr.next_pc}, {count})')
+        elif name in ('lui', 'auipc'):
+            value = instr.imm if name == 'lui' else (pc + instr.imm) & MASK_32
+            self._assign(instr, str(value))
+            self._log(instr, static_mnem)
+        elif name in _LOAD_EXPRESSIONS:
+            address = f'({a} + {instr.imm}) & 0xffffffff'
+            self._assign(instr, _LOAD_EXPRESSIONS[name].format(addr=address), side_effect=True)
+            self._log(instr, static_mnem)
+        elif name in _STORE_FUNCTIONS:
+            self._line(f'{_STORE_FUNCTIONS[name]}(({a} + {instr.imm}) & 0xffffffff, {b})')
+            self._log(instr, static_mnem)
+            if count < len(self._instructions):
+                self._line('if state[0]:')
+                self._exit(f'({instr.next_pc}, {count})', indent='    ')
+        elif instr.op.format == 'C':
+            # the clock is only advanced when the block returns
+            reads, writes = decoder.csr_effects(instr)
+            self._assign(instr, f'csr_access(bank, {instr.imm}, {reads}, {writes}, {count - 1})', side_effect=True)
+            self._log(instr, static_mnem)
+        elif name in _ITYPE_EXPRESSIONS:
+            self._assign(instr, _ITYPE_EXPRESSIONS[name].format(
+                a=a, imm=instr.imm, uimm=instr.imm & MASK_32, shamt=instr.imm & 0x1f))
+            self._log(instr, static_mnem)
+        elif name in _RTYPE_EXPRESSIONS:
+            self._assign(instr, _RTYPE_EXPRESSIONS[name].format(a=a, b=b))
+            self._log(instr, static_mnem)
+        else:
+            self._assign(instr, f'_{name}({a}, {b}) & 0xffffffff')
+            self._log(instr, static_mnem)
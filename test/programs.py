@@ -0,0 +1,69 @@
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import decoder
+import elf
+from instructions import InstructionsCache
+from memory import Memory
+from register import RegisterBank
+from simulator import Simulator
+
+# small hand-built programs for the tests: code at CODE, a data region at DATA
+CODE = 0x1000
+DATA = 0x40000
+DATA_SIZE = 0x2000
+
+E = decoder.encode
+ECALL = decoder.ECALL
+EBREAK = ECALL | 1 << 20
+
+def assemble(words: list[int]) -> bytes:
+    return b''.join(word.to_bytes(4, 'little') for word in words)
+
+def machine(words: list[int], trace=None, hartid: int = 0, memory: Memory | None = None) -> Simulator:
+    code = assemble(words)
+    if memory is None:
+        memory = Memory()
+        memory.add_region('data', DATA, DATA_SIZE)
+    memory.load_image(CODE, code)
+    cache = InstructionsCache(4, memory, CODE, CODE + len(code))
+    return Simulator(cache, RegisterBank(hartid=hartid), memory, trace, CODE)
+
+def count_down(n: int) -> list[int]:
+    # a0 = n, then a loop that adds a0 into a1 and counts a0 down to zero
+    return [E('addi', 10, 0, imm=n), E('add', 11, 11, 10), E('addi', 10, 10, imm=-1), E('bne', rs1=10, rs2=0, imm=-8),
+            EBREAK]
+
+def write_elf(path: str, code: bytes, entry: int, segments: list[tuple[int, bytes, int]] = (),
+              symbols: list[tuple[str, int, int, str]] = ()) -> None:
+    # code is loaded at CODE; segments are (address, file bytes, memory size) of the writable data;
+    # symbols are (name, address, size, 'func' or 'object')
+    kinds = {'object': 1, 'func': 2}
+    loads = [(CODE, code, len(code), elf.PF_R | elf.PF_X)]
+    loads += [(address, data, size, elf.PF_R | elf.PF_W) for address, data, size in segments]
+    strtab = b'\0'
+    symtab = bytes(16)
+    for name, address, size, kind in symbols:
+        symtab += struct.pack('<IIIBBH', len(strtab), address, size, 1 << 4 | kinds[kind], 0, 1)
+        strtab += name.encode() + b'\0'
+    phoff = 52
+    offset = phoff + 32 * len(loads)
+    headers = b''
+    body = b''
+    for address, data, size, flags in loads:
+        headers += struct.pack('<IIIIIIII', elf.PT_LOAD, offset + len(body), address, address, len(data), size,
+                               flags, 4)
+        body += data + bytes(-len(data) % 4)
+    symtab_offset = offset + len(body)
+    strtab_offset = symtab_offset + len(symtab)
+    shoff = strtab_offset + len(strtab) + (-(strtab_offset + len(strtab)) % 4)
+    sections = bytes(40)
+    sections += struct.pack('<IIIIIIIIII', 0, elf.SHT_SYMTAB, 0, 0, symtab_offset, len(symtab), 2, 1, 4, 16)
+    sections += struct.pack('<IIIIIIIIII', 0, 3, 0, 0, strtab_offset, len(strtab), 0, 0, 1, 0)
+    header = struct.pack('<4sBBB9x', elf.ELF_MAGIC, elf.ELFCLASS32, elf.ELFDATA2LSB, 1)
+    header += struct.pack('<HHIIIIIHHHHHH', 2, elf.EM_RISCV, 1, entry, phoff, shoff, 0, 52, 32, len(loads), 40, 3, 0)
+    with open(path, 'wb') as f:
+        f.write(header + headers + body + symtab + strtab.ljust(shoff - strtab_offset, b'\0') + sections)
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+np = pytest.importorskip('numpy')
+
+import batch
+from memory import PAGE_SIZE
+from programs import CODE, DATA, E, EBREAK, machine
+
+# for n = a0 down to 1: byte, half and word stores at addresses that depend on n (so only some of the
+# lanes are aligned), a branch that splits odd and even n, and a word store across a page boundary
+MIXED = [
+    E('lui', 12, imm=DATA), E('lw', 10, 12, imm=0),
+    E('mul', 5, 10, 10), E('addi', 7, 0, imm=-3), E('div', 6, 5, 7), E('add', 29, 12, 10),
+    E('sb', rs1=29, rs2=10, imm=64), E('sh', rs1=29, rs2=5, imm=129), E('lb', 30, 29, imm=64),
+    E('lhu', 31, 29, imm=129), E('sw', rs1=12, rs2=6, imm=256), E('andi', 8, 10, imm=1),
+    E('beq', rs1=8, rs2=0, imm=8), E('addi', 11, 11, imm=7), E('add', 11, 11, 5), E('addi', 10, 10, imm=-1),
+    E('bne', rs1=10, rs2=0, imm=-56),
+    E('addi', 29, 12, imm=2047), E('sw', rs1=29, rs2=11, imm=2047), E('lh', 9, 29, imm=2047), EBREAK,
+]
+
+def variant(n: int) -> list[tuple[int, bytes]]:
+    return [(DATA, (n & 0xffffffff).to_bytes(4, 'little'))]
+
+def reference(n: int, max_instructions: int | None = None):
+    sim = machine(MIXED)
+    sim.memory.write(DATA, variant(n)[0][1])
+    sim.simulate(max_instructions)
+    return sim
+
+def parent():
+    sim = machine(MIXED)
+    sim.reset()
+    sim.simulate(1)
+    return sim
+
+def test_lanes_match_the_interpreter():
+    values = [1, 2, 3, 6, 9, 4]
+    machine_ = batch.BatchMachine(parent(), len(values))
+    for lane, n in enumerate(values):
+        machine_.write(lane, DATA, variant(n)[0][1])
+    machine_.run()
+    for lane, (n, result) in enumerate(zip(values, machine_.results())):
+        sim = reference(n)
+        assert result['status'] == 'ok'
+        assert result['instructions'] == sim.clock - 1
+        assert result['pc'] == sim.register_bank.pc
+        assert result['registers'] == sim.register_bank.regs
+        assert machine_.read(lane, DATA, PAGE_SIZE + 4) == sim.memory.read(DATA, PAGE_SIZE + 4)
+
+def test_pages_are_shared_until_written():
+    machine_ = batch.BatchMachine(parent(), 3)
+    machine_.write(1, DATA + 8, b'\1')
+    assert machine_.read(0, DATA, 12) == bytes(12)
+    assert machine_.read(1, DATA, 12) == bytes(8) + b'\1' + bytes(3)
+    # lane 1 got its own copy of the page on the first write and keeps it; the others still share one
+    rows = machine_._rows
+    machine_.write(1, DATA + 9, b'\2')
+    machine_.read(2, DATA, 4)
+    assert machine_._rows == rows
+    slots = machine_._slots[:, machine_._page_map[DATA >> 12]]
+    assert slots[0] == slots[2] != slots[1]
+
+def test_budget():
+    results = batch.run(parent(), [variant(-3), variant(2)], max_instructions=200)
+    sim = reference(-3, 201)
+    assert [result['status'] for result in results] == ['budget', 'ok']
+    assert results[0]['instructions'] == 200 and results[0]['registers'] == sim.register_bank.regs
+    assert results[1]['registers'] == reference(2).register_bank.regs
+
+def test_stores_to_code_fail_the_lane():
+    # n + 64 lands on the first instruction
+    results = batch.run(parent(), [variant(CODE - DATA - 64), variant(1)])
+    assert results[0]['status'] == 'error' and 'self-modifying code' in results[0]['error']
+    assert results[0]['pc'] == CODE + 24
+    assert results[1]['status'] == 'ok'
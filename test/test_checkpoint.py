@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import checkpoint
+import tracing
+from programs import CODE, DATA, E, EBREAK, machine
+
+# sums 1..n into a1 and stores each partial sum to DATA + 4 * a0
+def store_sums(n: int) -> list[int]:
+    return [E('addi', 10, 0, imm=n), E('lui', 12, imm=DATA), E('add', 11, 11, 10), E('slli', 13, 10, imm=2),
+            E('add', 13, 13, 12), E('sw', rs1=13, rs2=11, imm=0), E('addi', 10, 10, imm=-1),
+            E('bne', rs1=10, rs2=0, imm=-20), EBREAK]
+
+@pytest.mark.parametrize('compression', checkpoint.COMPRESSIONS)
+def test_round_trip(tmp_path, compression):
+    path = str(tmp_path / 'sums.ckpt')
+    sim = machine(store_sums(10))
+    sim.simulate(30)
+    state = sim.snapshot('sums.riscv')
+    state.host = {'brk': 0x50000, 'exit_code': -1}
+    checkpoint.write(path, state, compression)
+    saved = checkpoint.read(path)
+    assert (saved.program, saved.pc, saved.clock, saved.regs) == ('sums.riscv', state.pc, 30, state.regs)
+    assert saved.regions == state.regions and saved.pages == state.pages
+    assert saved.host == {'brk': 0x50000, 'exit_code': -1}
+    # zero pages are left out
+    assert sorted(saved.pages) == [CODE >> 12, DATA >> 12]
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_resume_continues_the_run(tmp_path, engine):
+    path = str(tmp_path / 'sums.ckpt')
+    first = io.StringIO()
+    sim = machine(store_sums(10), tracing.TextTrace(first))
+    sim.checkpoint_every(25, lambda sim: checkpoint.write(path, sim.snapshot(), 'gzip') if sim.clock == 50 else None)
+    sim.simulate()
+
+    second = io.StringIO()
+    resumed = machine(store_sums(10), tracing.TextTrace(second))
+    # memory written after the checkpoint is cleared by the restore
+    resumed.memory.store_word(DATA + 0x100, 1)
+    resumed.restore(checkpoint.read(path))
+    assert resumed.memory.load_word(DATA + 0x100) == 0
+    resumed.simulate_blocks(resume=True) if engine == 'block' else resumed.simulate(resume=True)
+    assert resumed.clock == sim.clock
+    assert resumed.register_bank.regs == sim.register_bank.regs
+    assert resumed.memory.read(DATA, 44) == sim.memory.read(DATA, 44)
+    assert second.getvalue() == ''.join(first.getvalue().splitlines(keepends=True)[50:])
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'bad.ckpt'
+    path.write_bytes(b'RVCKPT99' + bytes(8))
+    with pytest.raises(Exception, match='Not a checkpoint file'):
+        checkpoint.read(str(path))
+    with pytest.raises(Exception, match='Unknown checkpoint compression'):
+        checkpoint.write(str(path), machine([EBREAK]).snapshot(), 'zip')
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import checkpoint
+import decoder
+from programs import E, EBREAK, machine
+
+COUNTERS = [
+    E('addi', 10, 0, imm=4), E('csrrs', 11, imm=decoder.CSR_CYCLE), E('addi', 10, 10, imm=-1),
+    E('bne', rs1=10, rs2=0, imm=-8), E('csrrs', 12, imm=decoder.CSR_INSTRET), E('csrrs', 13, imm=decoder.CSR_CYCLEH),
+    E('csrrs', 14, imm=decoder.CSR_MHARTID), E('csrrsi', 15, imm=decoder.CSR_TIME), EBREAK,
+]
+
+def run(words: list[int], engine: str = 'interpreter', hartid: int = 0):
+    sim = machine(words, hartid=hartid)
+    {'interpreter': sim.simulate, 'block': sim.simulate_blocks, 'fused': sim.simulate_fused}[engine]()
+    return sim
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block', 'fused'])
+def test_counters_read_the_retired_instructions(engine):
+    # the last csrrs in the loop is instruction 10, and the reads after it 13 to 16
+    regs = run(COUNTERS, engine, hartid=3).register_bank.regs
+    assert regs[11:16] == [10, 13, 0, 3, 16]
+
+def test_counters_continue_after_a_checkpoint():
+    first = machine(COUNTERS)
+    first.simulate(8)
+    resumed = machine(COUNTERS)
+    resumed.restore(checkpoint.capture(first.register_bank, first.memory, first.clock))
+    resumed.simulate_blocks(resume=True)
+    assert resumed.register_bank.regs[11:16] == [10, 13, 0, 0, 16]
+
+def test_high_halves():
+    sim = machine([E('csrrs', 11, imm=decoder.CSR_INSTRET), E('csrrs', 12, imm=decoder.CSR_INSTRETH), EBREAK])
+    sim.reset()
+    sim.clock = (5 << 32) + 7
+    sim.simulate(resume=True)
+    assert sim.register_bank.regs[11:13] == [7, 5]
+
+@pytest.mark.parametrize('word, message', [
+    (E('csrrw', 0, 10, imm=decoder.CSR_CYCLE), 'CSR cycle is read-only'),
+    (E('csrrs', 11, 10, imm=decoder.CSR_INSTRET), 'CSR instret is read-only'),
+    (E('csrrci', 11, 1, imm=decoder.CSR_MHARTID), 'CSR mhartid is read-only'),
+    (E('csrrs', 11, imm=0x300), 'Unsupported CSR: 0x300'),
+])
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_writes_and_unknown_csrs_stop_the_run(word, message, engine):
+    with pytest.raises(Exception, match=message):
+        run([E('addi', 10, 0, imm=1), word, EBREAK], engine)
+
+def test_reads_without_effects():
+    # csrrc with x0 as rs1 only reads
+    sim = run([E('addi', 10, 0, imm=1), E('csrrc', 11, 0, imm=decoder.CSR_CYCLE), EBREAK])
+    assert sim.register_bank.regs[11] == 1
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import elf
+import main
+from memory import Memory
+from programs import CODE, DATA, E, assemble, count_down, write_elf
+
+@pytest.fixture
+def program(tmp_path) -> str:
+    # count_down(5) from CODE + 4, after a word that is never run; 8 bytes of data and a 4 KiB .bss at DATA
+    path = str(tmp_path / 'count.riscv')
+    code = assemble([0] + count_down(5))
+    write_elf(path, code, CODE + 4, [(DATA, b'\1\2\3\4\5\6\7\10', 0x1008)],
+              [('main', CODE + 4, len(code) - 4, 'func'), ('table', DATA, 8, 'object'),
+               ('buffer', DATA + 8, 0x1000, 'object')])
+    return path
+
+def test_segments_and_entry(program):
+    with elf.ElfFile(program) as f:
+        assert f.entry == CODE + 4
+        assert [(s.address, s.file_size, s.memory_size, s.executable) for s in f.segments] == \
+            [(CODE, 24, 24, True), (DATA, 8, 0x1008, False)]
+        assert f.code_range() == (CODE, CODE + 24)
+        assert f.end() == DATA + 0x1008
+
+def test_load_maps_the_file_bytes_only(program):
+    memory = Memory()
+    with elf.ElfFile(program) as f:
+        f.load(memory)
+    assert memory.load_word(CODE + 4) == E('addi', 10, 0, imm=5)
+    assert memory.read(DATA, 12) == b'\1\2\3\4\5\6\7\10' + bytes(4)
+    assert [page for page, _ in memory.pages()] == [CODE >> 12, DATA >> 12]
+
+def test_symbols(program):
+    with elf.ElfFile(program) as f:
+        assert sorted(f.symbols()) == ['buffer', 'main', 'table']
+        assert f.symbol('table').address == DATA and f.symbol('table').kind == 'object'
+        assert f.symbol('missing') is None
+        assert f.symbol_at(CODE + 12).name == 'main'
+        assert f.symbol_at(DATA + 0x100).name == 'buffer'
+        assert f.symbol_at(CODE) is None
+
+def test_resolve_address(program):
+    assert main.resolve_address(program, 'buffer') == (DATA + 8, 0x1000)
+    assert main.resolve_address(program, '0x40') == (0x40, None)
+    assert main.resolve_watch(program, 'table:4:rw') == (DATA, DATA + 4, 'rw')
+    with pytest.raises(Exception, match='Unknown symbol'):
+        main.resolve_address(program, 'missing')
+
+def test_run_from_the_entry_point(program):
+    sim = main.build_simulator(program)
+    assert sim.entry == CODE + 4
+    sim.simulate()
+    assert sim.register_bank.regs[11] == 15
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.riscv'
+    path.write_bytes(b'#!/bin/sh\n' + bytes(100))
+    with pytest.raises(Exception, match='Not an ELF file'):
+        elf.ElfFile(str(path))
+    # ELFCLASS64
+    path.write_bytes(elf.ELF_MAGIC + bytes([2, elf.ELFDATA2LSB, 1]) + bytes(100))
+    with pytest.raises(Exception, match='Only little-endian ELF32'):
+        elf.ElfFile(str(path))
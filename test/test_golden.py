@@ -0,0 +1,75 @@
+import gzip
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import tracing
+from programs import E, count_down, machine
+
+def write_reference(folder, suffix: str, words: list[int], max_instructions: int | None = None) -> str:
+    path = str(folder / ('count' + suffix))
+    if suffix == '.trace':
+        with open(path, 'wb') as f:
+            machine(words, tracing.BinaryTrace(f)).simulate(max_instructions)
+        return path
+    out = io.StringIO()
+    machine(words, tracing.TextTrace(out)).simulate(max_instructions)
+    opener = gzip.open if suffix.endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        f.write(out.getvalue())
+    return path
+
+def compare(reference: str, words: list[int], context: int = tracing.DEFAULT_CONTEXT,
+            max_instructions: int | None = None) -> None:
+    golden = tracing.GoldenTrace(reference, context)
+    try:
+        machine(words, golden).simulate(max_instructions)
+        golden.check_end()
+    finally:
+        golden.close()
+
+@pytest.mark.parametrize('suffix', ['.log', '.log.gz', '.trace'])
+def test_same_run_matches(tmp_path, suffix):
+    reference = write_reference(tmp_path, suffix, count_down(5))
+    assert tracing.find_reference(str(tmp_path), 'count') == reference
+    compare(reference, count_down(5))
+
+@pytest.mark.parametrize('suffix', ['.log', '.trace'])
+def test_first_difference_is_reported(tmp_path, suffix):
+    reference = write_reference(tmp_path, suffix, count_down(5))
+    # an extra instruction before the loop
+    words = count_down(5)
+    with pytest.raises(tracing.TraceMismatch) as error:
+        compare(reference, words[:1] + [E('addi', 12, 0, imm=0)] + words[1:], context=2)
+    mismatch = error.value
+    assert mismatch.instruction == 1
+    assert 'expected x11=' in mismatch.report()
+    assert len(mismatch.context) == 1
+
+def test_changed_register_value(tmp_path):
+    reference = write_reference(tmp_path, '.log', count_down(5))
+    words = count_down(5)
+    words[2] = E('addi', 10, 10, imm=-2)
+    with pytest.raises(tracing.TraceMismatch) as error:
+        compare(reference, words, context=2)
+    mismatch = error.value
+    # addi a0 at the third instruction writes 3 instead of 4
+    assert mismatch.instruction == 2
+    assert 'x10: expected 00000004, actual 00000003' in mismatch.report()
+    assert len(mismatch.context) == 2
+
+def test_reference_ends_first(tmp_path):
+    reference = write_reference(tmp_path, '.log', count_down(5), max_instructions=10)
+    with pytest.raises(tracing.TraceMismatch, match='the reference ended') as error:
+        compare(reference, count_down(5))
+    assert error.value.instruction == 10
+
+def test_program_ends_first(tmp_path):
+    reference = write_reference(tmp_path, '.trace', count_down(5))
+    with pytest.raises(tracing.TraceMismatch, match='the program ended') as error:
+        compare(reference, count_down(5), max_instructions=10)
+    assert error.value.instruction == 10
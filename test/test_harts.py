@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import decoder
+import harts
+import main
+from programs import CODE, DATA, E, EBREAK, assemble, write_elf
+
+# every hart stores its mhartid + 1 at DATA + 4 * mhartid, then waits until the slots of all N harts add up
+# to N(N + 1)/2, with N and the sum stored at DATA + 64 and DATA + 68
+BARRIER = [
+    E('csrrs', 10, imm=decoder.CSR_MHARTID), E('lui', 12, imm=DATA), E('slli', 5, 10, imm=2), E('add', 5, 5, 12),
+    E('addi', 6, 10, imm=1), E('sw', rs1=5, rs2=6, imm=0), E('lw', 7, 12, imm=64), E('lw', 31, 12, imm=68),
+    E('addi', 11, 0, imm=0), E('addi', 28, 0, imm=0),
+    E('slli', 29, 28, imm=2), E('add', 29, 29, 12), E('lw', 30, 29, imm=0), E('add', 11, 11, 30),
+    E('addi', 28, 28, imm=1), E('bne', rs1=28, rs2=7, imm=-20),
+    E('bne', rs1=11, rs2=31, imm=-32), EBREAK,
+]
+
+def barrier(folder, count: int) -> str:
+    path = str(folder / 'barrier.riscv')
+    data = bytes(64) + count.to_bytes(4, 'little') + (count * (count + 1) // 2).to_bytes(4, 'little')
+    write_elf(path, assemble(BARRIER), CODE, [(DATA, data, len(data))])
+    return path
+
+def check(results: list[dict], count: int) -> None:
+    assert [result['status'] for result in results] == ['ok'] * count
+    for hartid, result in enumerate(results):
+        assert result['hart'] == hartid
+        assert result['registers'][10] == hartid
+        assert result['registers'][11] == count * (count + 1) // 2
+        assert result['pc'] == CODE + 4 * (len(BARRIER) - 1)
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_round_robin(tmp_path, engine):
+    path = barrier(tmp_path, 3)
+    results = harts.run_round_robin(path, 3, quantum=20, engine=engine)
+    check(results, 3)
+    # hart 0 spins through its first quantum before the others store their slots; the last one passes the
+    # barrier at once, and every run interleaves the same way
+    assert results[0]['instructions'] > results[2]['instructions'] == 30
+    assert harts.run_round_robin(path, 3, quantum=20, engine=engine) == results
+
+def test_round_robin_budget_and_traces(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('test')
+    # a single hart never sees the slots of the others and spins until the budget runs out
+    path = barrier(tmp_path, 2)
+    results = harts.run_round_robin(path, 1, quantum=7, max_instructions=100, trace_level='full')
+    assert [(result['status'], result['instructions']) for result in results] == [('budget', 100)]
+    with open('test/barrier.hart0.log') as f:
+        assert len(f.readlines()) == 100
+
+def test_parallel(tmp_path):
+    path = barrier(tmp_path, 4)
+    check(harts.run_parallel(path, 4), 4)
+
+def test_layout_covers_the_stacks(tmp_path):
+    path = barrier(tmp_path, 2)
+    regions = harts.layout(path, 2).regions
+    stacks = 2 * main.STACK_SIZE
+    assert [(base, size) for _, base, size in regions] == [(CODE, 0x1000), (DATA, 0x1000),
+                                                           (main.STACK_TOP - stacks, stacks)]
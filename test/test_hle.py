@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import checkpoint
+import hle
+import main
+import tracing
+from memory import Memory
+from programs import CODE, DATA, E, EBREAK, ECALL, assemble, machine, write_elf
+
+def test_heap_starts_after_bss(tmp_path):
+    # 4 bytes in the file at 0x20100 and 8 KiB of .bss after them
+    path = str(tmp_path / 'bss.riscv')
+    write_elf(path, assemble([EBREAK]), CODE, [(0x20100, b'\1\2\3\4', 0x2004)])
+    assert main.program_end(path) == 0x22104
+    assert hle.heap_start(main.program_end(path)) == 0x23000
+
+def test_brk_survives_a_checkpoint(tmp_path):
+    words = [E('addi', 10, 0, imm=0), E('addi', 17, 0, imm=hle.SYS_BRK), ECALL,
+             E('lui', 10, imm=0x50000), ECALL, EBREAK]
+    sim = machine(words)
+    services = hle.HostServices(io.BytesIO(), 0x48000)
+    services.install(sim.decoder)
+    sim.simulate(5)
+    assert services.brk == 0x50000
+    state = sim.snapshot()
+    state.host = services.state()
+    path = str(tmp_path / 'hle.ckpt')
+    checkpoint.write(path, state)
+
+    restored = machine(words)
+    other = hle.HostServices(io.BytesIO(), 0x48000)
+    other.install(restored.decoder)
+    saved = checkpoint.read(path)
+    restored.restore(saved)
+    other.restore(saved.host)
+    assert other.brk == 0x50000 and other.exit_code is None
+    # a break below the heap start is refused and returns the current one
+    restored.register_bank.regs[10] = 0x1000
+    restored.register_bank.pc = CODE + 8
+    restored.simulate(1, resume=True)
+    assert restored.register_bank.regs[10] == 0x50000
+
+def run_services(words: list[int], data: bytes = b'', engine: str = 'interpreter'):
+    sim = machine(words)
+    sim.memory.write(DATA, data)
+    services = hle.HostServices(io.BytesIO(), 0x48000)
+    services.install(sim.decoder)
+    sim.simulate_blocks() if engine == 'block' else sim.simulate()
+    return sim, services
+
+def syscall(number: int, a0: int = 0, a1: int = 0, a2: int = 0) -> list[int]:
+    return [E('addi', 10, 0, imm=a0), E('addi', 11, 0, imm=a1), E('addi', 12, 0, imm=a2),
+            E('addi', 17, 0, imm=number), ECALL]
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_write_and_exit(engine):
+    # write(1, DATA, 3), a4 = the result, write(2, DATA + 3, 4), exit(7)
+    words = [E('addi', 10, 0, imm=hle.STDOUT), E('lui', 11, imm=DATA), E('addi', 12, 0, imm=3),
+             E('addi', 17, 0, imm=hle.SYS_WRITE), ECALL, E('addi', 14, 10, imm=0),
+             E('addi', 10, 0, imm=hle.STDERR), E('addi', 11, 11, imm=3), E('addi', 12, 0, imm=4), ECALL]
+    words += syscall(hle.SYS_EXIT, 7) + [EBREAK]
+    sim, services = run_services(words, b'hi\nerr\n', engine)
+    assert services.output.getvalue() == b'hi\nerr\n'
+    assert sim.register_bank.regs[14] == 3
+    assert services.exit_code == 7 and services.state() == {'brk': 0x48000, 'exit_code': 7}
+    # the pc stays on the exit ecall
+    assert sim.finished and sim.register_bank.pc == CODE + 4 * (len(words) - 2)
+
+def test_errors_are_returned_in_a0():
+    words = syscall(hle.SYS_WRITE, 3, 0, 1) + [E('addi', 14, 10, imm=0)] + syscall(17) + [EBREAK]
+    sim, services = run_services(words)
+    assert sim.register_bank.regs[14] == -hle.EBADF & 0xffffffff
+    assert sim.register_bank.regs[10] == -hle.ENOSYS & 0xffffffff
+    assert services.exit_code is None and services.output.getvalue() == b''
+
+def test_routines():
+    memory = Memory()
+    memory.write(DATA, b'hello\0help\0')
+    assert hle.ROUTINES['strlen'](memory, DATA, 0, 0) == 5
+    assert hle.ROUTINES['strcmp'](memory, DATA, DATA + 6, 0) < 0
+    assert hle.ROUTINES['strcmp'](memory, DATA + 6, DATA + 6, 0) == 0
+    assert hle.ROUTINES['memcmp'](memory, DATA, DATA + 6, 3) == 0
+    assert hle.ROUTINES['memcpy'](memory, DATA + 0x100, DATA, 6) == DATA + 0x100
+    assert memory.read(DATA + 0x100, 6) == b'hello\0'
+    # across pages, without mapping more than the filled ones
+    assert hle.ROUTINES['memset'](memory, DATA + 0xffe, 0x1ab, 4) == DATA + 0xffe
+    assert memory.read(DATA + 0xffc, 8) == bytes(2) + b'\xab' * 4 + bytes(2)
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_intercepted_call(engine):
+    # a0 = strlen(DATA) through a routine at CODE + 16 whose guest code would return -1
+    words = [E('lui', 10, imm=DATA), E('jal', 1, imm=12), E('addi', 11, 10, imm=0), EBREAK,
+             E('addi', 10, 0, imm=-1), E('jalr', 0, 1, imm=0)]
+    out = io.StringIO()
+    sim = machine(words, tracing.TextTrace(out))
+    sim.memory.write(DATA, b'four\0')
+    hle.intercept(sim.decoder, {'strlen': CODE + 16})
+    sim.simulate_blocks() if engine == 'block' else sim.simulate()
+    assert sim.register_bank.regs[11] == 4
+    assert sim.clock == 5
+    assert ' hle ' in out.getvalue().splitlines()[2]
+
+def test_find_routines(tmp_path):
+    body = [E('addi', 10, 0, imm=-1), E('jalr', 0, 1, imm=0)]
+    code = assemble([EBREAK] + body)
+    path = str(tmp_path / 'lib.riscv')
+    write_elf(path, code, CODE, symbols=[('strlen', CODE + 4, 8, 'func')])
+    assert hle.find_routines(path, code, CODE, ['strlen', 'memcpy']) == {'strlen': CODE + 4}
+    assert hle.signature(path, 'strlen') == [f'{word:08x}' for word in body]
+
+    signatures = tmp_path / 'sigs.json'
+    signatures.write_text(json.dumps({'memcpy': hle.signature(path, 'strlen')}))
+    # the body is only found at an aligned address
+    image = b'\0\0' + code[4:] + b'\0\0' + code[4:]
+    found = hle.find_routines('lib.bin', image, CODE, ['memcpy'], hle.load_signatures(str(signatures)))
+    assert found == {'memcpy': CODE + 12}
+    signatures.write_text(json.dumps({'printf': []}))
+    with pytest.raises(Exception, match='Unknown routine'):
+        hle.load_signatures(str(signatures))
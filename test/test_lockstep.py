@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import decoder
+import lockstep
+import rtype_helper
+from utils import MASK_32
+
+# rs1, rs2 and the expected results, from the division table of the M extension and a few signed cases
+KNOWN_RESULTS = [
+    ('div', 7, 2, 3), ('div', -7, 2, -3), ('div', 7, -2, -3), ('div', -7, -2, 3),
+    ('rem', 7, 2, 1), ('rem', -7, 2, -1), ('rem', 7, -2, 1), ('rem', -7, -2, -1),
+    ('div', 5, 0, -1), ('rem', 5, 0, 5), ('divu', 5, 0, MASK_32), ('remu', 5, 0, 5),
+    ('div', -2**31, -1, -2**31), ('rem', -2**31, -1, 0),
+    ('divu', 0xfffffff9, 2, 0x7ffffffc), ('remu', 0xfffffff9, 2, 1),
+    ('mulh', -1, -1, 0), ('mulhu', MASK_32, MASK_32, 0xfffffffe), ('mulhsu', -1, MASK_32, MASK_32),
+    ('mul', 0x10000, 0x10000, 0), ('sra', 0x80000000, 31, MASK_32), ('slt', -1, 0, 1), ('sltu', -1, 0, 0),
+]
+
+@pytest.mark.parametrize('name, a, b, expected', KNOWN_RESULTS)
+def test_known_results(name, a, b, expected):
+    a, b = a & MASK_32, b & MASK_32
+    assert lockstep.SPEC[name](a, b) & MASK_32 == expected & MASK_32
+    assert rtype_helper.FUNCTIONS[name](a, b) & MASK_32 == expected & MASK_32
+
+@pytest.mark.parametrize('engines', [('interpreter', 'block'), ('interpreter', 'fused'), ('block', 'fused')])
+def test_fuzz(engines):
+    for seed, divergence, mismatches in lockstep.fuzz(4, 0, 200, engines, lockstep.DEFAULT_INTERVAL):
+        assert divergence is None, f'seed {seed}:\n{divergence.report()}'
+        assert not mismatches, f'seed {seed}: {mismatches}'
+
+def test_spec_check_reports_wrong_results():
+    check = lockstep.SpecCheck()
+    instr = decoder.Decoder().build_instruction(decoder.encode('rem', 1, 2, 3), 0x1000)
+    check.record(instr, 1, (-7) & MASK_32, (-2) & MASK_32)
+    assert list(check.mismatches) == ['00001000 rem fffffff9, fffffffe: 00000001, expected ffffffff']
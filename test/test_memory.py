@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from memory import PAGE_SIZE, Memory
+
+def test_accessors_are_little_endian():
+    memory = Memory()
+    memory.store_word(0x1000, 0x11223344)
+    assert memory.read(0x1000, 4) == b'\x44\x33\x22\x11'
+    assert memory.load_half(0x1002) == 0x1122
+    assert memory.load_byte(0x1003) == 0x11
+    memory.store_half(0x1000, 0x1abcd)
+    memory.store_byte(0x1003, 0x1ff)
+    assert memory.load_word(0x1000) == 0xff22abcd
+
+def test_pages_are_allocated_on_first_write():
+    memory = Memory()
+    assert memory.load_word(0x123456) == 0
+    assert memory.pages() == []
+    memory.store_byte(0x123456, 1)
+    assert [page for page, _ in memory.pages()] == [0x123]
+
+def test_accesses_across_a_page_boundary():
+    memory = Memory()
+    memory.store_word(PAGE_SIZE - 2, 0xaabbccdd)
+    assert memory.load_word(PAGE_SIZE - 2) == 0xaabbccdd
+    assert memory.load_half(PAGE_SIZE - 1) == 0xbbcc
+    assert memory.page_data(1)[:2] == b'\xbb\xaa'
+
+def test_regions():
+    memory = Memory()
+    memory.load_image(0x1000, b'\1\2\3\4', 'code')
+    memory.add_region('data', 0x8000, PAGE_SIZE)
+    assert memory.find_region(0x1003).name == 'code'
+    assert memory.find_region(0x8fff).name == 'data'
+    assert memory.find_region(0x9000) is None
+    memory.store_word(0x8000, 7)
+    assert memory.regions()[1].data[:4] == b'\7\0\0\0'
+    with pytest.raises(Exception, match='overlaps'):
+        memory.add_region('other', 0x8ffc, 8)
+
+def test_bulk_write_and_read():
+    memory = Memory()
+    data = bytes(range(256)) * 20
+    memory.write(PAGE_SIZE - 100, data)
+    assert memory.read(PAGE_SIZE - 100, len(data)) == data
+    assert memory.read(0, 4) == bytes(4)
+
+def test_code_stores_are_reported():
+    memory = Memory()
+    memory.load_image(0, bytes(2 * PAGE_SIZE))
+    stores = []
+    memory.watch_code(0x1000, 0x1010, lambda address, width: stores.append((address, width)))
+    memory.store_word(0x0ff8, 0)
+    memory.store_word(0x0ffe, 0)
+    memory.store_word(0x1010, 0)
+    memory.store_half(0x1004, 0)
+    memory.write(0x100c, bytes(8))
+    assert stores == [(0x0ffe, 2), (0x1000, 2), (0x1004, 2), (0x100c, 4)]
+
+def test_fork_copies_pages_on_write():
+    parent = Memory()
+    parent.store_word(0x1000, 1)
+    parent.store_word(0x2000, 2)
+    child = parent.fork()
+    child.store_word(0x1000, 10)
+    parent.store_word(0x2000, 20)
+    assert parent.load_word(0x1000) == 1 and child.load_word(0x1000) == 10
+    assert parent.load_word(0x2000) == 20 and child.load_word(0x2000) == 2
+    # a page allocated after the fork belongs to one side only
+    child.store_byte(0x3000, 3)
+    assert parent.load_byte(0x3000) == 0
+
+def test_fork_of_a_region():
+    parent = Memory()
+    parent.add_region('data', 0x8000, 2 * PAGE_SIZE)
+    child = parent.fork()
+    child.store_word(0x8ffe, 0xffffffff)
+    assert parent.read(0x8ffe, 4) == bytes(4)
+    assert child.read(0x8ffe, 4) == b'\xff' * 4
+    assert parent.regions()[0].data == bytes(2 * PAGE_SIZE)
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import pipeline
+import tracing
+from programs import CODE, DATA, E, EBREAK, count_down, machine
+
+def timed(words: list[int], predictor: str = 'static', **options) -> pipeline.PipelineModel:
+    model = pipeline.PipelineModel(pipeline.build_predictor(predictor, 4), **options)
+    machine(words, model).simulate()
+    return model
+
+def stalls(model: pipeline.PipelineModel) -> dict[str, int]:
+    return {kind: count for kind, count in model.stalls.items() if count}
+
+def test_independent_instructions():
+    # the first instruction is in EX on cycle 3 and the last one leaves WB 2 cycles after its EX
+    model = timed([E('addi', 10, 0, imm=1), E('addi', 11, 0, imm=2), E('add', 12, 10, 11), EBREAK])
+    assert (model.instructions, model.cycles, stalls(model)) == (4, 8, {})
+
+def test_load_use():
+    words = [E('lui', 12, imm=DATA), E('lw', 10, 12, imm=0), E('add', 11, 10, 10), EBREAK]
+    model = timed(words)
+    assert (model.cycles, stalls(model)) == (9, {'load-use': 1})
+    # without forwarding every dependent instruction waits for the write back of its operand
+    model = timed(words, forwarding=False)
+    assert (model.cycles, stalls(model)) == (12, {'raw': 4})
+
+@pytest.mark.parametrize('dependent', [False, True])
+def test_multiplication_holds_ex(dependent):
+    words = [E('mul', 10, 11, 12), E('add', 13, 10, 10) if dependent else E('addi', 13, 0, imm=1), EBREAK]
+    model = timed(words)
+    assert (model.cycles, stalls(model)) == (9, {'mul': 2})
+    model = timed(words, div_latency=10, mul_latency=5)
+    assert (model.cycles, stalls(model)) == (11, {'mul': 4})
+
+def test_branches():
+    # bne is taken 4 times, and the static predictor only misses the exit
+    model = timed(count_down(5))
+    assert (model.instructions, model.cycles, stalls(model)) == (17, 27, {'taken': 4, 'mispredict': 2})
+    assert (model.branches, model.mispredictions) == (5, 1)
+    # the bimodal counters start weakly not taken, so the first taken branch is missed too
+    model = timed(count_down(5), 'bimodal')
+    assert (model.cycles, stalls(model)) == (28, {'taken': 3, 'mispredict': 4})
+    assert model.summary()['misprediction_rate'] == 0.4
+
+def test_jumps():
+    # jal is redirected from ID, jalr only once its target is known in EX
+    model = timed([E('jal', 0, imm=8), E('addi', 10, 0, imm=1), E('addi', 11, 0, imm=1), EBREAK])
+    assert (model.instructions, model.cycles, stalls(model)) == (3, 8, {'jump': 1})
+    model = timed([E('lui', 5, imm=CODE), E('jalr', 0, 5, imm=12), E('addi', 10, 0, imm=1), EBREAK])
+    assert (model.instructions, model.cycles, stalls(model)) == (3, 9, {'jump': 2})
+
+def test_model_next_to_a_trace():
+    out = io.StringIO()
+    model = pipeline.PipelineModel()
+    machine(count_down(5), tracing.TeeTrace([tracing.TextTrace(out), model])).simulate_blocks()
+    assert len(out.getvalue().splitlines()) == model.instructions == 17
+    assert model.summary()['cpi'] == 27 / 17
+
+def test_unknown_predictor():
+    with pytest.raises(Exception, match='Unknown branch predictor'):
+        pipeline.build_predictor('perceptron')
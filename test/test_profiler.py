@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import profiler
+from programs import CODE, E, EBREAK, assemble, machine, write_elf
+
+# main calls leaf three times, then helper, which tail-calls leaf
+CALLS = [
+    E('addi', 8, 0, imm=3), E('jal', 1, imm=20), E('addi', 8, 8, imm=-1), E('bne', rs1=8, rs2=0, imm=-8),
+    E('jal', 1, imm=20), EBREAK,
+    E('addi', 10, 10, imm=1), E('addi', 10, 10, imm=1), E('jalr', 0, 1, imm=0),
+    E('addi', 5, 0, imm=0), E('jal', 0, imm=-16),
+]
+SYMBOLS = [(CODE, 24, 'main'), (CODE + 24, 12, 'leaf'), (CODE + 36, 8, 'helper')]
+
+def profile(interval: int, engine: str = 'interpreter', symbols=profiler.Symbols(SYMBOLS)) -> profiler.Profiler:
+    sim = machine(CALLS)
+    result = profiler.Profiler(symbols, interval)
+    result.attach(sim)
+    sim.simulate_blocks() if engine == 'block' else sim.simulate()
+    result.sample(sim)
+    assert sim.clock == 26
+    return result
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block'])
+def test_calls_are_charged_to_their_path(engine):
+    # a call is charged to the callee and a return to the caller; the tail call stays under helper
+    assert profile(1, engine).paths() == {('main',): 12, ('main', 'leaf'): 9, ('main', 'helper'): 2,
+                                          ('main', 'helper', 'leaf'): 3}
+
+def test_sampling_charges_the_path_at_the_sample():
+    # samples after instruction 10 (in the second call to leaf), 20 (the call to helper) and at the end (26)
+    assert profile(10).paths() == {('main', 'leaf'): 10, ('main', 'helper'): 10, ('main',): 6}
+
+def test_collapsed_and_hotspots():
+    result = profile(1)
+    assert result.collapsed() == 'main 12\nmain;helper 2\nmain;helper;leaf 3\nmain;leaf 9\n'
+    lines = result.hotspots(2).splitlines()
+    assert len(lines) == 3
+    assert lines[1].split() == ['main', '12', '46.15', '26', '100.00']
+    assert lines[2].split() == ['leaf', '12', '46.15', '12', '46.15']
+
+def test_without_symbols():
+    assert profile(1, symbols=None).paths()[(f'0x{CODE:08x}', f'0x{CODE + 24:08x}')] == 9
+
+def test_symbols_from_a_map_and_an_elf(tmp_path):
+    path = tmp_path / 'calls.map'
+    path.write_text(f'{CODE:08x} T main\n{CODE + 24:08x} t leaf\n         U printf\n{CODE + 36:08x} T helper\n')
+    symbols = profiler.Symbols.from_map(str(path))
+    assert symbols.lookup(CODE + 30) == (CODE + 24, 'leaf')
+    # without sizes a symbol reaches the next one
+    assert symbols.lookup(CODE + 100) == (CODE + 36, 'helper')
+    assert symbols.lookup(CODE - 4) is None
+
+    elf_path = str(tmp_path / 'calls.riscv')
+    write_elf(elf_path, assemble(CALLS), CODE, symbols=[(name, address, size, 'func')
+                                                        for address, size, name in SYMBOLS])
+    symbols = profiler.Symbols.from_elf(elf_path)
+    assert symbols.lookup(CODE + 40) == (CODE + 36, 'helper')
+    assert symbols.lookup(CODE + 44) is None
+    assert profile(1, symbols=symbols).paths() == profile(1).paths()
@@ -0,0 +1,49 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import progcache
+from programs import CODE, E, EBREAK, machine
+
+def store_program(offset: int) -> list[int]:
+    # stores 5 at CODE + offset; the word after the ebreak is data that lives in the code range
+    return [E('lui', 5, imm=CODE), E('addi', 6, 0, imm=5), E('sw', rs1=5, rs2=6, imm=offset), EBREAK, 0]
+
+def test_data_stores_keep_the_blocks():
+    sim = machine(store_program(16))
+    sim.simulate_blocks()
+    assert sim.memory.load_word(CODE + 16) == 5
+    assert sim.export_code()['blocks']
+
+def test_code_stores_drop_the_blocks():
+    sim = machine(store_program(4))
+    sim.simulate_blocks()
+    assert sim.export_code()['blocks'] == {}
+
+def test_preloaded_blocks_run_and_are_dropped_by_code_stores():
+    first = machine(store_program(16))
+    first.simulate_blocks()
+    code = first.export_code()
+    second = machine(store_program(16))
+    second.preload(code)
+    second.simulate_blocks()
+    assert second.register_bank.regs[6] == 5
+    assert second.export_code()['blocks'].keys() == code['blocks'].keys()
+
+    # a store to an instruction only known from the preloaded code, before it was ever translated
+    third = machine(store_program(16))
+    third.preload(code)
+    third.memory.store_word(CODE + 4, E('addi', 6, 0, imm=7))
+    third.simulate_blocks()
+    assert third.register_bank.regs[6] == 7
+    assert third.export_code()['blocks'] == {}
+
+def test_key_depends_on_the_load_address(tmp_path):
+    cache = progcache.ProgramCache(str(tmp_path))
+    image = b'\x13\x00\x00\x00'
+    assert cache.key(image, 0x1000, 0x1000, None) != cache.key(image, 0x2000, 0x2000, None)
+    assert cache.key(image, 0x1000, 0x1000, None) != cache.key(image, 0x1000, 0x1004, None)
+    cache.store(cache.key(image, 0x1000, 0x1000, None), {'blocks': {}})
+    assert cache.load(cache.key(image, 0x1000, 0x1000, None)) == {'blocks': {}}
+    assert cache.load(cache.key(image, 0x2000, 0x2000, None)) is None
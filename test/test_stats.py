@@ -0,0 +1,69 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import checkpoint
+import stats
+import tracing
+from programs import count_down, machine
+
+def text_log(words: list[int]) -> str:
+    out = io.StringIO()
+    machine(words, tracing.TextTrace(out)).simulate()
+    return out.getvalue()
+
+def test_counts_every_interpreted_instruction():
+    out = io.StringIO()
+    sim = machine(count_down(10), tracing.TextTrace(out))
+    run_stats = stats.Stats(4)
+    run_stats.attach(sim)
+    sim.simulate()
+    summary = run_stats.summary()
+    assert summary['instructions'] == 32
+    assert summary['mnemonics'] == {'add': 10, 'addi': 11, 'bne': 10, 'ebreak': 1}
+    assert summary['formats'] == {'I': 11, 'R': 10, 'B': 10, 'E': 1}
+    # one cycle in 4 is timed, and every distinct instruction is decoded once
+    assert summary['phases']['samples'] == 8
+    assert summary['decode']['count'] == 5
+    # measuring does not change what the run does
+    assert out.getvalue() == text_log(count_down(10))
+
+def test_other_engines_report_totals():
+    sim = machine(count_down(10))
+    run_stats = stats.Stats()
+    run_stats.attach(sim)
+    sim.simulate_blocks()
+    summary = run_stats.summary()
+    assert summary['instructions'] == 32 and summary['decode']['count'] == 5
+    assert 'mnemonics' not in summary and 'phases' not in summary
+
+def test_resumed_runs_count_from_the_checkpoint():
+    first = machine(count_down(10))
+    first.simulate(20)
+    resumed = machine(count_down(10))
+    resumed.restore(checkpoint.capture(first.register_bank, first.memory, first.clock))
+    run_stats = stats.Stats(1)
+    run_stats.attach(resumed)
+    resumed.simulate(resume=True)
+    summary = run_stats.summary()
+    assert summary['instructions'] == 12
+    assert sum(summary['mnemonics'].values()) == 12 and summary['phases']['samples'] == 12
+
+def test_progress_reports():
+    out = io.StringIO()
+    sim = machine(count_down(10))
+    sim.every('progress', 10, stats.Progress('count', out))
+    sim.simulate()
+    lines = out.getvalue().splitlines()
+    assert [line.split(',')[0] for line in lines] == \
+        ['count: 10 instructions', 'count: 20 instructions', 'count: 30 instructions']
+
+def test_host_profile(tmp_path):
+    path = str(tmp_path / 'count.pstats')
+    with stats.host_profile(path):
+        machine(count_down(10)).simulate()
+    assert os.path.getsize(path)
+    with stats.host_profile(None):
+        pass
@@ -0,0 +1,76 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import sweep
+import tracing
+from programs import CODE, DATA, E, EBREAK, machine
+
+# a1 = n + (n - 1) + ... + 1, for the n stored at DATA
+SUM_OF = [E('lui', 12, imm=DATA), E('lw', 10, 12, imm=0), E('add', 11, 11, 10), E('addi', 10, 10, imm=-1),
+          E('bne', rs1=10, rs2=0, imm=-8), EBREAK]
+
+def variant(n: int) -> list[tuple[int, bytes]]:
+    return [(DATA, n.to_bytes(4, 'little'))]
+
+def prepared():
+    sim = machine(SUM_OF)
+    sim.memory.store_word(DATA, 3)
+    sim.reset()
+    assert sim.run_until(CODE + 4)
+    return sim
+
+def test_fork_is_isolated():
+    parent = prepared()
+    child = parent.fork()
+    child.memory.store_word(DATA, 10)
+    child.register_bank.regs[11] = 100
+    child.simulate(resume=True)
+    assert child.register_bank.regs[11] == 155
+    assert parent.memory.load_word(DATA) == 3 and parent.register_bank.regs[11] == 0
+    assert parent.clock == 1 and not parent.finished
+    parent.simulate(resume=True)
+    assert parent.register_bank.regs[11] == 6
+    assert child.memory.load_word(DATA) == 10
+
+def test_fork_has_its_own_trace():
+    parent = prepared()
+    parent_log, child_log = io.StringIO(), io.StringIO()
+    parent.trace = tracing.TextTrace(parent_log)
+    child = parent.fork(tracing.TextTrace(child_log))
+    child.simulate(resume=True)
+    assert parent_log.getvalue() == ''
+    assert child_log.getvalue().startswith(f'PC={CODE + 4:08x}')
+    assert child.clock == 12
+
+def test_fork_reuses_the_compiled_blocks():
+    parent = prepared()
+    parent.simulate_blocks(resume=True)
+    code = parent.export_code()
+    assert code['blocks']
+    child = parent.fork()
+    child.memory.store_word(DATA, 4)
+    child.register_bank.regs[11] = 0
+    child.register_bank.pc = CODE + 4
+    child.simulate_blocks(resume=True)
+    assert child.register_bank.regs[11] == 10
+    assert child.export_code()['blocks'].keys() == code['blocks'].keys()
+
+@pytest.mark.parametrize('engine, workers', [('interpreter', 1), ('block', 1), ('fused', 1), ('interpreter', 2)])
+def test_sweep(engine, workers):
+    results = sweep.run(prepared(), [variant(n) for n in range(1, 6)], workers, engine=engine)
+    assert [result['status'] for result in results] == ['ok'] * 5
+    assert [result['registers'][11] for result in results] == [1, 3, 6, 10, 15]
+    assert [result['instructions'] for result in results] == [3 * n + 2 for n in range(1, 6)]
+
+def test_sweep_budget():
+    # n = 0 counts down through every 32-bit value
+    results = sweep.run(prepared(), [variant(0), variant(2)], max_instructions=100)
+    assert [(result['status'], result['instructions']) for result in results] == [('budget', 100), ('ok', 8)]
+
+def test_parse_values():
+    assert sweep.parse_values('1,4..6,0x10') == [1, 4, 5, 6, 16]
@@ -0,0 +1,104 @@
+import gzip
+import io
+import json
+import lzma
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import hle
+import tracing
+from programs import CODE, DATA, E, EBREAK, count_down, machine
+
+def text_log(words: list[int]) -> str:
+    out = io.StringIO()
+    machine(words, tracing.TextTrace(out)).simulate()
+    return out.getvalue()
+
+def binary_trace(words: list[int], index_interval: int = tracing.DEFAULT_INDEX_INTERVAL) -> io.BytesIO:
+    out = io.BytesIO()
+    machine(words, tracing.BinaryTrace(out, index_interval)).simulate()
+    out.seek(0)
+    return out
+
+def test_binary_trace_renders_the_text_log():
+    words = count_down(20)
+    reader = tracing.TraceReader(binary_trace(words))
+    out = io.StringIO()
+    tracing.render(reader, out)
+    assert reader.count == 62
+    assert out.getvalue() == text_log(words)
+
+def test_render_a_range_through_the_index():
+    words = count_down(20)
+    lines = text_log(words).splitlines(keepends=True)
+    reader = tracing.TraceReader(binary_trace(words, index_interval=8))
+    assert [n for n, _, _ in reader.index] == list(range(0, 62, 8))
+    for start, stop in ((0, 5), (17, 40), (56, None), (60, 100)):
+        out = io.StringIO()
+        tracing.render(reader, out, start, stop)
+        assert out.getvalue() == ''.join(lines[start:stop])
+
+def test_host_calls_are_rendered_from_the_op_table():
+    # strlen at CODE + 12 runs on the host
+    words = [E('lui', 10, imm=DATA), E('jal', 1, imm=8), EBREAK, E('addi', 10, 0, imm=-1)]
+    text, binary = io.StringIO(), io.BytesIO()
+    for trace in (tracing.TextTrace(text), tracing.BinaryTrace(binary)):
+        sim = machine(words, trace)
+        sim.memory.write(DATA, b'hello\0')
+        hle.intercept(sim.decoder, {'strlen': CODE + 12})
+        sim.simulate()
+        assert sim.register_bank.regs[10] == 5
+    binary.seek(0)
+    reader = tracing.TraceReader(binary)
+    assert [op.name for op in reader.ops] == ['hle']
+    out = io.StringIO()
+    tracing.render(reader, out)
+    assert out.getvalue() == text.getvalue()
+
+def summary(words: list[int], engine: str = 'interpreter') -> dict:
+    out = io.StringIO()
+    sim = machine(words, tracing.SummaryTrace(out))
+    sim.simulate_blocks() if engine == 'block' else sim.simulate()
+    return json.loads(out.getvalue())
+
+def test_summary_hash():
+    words = count_down(20)
+    result = summary(words)
+    assert result['instructions'] == 62
+    assert result['registers']['x11'] == f'{sum(range(21)):08x}'
+    assert summary(words, 'block') == result
+    # one different rd value changes the hash
+    changed = summary(words[:1] + [E('add', 11, 11, 10), E('addi', 10, 10, imm=-2)] + words[3:])
+    assert changed['trace_hash'] != result['trace_hash']
+
+@pytest.mark.parametrize('compression', tracing.TRACE_COMPRESSIONS)
+def test_background_writer(tmp_path, compression):
+    words = count_down(50)
+    path = str(tmp_path / ('count.log' + tracing.COMPRESSION_SUFFIXES[compression]))
+    # a small buffer hands many chunks to the writer thread
+    writer = tracing.BackgroundWriter(path, compression, 256)
+    machine(words, tracing.TextTrace(writer)).simulate()
+    writer.close()
+    opener = {'none': open, 'gzip': gzip.open, 'lzma': lzma.open}[compression]
+    with opener(path, 'rt') as f:
+        assert f.read() == text_log(words)
+
+def test_open_trace_compresses_in_the_background(tmp_path):
+    trace, file = tracing.open_trace(str(tmp_path / 'count'), 'full', 'text', compression='lzma')
+    assert isinstance(file, tracing.BackgroundWriter)
+    machine(count_down(5), trace).simulate()
+    file.close()
+    with lzma.open(tmp_path / 'count.log.xz', 'rt') as f:
+        assert f.read() == text_log(count_down(5))
+
+@pytest.mark.skipif(not os.path.exists('/dev/full'), reason='needs /dev/full')
+def test_background_writer_errors_reach_the_simulator():
+    writer = tracing.BackgroundWriter('/dev/full', 'none', 16)
+    with pytest.raises(Exception, match='Trace writer failed'):
+        for _ in range(1000):
+            writer.write('x' * 1000)
+        writer.close()
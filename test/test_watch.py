@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from memory import PAGE_SIZE, Memory
+from programs import CODE, DATA, E, EBREAK, machine
+
+# stores a0 = 3, 2, 1 to DATA + 4 * a0 and loads each word back
+def store_loop() -> list[int]:
+    return [E('addi', 10, 0, imm=3), E('lui', 12, imm=DATA), E('slli', 13, 10, imm=2), E('add', 13, 13, 12),
+            E('sw', rs1=13, rs2=10, imm=0), E('lw', 14, 13, imm=0), E('addi', 10, 10, imm=-1),
+            E('bne', rs1=10, rs2=0, imm=-20), EBREAK]
+
+def test_reads_and_writes():
+    memory = Memory()
+    reads = memory.watch(0x1000, 0x1004, 'r')
+    writes = memory.watch(0x1002, 0x1003, 'w')
+    memory.store_word(0x1000, 0x11223344)
+    memory.store_byte(0x1003, 0x55)
+    memory.store_half(0x0ffe, 0x6677)
+    assert memory.load_half(0x1002) == 0x5522
+    memory.load_byte(0x1004)
+    assert [str(access) for access in writes.events] == ['PC=???????? w 00001000 [4] 11223344']
+    assert [str(access) for access in reads.events] == ['PC=???????? r 00001002 [2] 5522']
+
+def test_accesses_across_a_page_boundary():
+    memory = Memory()
+    watchpoint = memory.watch(PAGE_SIZE, PAGE_SIZE + 1, 'rw')
+    memory.store_word(PAGE_SIZE - 2, 0xaabbccdd)
+    memory.load_half(PAGE_SIZE - 1)
+    assert [(a.kind, a.address, a.value) for a in watchpoint.events] == \
+        [('w', PAGE_SIZE - 2, 0xaabbccdd), ('r', PAGE_SIZE - 1, 0xbbcc)]
+
+def test_unwatch_restores_the_accessors():
+    memory = Memory()
+    assert 'store_word' not in memory.__dict__
+    first = memory.watch(0x1000, 0x1004, 'w')
+    second = memory.watch(0x2000, 0x2004, 'rw')
+    assert 'store_word' in memory.__dict__ and 'load_word' in memory.__dict__
+    memory.unwatch(second)
+    assert 'load_word' not in memory.__dict__ and 'store_word' in memory.__dict__
+    memory.unwatch(first)
+    assert not any(name in memory.__dict__ for name in ('load_byte', 'load_word', 'store_byte', 'store_word'))
+    assert not memory.watching()
+    memory.store_word(0x1000, 1)
+    assert first.events == []
+
+def test_invalid_watches():
+    memory = Memory()
+    with pytest.raises(Exception, match='Invalid watch kinds'):
+        memory.watch(0x1000, 0x1004, 'wz')
+    with pytest.raises(Exception, match='Empty watch range'):
+        memory.watch(0x1000, 0x1000)
+
+@pytest.mark.parametrize('engine', ['interpreter', 'block', 'fused'])
+def test_accesses_carry_the_pc(engine):
+    sim = machine(store_loop())
+    data = sim.memory.watch(DATA + 4, DATA + 12, 'rw')
+    code = sim.memory.watch(CODE + 16, CODE + 20, 'x')
+    {'interpreter': sim.simulate, 'block': sim.simulate_blocks, 'fused': sim.simulate_fused}[engine]()
+    # the word at DATA + 12 is outside the range
+    assert [str(access) for access in data.events] == [
+        f'PC={CODE + 16:08x} w {DATA + 8:08x} [4] 00000002',
+        f'PC={CODE + 20:08x} r {DATA + 8:08x} [4] 00000002',
+        f'PC={CODE + 16:08x} w {DATA + 4:08x} [4] 00000001',
+        f'PC={CODE + 20:08x} r {DATA + 4:08x} [4] 00000001',
+    ]
+    assert [(a.kind, a.pc) for a in code.events] == [('x', CODE + 16)] * 3
+
+def test_watch_added_after_blocks_were_translated():
+    sim = machine(store_loop())
+    sim.simulate_blocks(8)
+    watchpoint = sim.memory.watch(DATA, DATA + 16, 'w')
+    sim.simulate_blocks(resume=True)
+    assert [(a.address, a.value) for a in watchpoint.events] == [(DATA + 8, 2), (DATA + 4, 1)]
+    sim.memory.unwatch(watchpoint)
+    sim.register_bank.pc = CODE
+    sim.simulate_blocks(resume=True)
+    assert len(watchpoint.events) == 2